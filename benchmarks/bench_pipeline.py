@@ -0,0 +1,215 @@
+"""Throughput benchmarks of the demux and caption pipeline.
+
+A large TS file is synthesized by looping tests/sample/sample.ts, or generated with tests/tsgen.py,
+and every stage is timed on it:
+
+- packet_parse: TS packet and PSI parsing only
+- pes_reassembly: packets reassembled into PES of the audio/video PIDs
+- caption_extraction: full extract_scc, including user data / SEI parsing and CEA-608 decoding
+- cea608_decode: decoding the extracted byte pairs with Cea608FieldProcessor
+- scc_render: rendering the extracted captions as SCC
+- srt_write, vtt_write: decoding the extracted captions and streaming them as SRT or VTT cues
+
+Usage:
+    python benchmarks/bench_pipeline.py --size-mb 100 --json results.json
+    python benchmarks/bench_pipeline.py --size-mb 100 --generate h264 --b-frames 2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / 'benchmarks'))
+
+CAPTION_TEXT = 'THE QUICK BROWN FOX'
+
+from sample_loop import TS_PACKET_SIZE, write_looped_ts  # noqa: E402
+
+from tests.tsgen import Program, TsGenerator, pop_on_pairs  # noqa: E402
+from ts_cc_extractor import __version__  # noqa: E402
+from ts_cc_extractor.extractor import extract_scc, set_options  # noqa: E402
+from ts_cc_extractor.media_tools import cea608, ts  # noqa: E402
+from ts_cc_extractor.subtitles import write_cues  # noqa: E402
+
+CHUNK_SIZE = 188 * 100000
+
+
+class PacketObserver(ts.observer):
+    "Observe no PIDs, so only TS packets and PSI are parsed."
+
+    def __init__(self, options):
+        pass
+
+
+class PesOnlyObserver(ts.parser_observer):
+    "Observe the same PIDs as the extraction, but drop the reassembled PES."
+
+    def on_pes(self, pid, pes):
+        pass
+
+
+def write_generated_ts(f, min_size: int, codec: str, b_frames: int, stuffing_ratio: float) -> None:
+    "Write a generated stream with a caption repeated in both fields."
+    caption_format = 'SCTE20' if codec == 'scte20' else 'ATSC'
+    pairs = pop_on_pairs(CAPTION_TEXT) * 10000
+    program = Program(codec='mpeg2' if codec == 'scte20' else codec, caption_format=caption_format,
+                      field1=pairs, field2=pairs)
+    generator = TsGenerator([program], b_frames=b_frames, stuffing_ratio=stuffing_ratio)
+    generator.write(f, min_size=min_size)
+
+
+def run_importer(path: pathlib.Path, observer_class: type) -> None:
+    options = set_options({'show_progress': False})
+    importer = ts.ts_importer(observer_class(options), options)
+    with path.open('rb') as f:
+        data = f.read(CHUNK_SIZE)
+        while data:
+            importer.add_data(data)
+            data = f.read(CHUNK_SIZE)
+    importer.flush()
+
+
+def decode_pairs(cc_files: list) -> None:
+    for cc_file in cc_files:
+        processor = cea608.Cea608FieldProcessor(cc_file['channel'])
+        pairs = cc_file['pairs']
+        pts = cc_file['pts']
+        start = 0
+        for end in cc_file.line_ends:
+            line = pairs[start:end]
+            if cea608.SWAP_CODES:
+                line.byteswap()
+            processor.add_pairs(line.tobytes(), pts[start])
+            start = end
+
+
+def write_subtitles(cc_files: list, fmt: str) -> None:
+    with open(os.devnull, 'w') as f:
+        for cc_file in cc_files:
+            write_cues(cc_file, f, fmt)
+
+
+def measure(func: Callable[[], Any], repeat: int, memory: bool) -> dict[str, float]:
+    "Best time of repeat runs, and the peak of traced memory in an extra run."
+    seconds = min(timed(func) for _ in range(repeat))
+    result = {'seconds': seconds}
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            result['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def timed(func: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def rates(result: dict[str, float], num_bytes: int, num_items: int, item_name: str) -> dict[str, float]:
+    seconds = result['seconds'] or 1e-9
+    return {
+        **result,
+        'mb_per_s': num_bytes / seconds / 1e6,
+        '%s_per_s' % item_name: num_items / seconds,
+    }
+
+
+def run_benchmarks(path: pathlib.Path, repeat: int = 1, memory: bool = True) -> dict[str, Any]:
+    ts_bytes = path.stat().st_size
+    ts_packets = ts_bytes // TS_PACKET_SIZE
+
+    def extract():
+        with path.open('rb') as f:
+            return extract_scc(f, show_progress=False)
+
+    cc_files = extract()
+    pair_count = sum(len(cc_file['pairs']) for cc_file in cc_files)
+    line_count = sum(len(cc_file.line_ends) for cc_file in cc_files)
+
+    def render():
+        for cc_file in cc_files:
+            cc_file.render()
+
+    stages = {
+        'packet_parse': rates(measure(lambda: run_importer(path, PacketObserver), repeat, memory),
+                              ts_bytes, ts_packets, 'packets'),
+        'pes_reassembly': rates(measure(lambda: run_importer(path, PesOnlyObserver), repeat, memory),
+                                ts_bytes, ts_packets, 'packets'),
+        'caption_extraction': rates(measure(extract, repeat, memory), ts_bytes, ts_packets, 'packets'),
+        'cea608_decode': rates(measure(lambda: decode_pairs(cc_files), repeat, memory),
+                               2 * pair_count, pair_count, 'pairs'),
+        'scc_render': rates(measure(render, repeat, memory), 2 * pair_count, line_count, 'lines'),
+    }
+    for name, fmt in (('srt_write', 'SRT'), ('vtt_write', 'VTT')):
+        stages[name] = rates(measure(lambda: write_subtitles(cc_files, fmt), repeat, memory),
+                             2 * pair_count, line_count, 'lines')
+
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'input': {'bytes': ts_bytes, 'packets': ts_packets, 'pairs': pair_count, 'lines': line_count},
+        'stages': stages,
+    }
+
+
+def print_results(results: dict[str, Any]) -> None:
+    print('Input: %(bytes)d bytes, %(packets)d packets, %(pairs)d byte pairs' % results['input'])
+    for name, result in results['stages'].items():
+        line = '%-20s %8.3f s %9.2f MB/s' % (name, result['seconds'], result['mb_per_s'])
+        for key, value in result.items():
+            if key.endswith('_per_s') and key != 'mb_per_s':
+                line += ' %12.0f %s' % (value, key.replace('_per_s', '/s'))
+        if 'peak_memory_bytes' in result:
+            line += ' %9.1f MB peak' % (result['peak_memory_bytes'] / 1e6)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the TS caption pipeline')
+    parser.add_argument('--size-mb', type=float, default=10, help='Size of the synthesized TS input')
+    parser.add_argument('--input', type=pathlib.Path, help='Use this TS file instead of a synthesized one')
+    parser.add_argument('--generate', choices=['h264', 'hevc', 'mpeg2', 'scte20'],
+                        help='Generate a stream with captions in every frame, instead of looping the sample')
+    parser.add_argument('--b-frames', type=int, default=2, help='B-frames of the generated stream')
+    parser.add_argument('--stuffing-ratio', type=float, default=0.0,
+                        help='Fraction of null packets in the generated stream')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of timed runs, best is reported')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the peak memory runs')
+    parser.add_argument('--json', type=pathlib.Path, help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.input
+        if path is None:
+            path = pathlib.Path(tmp_dir) / 'looped.ts'
+            with path.open('wb') as f:
+                if args.generate:
+                    write_generated_ts(f, int(args.size_mb * 1e6), args.generate, args.b_frames,
+                                       args.stuffing_ratio)
+                else:
+                    write_looped_ts(f, int(args.size_mb * 1e6))
+        results = run_benchmarks(path, repeat=args.repeat, memory=not args.no_memory)
+
+    print_results(results)
+    if args.json:
+        with args.json.open('w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
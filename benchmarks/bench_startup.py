@@ -0,0 +1,106 @@
+"""Startup time of the package and the CLI.
+
+Every command is run in a new interpreter, and the best wall time of the runs is reported, with the
+time of python itself as a baseline. A run with -X importtime tells which of the heavy modules are
+imported: the TS parsers are only needed when captions are extracted.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 20 --json results.json
+    python benchmarks/bench_startup.py --check
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+ROOT_DIR = pathlib.Path(__file__).parent.parent
+SAMPLE_TS = ROOT_DIR / 'tests' / 'sample' / 'sample.ts'
+
+HEAVY_MODULES = ('ts_cc_extractor.media_tools.ts', 'ts_cc_extractor.subtitles')
+# Commands that must not import the heavy modules
+LIGHT_COMMANDS = ('import', 'version', 'help')
+
+
+def commands(out_path: pathlib.Path) -> dict[str, list[str]]:
+    return {
+        'python': ['-c', 'pass'],
+        'import': ['-c', 'import ts_cc_extractor'],
+        'version': ['-m', 'ts_cc_extractor', '--version'],
+        'help': ['-m', 'ts_cc_extractor', '--help'],
+        'extract_srt': ['-m', 'ts_cc_extractor', '-i', str(SAMPLE_TS), '-o', str(out_path)],
+    }
+
+
+def run(args: list[str], importtime: bool = False) -> subprocess.CompletedProcess:
+    options = ['-X', 'importtime'] if importtime else []
+    return subprocess.run([sys.executable, *options, *args], cwd=ROOT_DIR, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+def imported_modules(args: list[str]) -> dict[str, int]:
+    "Cumulative import time in microseconds of every module imported by the command."
+    modules = {}
+    for line in run(args, importtime=True).stderr.splitlines():
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def measure(args: list[str], repeat: int) -> dict[str, Any]:
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(args)
+        seconds.append(time.perf_counter() - start)
+    modules = imported_modules(args)
+    return {
+        'seconds': min(seconds),
+        'package_import_seconds': modules.get('ts_cc_extractor', 0) / 1e6,
+        'heavy_modules': [name for name in HEAVY_MODULES if name in modules],
+    }
+
+
+def run_benchmarks(repeat: int = 10) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results = {name: measure(args, repeat)
+                   for name, args in commands(pathlib.Path(tmp_dir) / 'out.srt').items()}
+    return {'python': sys.version.split()[0], 'commands': results}
+
+
+def print_results(results: dict[str, Any]) -> None:
+    for name, result in results['commands'].items():
+        print('%-12s %8.1f ms  package import %7.1f ms  %s' % (
+            name, result['seconds'] * 1e3, result['package_import_seconds'] * 1e3,
+            ', '.join(result['heavy_modules'])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup of the package and the CLI')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of timed runs, best is reported')
+    parser.add_argument('--check', action='store_true',
+                        help='Fail if --version, --help or the package import load %s'
+                             % ', '.join(HEAVY_MODULES))
+    parser.add_argument('--json', type=pathlib.Path, help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run_benchmarks(repeat=args.repeat)
+    print_results(results)
+    if args.json:
+        with args.json.open('w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.check:
+        slow = [name for name in LIGHT_COMMANDS if results['commands'][name]['heavy_modules']]
+        if slow:
+            sys.exit('Heavy modules imported by: %s' % ', '.join(slow))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Build large TS inputs by looping a sample file.
+
+Each loop is shifted in time: PTS/DTS of PES headers and PCR of adaptation fields are moved by the
+sample duration, and continuity counters keep counting, so the result demuxes like one long stream.
+"""
+from __future__ import annotations
+
+import pathlib
+from typing import IO, Iterator
+
+TS_PACKET_SIZE = 188
+SAMPLE_TS = pathlib.Path(__file__).parent.parent / 'tests' / 'sample' / 'sample.ts'
+
+PTS_MASK = (1 << 33) - 1
+# Stream ids of PES packets without the optional PES header
+PES_NO_HEADER_IDS = {0xBC, 0xBE, 0xBF, 0xF0, 0xF1, 0xF2, 0xF8, 0xFF}
+
+
+def decode_timestamp(data: bytes, offset: int) -> int:
+    return (((data[offset] >> 1) & 0x07) << 30 | data[offset + 1] << 22 | (data[offset + 2] >> 1) << 15
+            | data[offset + 3] << 7 | data[offset + 4] >> 1)
+
+
+def encode_timestamp(data: bytearray, offset: int, value: int) -> None:
+    # Keep the 4 bit prefix ('0010', '0011' or '0001') and the marker bits
+    data[offset] = (data[offset] & 0xF1) | ((value >> 29) & 0x0E)
+    data[offset + 1] = (value >> 22) & 0xFF
+    data[offset + 2] = ((value >> 14) & 0xFE) | 0x01
+    data[offset + 3] = (value >> 7) & 0xFF
+    data[offset + 4] = ((value << 1) & 0xFE) | 0x01
+
+
+class SampleLoop:
+    """Time-shiftable copy of a TS sample.
+
+    The offsets of all timestamps and continuity counters are found once, so every loop
+    only patches those bytes in a copy of the sample."""
+
+    def __init__(self, data: bytes):
+        self.data = data[:len(data) - len(data) % TS_PACKET_SIZE]
+        self.timestamps: list[tuple[int, int]] = []  # (offset, value)
+        self.pcrs: list[tuple[int, int]] = []  # (offset, PCR base)
+        self.counters: list[tuple[int, int]] = []  # (offset, pid)
+        self.payload_packets: dict[int, int] = {}
+        self.scan()
+        self.duration = self.calc_duration()
+
+    def scan(self) -> None:
+        data = self.data
+        for offset in range(0, len(data), TS_PACKET_SIZE):
+            pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+            if pid == 0x1FFF:
+                continue
+            adaptation_field_control = (data[offset + 3] >> 4) & 0x03
+            payload_offset = offset + 4
+            if adaptation_field_control & 0x02:
+                adaptation_field_length = data[offset + 4]
+                if adaptation_field_length and data[offset + 5] & 0x10:
+                    self.pcrs.append((offset + 6, decode_pcr_base(data, offset + 6)))
+                payload_offset += 1 + adaptation_field_length
+            if adaptation_field_control & 0x01:
+                self.counters.append((offset + 3, pid))
+                self.payload_packets[pid] = self.payload_packets.get(pid, 0) + 1
+                if data[offset + 1] & 0x40:
+                    self.scan_pes_header(payload_offset)
+
+    def scan_pes_header(self, offset: int) -> None:
+        data = self.data
+        if data[offset:offset + 3] != b'\x00\x00\x01' or data[offset + 3] in PES_NO_HEADER_IDS:
+            return
+        pts_dts_flags = data[offset + 7] >> 6
+        if pts_dts_flags & 0x02:
+            self.timestamps.append((offset + 9, decode_timestamp(data, offset + 9)))
+        if pts_dts_flags == 0x03:
+            self.timestamps.append((offset + 14, decode_timestamp(data, offset + 14)))
+
+    def calc_duration(self) -> int:
+        "Duration of the sample in 90 kHz units, including the average frame duration."
+        values = sorted(value for _, value in self.timestamps)
+        if len(values) < 2:
+            return 0
+        span = values[-1] - values[0]
+        return span + span // (len(values) - 1)
+
+    def loop(self, index: int) -> bytes:
+        "Return copy number index of the sample, shifted by index times the duration."
+        if index == 0:
+            return self.data
+        data = bytearray(self.data)
+        shift = index * self.duration
+        for offset, value in self.timestamps:
+            encode_timestamp(data, offset, (value + shift) & PTS_MASK)
+        for offset, base in self.pcrs:
+            encode_pcr_base(data, offset, (base + shift) & PTS_MASK)
+        counter_shifts = {pid: index * count for pid, count in self.payload_packets.items()}
+        for offset, pid in self.counters:
+            data[offset] = (data[offset] & 0xF0) | ((data[offset] + counter_shifts[pid]) & 0x0F)
+        return bytes(data)
+
+    def loops(self, count: int) -> Iterator[bytes]:
+        for index in range(count):
+            yield self.loop(index)
+
+
+def decode_pcr_base(data: bytes, offset: int) -> int:
+    return (data[offset] << 25 | data[offset + 1] << 17 | data[offset + 2] << 9 | data[offset + 3] << 1
+            | data[offset + 4] >> 7)
+
+
+def encode_pcr_base(data: bytearray, offset: int, base: int) -> None:
+    data[offset] = (base >> 25) & 0xFF
+    data[offset + 1] = (base >> 17) & 0xFF
+    data[offset + 2] = (base >> 9) & 0xFF
+    data[offset + 3] = (base >> 1) & 0xFF
+    data[offset + 4] = (data[offset + 4] & 0x7F) | ((base & 0x01) << 7)
+
+
+def write_looped_ts(f: IO[bytes], min_size: int, sample: pathlib.Path = SAMPLE_TS) -> int:
+    """Write the sample looped until at least min_size bytes are written.
+
+    Returns:
+        Number of loops written.
+    """
+    sample_loop = SampleLoop(sample.read_bytes())
+    count = max(1, -(-min_size // len(sample_loop.data)))
+    for data in sample_loop.loops(count):
+        f.write(data)
+    return count
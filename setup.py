@@ -31,14 +31,13 @@ if __name__ == '__main__':
         python_requires='>=3.7',
         keywords='ts extract convert eia-608 srt vtt subtitles captions',
         url='https://github.com/interlark/ts-cc-extractor',
-        install_requires=[
-            'pycaption>=2.0.9',
-        ],
         extras_require={
             'dev': [
+                'pycaption>=2.0.9',
                 'wheel>=0.36.2,<0.38',
                 'tox>=3.5,<4',
                 'pytest>=6.2,<8',
+                'numpy>=1.17',
                 'typing-extensions>=4.0.0;python_version<"3.8"',
             ],
         },
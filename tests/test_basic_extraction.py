@@ -1,9 +1,13 @@
 import pathlib
+import subprocess
+import sys
 
 import pytest
 from pycaption import SRTReader, WebVTTReader
 from pycaption.base import BaseReader
 from ts_cc_extractor import extract_subtitles
+from ts_cc_extractor.extractor import set_options
+from ts_cc_extractor.media_tools.ts import handle_file
 
 
 SAMPLE_DIR = pathlib.Path(__file__).parent / 'sample'
@@ -27,6 +31,7 @@ def check_subtitles(subs_content: str, sample_file: pathlib.Path, reader: BaseRe
             assert cue_test.start == cue_sample.start
             assert cue_test.end == cue_sample.end
             assert cue_test.style == cue_sample.style
+            assert cue_test.layout_info == cue_sample.layout_info
             assert len(cue_test.nodes) == len(cue_sample.nodes)
             for node_test, node_sample in zip(cue_test.nodes, cue_sample.nodes):
                 assert node_test.type_ == node_sample.type_
@@ -39,3 +44,47 @@ def test_basic_extraction(fmt, sample_file, reader):
     with open(VIDEO_SAMPLE, 'rb') as f:
         subs_content = extract_subtitles(f, fmt=fmt)
         check_subtitles(subs_content, sample_file, reader)
+
+
+def test_progress_covers_whole_file():
+    progress = []
+    with open(VIDEO_SAMPLE, 'rb') as f:
+        handle_file(f, lambda current, total: progress.append((current, total)), [], **set_options({}))
+
+    size = VIDEO_SAMPLE.stat().st_size
+    assert len(progress) > 1
+    assert progress[-1] == (size, size)
+    assert [current for current, _ in progress] == sorted(current for current, _ in progress)
+
+
+def test_lazy_imports():
+    # --version and --help must not pay for the subtitle writers and the TS parsers
+    code = ('import sys; sys.argv = ["ts-cc-extractor", "--version"]\n'
+            'from ts_cc_extractor.__main__ import main\n'
+            'try:\n'
+            '    main()\n'
+            'except SystemExit:\n'
+            '    print("ts_cc_extractor.subtitles" in sys.modules,\n'
+            '          "ts_cc_extractor.media_tools.ts" in sys.modules)\n')
+    result = subprocess.run([sys.executable, '-c', code], cwd=pathlib.Path(__file__).parent.parent,
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout.endswith('False False\n')
+
+
+def test_lazy_scc_import():
+    # The cache, imported with the extractor, only needs the SCC files when it reads an entry
+    code = ('import sys\n'
+            'import ts_cc_extractor.extractor, ts_cc_extractor.sidecar\n'
+            'print("ts_cc_extractor.media_tools.scc" in sys.modules,\n'
+            '      "ts_cc_extractor.media_tools.cea608" in sys.modules)\n')
+    result = subprocess.run([sys.executable, '-c', code], cwd=pathlib.Path(__file__).parent.parent,
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert result.stdout == 'False False\n'
+
+
+def test_verbose_statistics(tmp_path):
+    result = subprocess.run([sys.executable, '-m', 'ts_cc_extractor', '-i', str(VIDEO_SAMPLE),
+                             '-o', str(tmp_path / 'out.srt'), '--verbose'],
+                            cwd=pathlib.Path(__file__).parent.parent,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    assert 'Total bitrate:' in result.stderr
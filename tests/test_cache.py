@@ -0,0 +1,81 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ts_cc_extractor import extract_subtitles
+from ts_cc_extractor.cache import ResultCache, cache_key, fingerprint
+from ts_cc_extractor.extractor import Metrics, extract_scc
+from tests.tsgen import Program, TsGenerator, pop_on_pairs
+
+
+def generate_ts(text: str) -> bytes:
+    program = Program(codec='h264', field1=pop_on_pairs(text), field2=pop_on_pairs('SECOND FIELD'))
+    return b''.join(TsGenerator([program], bitrate=1000000).packets(60))
+
+
+def test_cached_extraction(tmp_path):
+    ts_data = generate_ts('HELLO WORLD')
+    expected = extract_scc(ts_data, show_progress=False)
+
+    first = extract_scc(ts_data, show_progress=False, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+
+    metrics = Metrics()
+    cached = extract_scc(ts_data, show_progress=False, cache_dir=str(tmp_path), metrics=metrics)
+    assert 'packet_parse' not in metrics.stage_times
+    for files in (first, cached):
+        assert [(f['name'], f['channel'], f['content']) for f in files] == \
+            [(f['name'], f['channel'], f['content']) for f in expected]
+        assert [f['pts'] for f in files] == [f['pts'] for f in expected]
+
+    srt = extract_subtitles(ts_data, show_progress=False, cache_dir=str(tmp_path))
+    assert srt == '1\n00:00:00,400 --> 00:00:04,400\nHELLO WORLD\n'
+
+
+def test_cached_frame_rate(tmp_path):
+    ts_data = generate_ts('HELLO WORLD')
+    expected = extract_scc(ts_data, show_progress=False, scc_frame_rate='25')
+    assert expected[0]['content'] != extract_scc(ts_data, show_progress=False)[0]['content']
+
+    # The frame rate does not change the cached data, so the entry of the first extraction is used
+    extract_scc(ts_data, show_progress=False, cache_dir=str(tmp_path))
+    cached = extract_scc(ts_data, show_progress=False, cache_dir=str(tmp_path), scc_frame_rate='25')
+    assert [f.frame_rate for f in cached] == ['25'] * len(expected)
+    assert [f['content'] for f in cached] == [f['content'] for f in expected]
+
+
+def test_cache_key():
+    ts_data = generate_ts('HELLO WORLD')
+    file_fingerprint = fingerprint(io.BytesIO(ts_data))
+    assert file_fingerprint == fingerprint(io.BytesIO(ts_data))
+    assert file_fingerprint != fingerprint(io.BytesIO(generate_ts('OTHER TEXT')))
+    assert cache_key(file_fingerprint, {'start': None}) != cache_key(file_fingerprint, {'start': 10})
+    assert cache_key(file_fingerprint, {'verbose': 0}) == cache_key(file_fingerprint, {'verbose': 3})
+
+
+def test_lru_eviction(tmp_path):
+    cc_files = extract_scc(generate_ts('HELLO WORLD'), show_progress=False)
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 9)
+    cache.put('a', cc_files)
+    entry_size = os.path.getsize(cache.path('a'))
+    cache.max_bytes = 2 * entry_size
+    cache.put('b', cc_files)
+    os.utime(cache.path('a'), ns=(0, 0))
+    os.utime(cache.path('b'), ns=(1, 1))
+    assert cache.get('a') is not None  # Most recently used now
+
+    cache.put('c', cc_files)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['a.cc', 'c.cc']
+
+
+def test_concurrent_puts(tmp_path, caplog):
+    cc_files = extract_scc(generate_ts('HELLO WORLD'), show_progress=False)
+    cache = ResultCache(str(tmp_path))
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: cache.put('key', cc_files), range(64)))
+
+    assert not caplog.records
+    assert [path.name for path in tmp_path.iterdir()] == ['key.cc']
+    cached = cache.get('key')
+    assert cached is not None
+    assert [f['content'] for f in cached] == [f['content'] for f in cc_files]
@@ -0,0 +1,96 @@
+import io
+import struct
+import zipfile
+from array import array
+
+import pytest
+from ts_cc_extractor.extractor import extract_scc, extract_subtitles_to
+from ts_cc_extractor.sidecar import read_npz, write_npz
+from tests.tsgen import Program, TsGenerator, pop_on_pairs
+
+
+def generate_ts() -> bytes:
+    program = Program(codec='h264', field1=pop_on_pairs('HELLO WORLD'), field2=pop_on_pairs('SECOND FIELD'))
+    return b''.join(TsGenerator([program], bitrate=1000000).packets(60))
+
+
+def summary(cc_files):
+    return [(cc_file['name'], cc_file['channel'], cc_file['pts_offset'], cc_file['content'])
+            for cc_file in cc_files]
+
+
+def test_sidecar_round_trip():
+    cc_files = extract_scc(generate_ts(), show_progress=False)
+    f = io.BytesIO()
+    write_npz(f, cc_files)
+
+    with zipfile.ZipFile(f) as zip_file:
+        assert sorted(zip_file.namelist()) == sorted(name + '.npy' for name in (
+            'pts', 'source', 'channel', 'pairs', 'line_ends', 'source_ends', 'pts_offsets', 'sources'))
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zip_file.infolist())
+
+    f.seek(0)
+    read_files = read_npz(f)
+    assert summary(read_files) == summary(cc_files)
+    assert [cc_file['pts'] for cc_file in read_files] == [cc_file['pts'] for cc_file in cc_files]
+
+    with pytest.raises(ValueError):
+        read_npz(io.BytesIO(b'Scenarist_SCC V1.0'))
+
+
+def test_sidecar_numpy():
+    np = pytest.importorskip('numpy')
+    cc_files = extract_scc(generate_ts(), show_progress=False)
+    f = io.BytesIO()
+    assert extract_subtitles_to(generate_ts(), io.StringIO(), sidecar_file=f, show_progress=False)
+
+    f.seek(0)
+    arrays = np.load(f)
+    assert arrays['pts'].dtype == np.int64
+    assert arrays['channel'].dtype == np.uint8
+    assert arrays['pairs'].dtype == np.uint16
+    assert list(arrays['sources']) == ['EMBEDDED', 'EMBEDDED']
+    for index, cc_file in enumerate(cc_files):
+        selected = arrays['source'] == index
+        assert list(arrays['pairs'][selected]) == list(cc_file['pairs'])
+        assert list(arrays['channel'][selected]) == [cc_file['channel']] * len(cc_file['pairs'])
+
+
+def test_empty_sidecar():
+    f = io.BytesIO()
+    write_npz(f, [])
+    f.seek(0)
+    assert read_npz(f) == []
+
+
+class UnseekableFile(io.RawIOBase):
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def test_sidecar_alignment():
+    cc_files = extract_scc(generate_ts(), show_progress=False)
+    seekable = io.BytesIO()
+    write_npz(seekable, cc_files)
+    unseekable = UnseekableFile()
+    write_npz(unseekable, cc_files)
+
+    for data in (seekable.getvalue(), bytes(unseekable.data)):
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            infos = zip_file.infolist()
+        for info in infos:
+            name_length, extra_length = struct.unpack_from('<HH', data, info.header_offset + 26)
+            npy_offset = info.header_offset + 30 + name_length + extra_length
+            header_length, = struct.unpack_from('<H', data, npy_offset + 8)
+            data_offset = npy_offset + 10 + header_length
+            assert data_offset % 64 == 0
+            if info.filename == 'pairs.npy':
+                pairs = array('H', data[data_offset:data_offset + 2 * len(cc_files[0]['pairs'])])
+                assert pairs == cc_files[0]['pairs']
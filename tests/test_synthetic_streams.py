@@ -0,0 +1,306 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from ts_cc_extractor import extract_subtitles
+from ts_cc_extractor.extractor import (Metrics, convert_scc, extract_programs, extract_scc,
+                                       extract_subtitles_to, probe)
+from ts_cc_extractor.media_tools import ts
+from ts_cc_extractor.media_tools.ts import mpeg_video_parser
+from tests.tsgen import PADDING_PAIR, Program, TsGenerator, crc32_mpeg2, pop_on_pairs
+
+
+@pytest.mark.parametrize('codec, caption_format, b_frames', [
+    ('h264', 'ATSC', 0),
+    ('h264', 'ATSC', 2),
+    ('hevc', 'ATSC', 2),
+    ('mpeg2', 'ATSC', 2),
+    ('mpeg2', 'SCTE20', 2),
+])
+def test_synthetic_stream(codec, caption_format, b_frames):
+    program = Program(codec=codec, caption_format=caption_format,
+                      field1=pop_on_pairs('HELLO WORLD'), field2=pop_on_pairs('SECOND FIELD'))
+    generator = TsGenerator([program], bitrate=1000000, stuffing_ratio=0.1, b_frames=b_frames)
+    ts_data = b''.join(generator.packets(60))
+
+    cc_files = extract_scc(ts_data, show_progress=False)
+    assert [cc_file['channel'] for cc_file in cc_files] == [0, 1]
+    assert cc_files[0]['content'].startswith('Scenarist_SCC V1.0\n\n00:00:00:00 9420\n\n00:00:00:01 9420\n\n')
+
+    srt = extract_subtitles(ts_data, fmt='SRT', show_progress=False)
+    assert srt == '1\n00:00:00,400 --> 00:00:04,400\nHELLO WORLD\n'
+
+
+def test_extraction_metrics():
+    field1 = pop_on_pairs('HELLO WORLD')
+    program = Program(codec='h264', field1=field1)
+    ts_data = b''.join(TsGenerator([program], bitrate=1000000).packets(60))
+
+    metrics = Metrics()
+    extract_scc(ts_data, show_progress=False, metrics=metrics)
+    result = json.loads(metrics.to_json())
+
+    assert result['counters']['packets'] == len(ts_data) // 188
+    assert result['counters']['cc_errors'] == 0
+    assert result['captions'] == {
+        'EMBEDDED-0': {'caption_pairs': len(field1), 'padding_pairs': 60 - len(field1), 'dropped_pairs': 0},
+        'EMBEDDED-1': {'caption_pairs': 0, 'padding_pairs': 60, 'dropped_pairs': 0},
+    }
+    assert result['pids'][str(program.video_pid)]['num_packets'] > 0
+    stages = {'packet_parse', 'pes_assembly', 'h264', 'user_data', 'cea608_decode'}
+    assert stages <= set(result['stage_times'])
+
+
+def test_continuity_errors():
+    program = Program(codec='h264', field1=pop_on_pairs('HELLO WORLD'))
+    packets = list(TsGenerator([program], bitrate=1000000).packets(60))
+    video_packets = [i for i, packet in enumerate(packets)
+                     if ((packet[1] & 0x1F) << 8 | packet[2]) == program.video_pid]
+    # A lost packet is an error, a duplicated packet is not
+    ts_data = b''.join(packets[:video_packets[10]] + packets[video_packets[10] + 1:] + packets[-1:])
+
+    for check_cc, cc_errors in ((True, 1), (False, 0)):
+        metrics = Metrics()
+        extract_scc(ts_data, show_progress=False, metrics=metrics, check_cc=check_cc)
+        assert metrics.counters['cc_errors'] == cc_errors
+
+
+def test_duplicate_packets():
+    program = Program(codec='h264', field1=pop_on_pairs('HELLO WORLD'))
+    packets = list(TsGenerator([program], bitrate=1000000).packets(60))
+    expected = extract_scc(b''.join(packets), show_progress=False)
+    # The payload of a duplicated PES start, with the captions of its frame, is used once
+    pes_starts = [i for i, packet in enumerate(packets)
+                  if ((packet[1] & 0x1F) << 8 | packet[2]) == program.video_pid and packet[1] & 0x40]
+    duplicated = pes_starts[5]
+    ts_data = b''.join(packets[:duplicated + 1] + packets[duplicated:])
+
+    metrics = Metrics()
+    cc_files = extract_scc(ts_data, show_progress=False, metrics=metrics)
+    assert [f['content'] for f in cc_files] == [f['content'] for f in expected]
+    assert metrics.counters['cc_errors'] == 0
+    assert metrics.counters['duplicate_packets'] == 1
+
+
+def test_concurrent_extractions():
+    streams = []
+    for text in ('HELLO WORLD', 'SECOND STREAM', 'THIRD ONE'):
+        program = Program(codec='h264', field1=pop_on_pairs(text))
+        streams.append(b''.join(TsGenerator([program], bitrate=1000000, b_frames=2).packets(60)))
+    expected = [extract_subtitles(ts_data, fmt='SRT', show_progress=False) for ts_data in streams]
+
+    def extract(ts_data):
+        return extract_subtitles(ts_data, fmt='SRT', show_progress=False)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(extract, streams * 4))
+    assert results == expected * 4
+
+
+def test_packets_before_pmt():
+    program = Program(codec='h264', field1=pop_on_pairs('HELLO WORLD'))
+    packets = list(TsGenerator([program], bitrate=1000000, psi_interval=15).packets(60))
+    # Without the first PAT and PMT, the first 15 frames come before the PMT
+    assert [(packet[1] & 0x1F) << 8 | packet[2] for packet in packets[:2]] == [0, program.pmt_pid]
+    ts_data = b''.join(packets[2:])
+
+    metrics = Metrics()
+    srt = extract_subtitles(ts_data, fmt='SRT', show_progress=False, metrics=metrics)
+    assert srt == '1\n00:00:00,400 --> 00:00:04,400\nHELLO WORLD\n'
+    assert metrics.counters['packets'] == len(packets) - 2
+
+
+def test_time_range():
+    field1 = []
+    for text in ('FIRST', 'SECOND', 'THIRD', 'FOURTH', 'FIFTH'):
+        pairs = pop_on_pairs(text)
+        field1 += pairs + [PADDING_PAIR] * (120 - len(pairs))
+    program = Program(codec='h264', field1=field1)
+    ts_data = b''.join(TsGenerator([program], bitrate=2000000).packets(600))
+
+    metrics = Metrics()
+    srt = extract_subtitles(ts_data, fmt='SRT', show_progress=False, metrics=metrics,
+                            start=9, end=15, preroll=3)
+    # THIRD is shown at 8.308 s, before the start, and FOURTH at 12.312 s
+    assert srt == ('1\n00:00:00,000 --> 00:00:03,312\nTHIRD\n\n'
+                   '2\n00:00:03,312 --> 00:00:07,312\nFOURTH\n')
+    assert metrics.counters['packets'] < len(ts_data) // 188
+
+
+def test_streamed_vtt():
+    field1 = []
+    for text, row in (('R&D <1>', 15), ('TOP', 1)):
+        pairs = pop_on_pairs(text, row=row)
+        field1 += pairs + [PADDING_PAIR] * (60 - len(pairs))
+    program = Program(codec='h264', field1=field1)
+    ts_data = b''.join(TsGenerator([program], bitrate=1000000).packets(300))
+
+    subs_file = io.StringIO()
+    assert extract_subtitles_to(ts_data, subs_file, fmt='VTT', show_progress=False)
+    assert subs_file.getvalue() == (
+        'WEBVTT\n\n'
+        '00:00:00.333 --> 00:00:02.268 align:left position:10% line:89% size:80%\nR&amp;D &lt;1&gt;\n\n'
+        '00:00:02.268 --> 00:00:06.268 align:left position:10% line:5% size:80%\nTOP\n')
+
+
+@pytest.mark.parametrize('caption_format', ['ATSC', 'SCTE20'])
+def test_mpeg2_user_data_scan(caption_format):
+    program = Program(codec='mpeg2', caption_format=caption_format, field1=pop_on_pairs('HELLO WORLD'))
+    ts_data = b''.join(TsGenerator([program], bitrate=1000000, b_frames=2).packets(60))
+    # verbose parses all start codes, to log the frames
+    full_scan = extract_scc(ts_data, show_progress=False, verbose=1)
+    user_data_scan = extract_scc(ts_data, show_progress=False)
+    assert [f['content'] for f in user_data_scan] == [f['content'] for f in full_scan]
+
+    generator = TsGenerator([program], gop_size=15)
+    frame = generator.mpeg2_frame(program, b'\x80\x80', b'\x80\x80', 22, 'B')
+    for fast in (True, False):
+        parser = mpeg_video_parser(frames=not fast, picture_info=True)
+        parser.add_pes(frame, 90000, 90000)
+        # The B-frames 13 and 14 start the second GOP
+        assert (parser.temporal_reference, parser.picture_type) == (9, 3)
+
+
+@pytest.mark.parametrize('b_frames', [0, 2])
+@pytest.mark.parametrize('fast', [True, False])
+def test_mpeg2_picture_timing(b_frames, fast):
+    program = Program(codec='mpeg2', field1=pop_on_pairs('HELLO WORLD'))
+    generator = TsGenerator([program], b_frames=b_frames, gop_size=15)
+    parser = mpeg_video_parser(frames=not fast, picture_info=True)
+    assert parser.reorder_depth == 1
+    for display_index, picture_type in generator.decode_order(31):
+        frame = generator.frame_payload(program, display_index, picture_type)
+        pts = generator.start_pts + int((display_index + b_frames) * generator.frame_duration)
+        # Only I- and P-pictures have a PTS, B-pictures are timed by their temporal reference
+        parser.add_pes(frame, pts if picture_type != 'B' else -1, 0)
+        assert abs(parser.picture_pts - pts) <= 1
+    # Sorting is only needed with B-pictures
+    assert parser.reorder_depth == (1 if b_frames else 0)
+    assert parser.ATSC_parser.cc_writers[0].sorting_overlap == parser.reorder_depth
+
+
+@pytest.mark.parametrize('fast', [True, False])
+def test_mpeg2_untimed_pictures(fast):
+    # The stream starts with the B-pictures 1 and 2 of a GOP, and only I- and P-pictures have a PTS
+    field1 = [PADDING_PAIR] * 20 + pop_on_pairs('HELLO WORLD')
+    program = Program(codec='mpeg2', field1=field1)
+    generator = TsGenerator([program], bitrate=1000000, pts_types='IP', start_frame=2)
+    cc_files = extract_scc(b''.join(generator.packets(60)), show_progress=False, verbose=0 if fast else 1)
+
+    # The captions of pictures 1 and 2 are dropped, and the first time is the one of picture 4,
+    # timed from picture 6
+    pts_offset = generator.start_pts + int((4 + generator.b_frames) * generator.frame_duration)
+    assert abs(cc_files[0]['pts_offset'] - pts_offset) <= 1
+    assert min(cc_files[0]['pts']) >= cc_files[0]['pts_offset']
+    srt = convert_scc(cc_files)
+    assert srt == '1\n00:00:00,934 --> 00:00:04,934\nHELLO WORLD\n'
+
+    # A picture starting a GOP without a PTS does not reuse the time of the previous GOP
+    parser = mpeg_video_parser(frames=not fast, picture_info=True)
+    for display_index, picture_type in generator.decode_order(15):
+        pts = generator.start_pts + int((display_index + generator.b_frames) * generator.frame_duration)
+        parser.add_pes(generator.frame_payload(program, display_index, picture_type), pts, 0)
+    parser.add_pes(generator.frame_payload(program, 15, 'I'), -1, 0)
+    assert parser.picture_pts == -1
+
+
+def test_multi_program_stream():
+    codecs = ['mpeg2', 'h264', 'hevc']
+    programs = [Program(program_number=number, codec=codecs[number % 3],
+                        field1=pop_on_pairs('PROGRAM %d' % number), service_name='Service %d' % number)
+                for number in range(1, 13)]
+    ts_data = b''.join(TsGenerator(programs).packets(30))
+
+    # The SDT of 12 services takes two packets
+    results = extract_programs(ts_data, show_progress=False)
+    assert sorted(results) == list(range(1, 13))
+    for number, program in results.items():
+        assert program['service_name'] == 'Service %d' % number
+        assert '\nPROGRAM %d\n' % number in convert_scc(program['files'])
+
+    # Only the first program, unless others are asked for
+    assert '\nPROGRAM 1\n' in convert_scc(extract_scc(ts_data, show_progress=False))
+    cc_files = extract_scc(ts_data, show_progress=False, programs=[5, 6])
+    assert [cc_file['name'] for cc_file in cc_files] == ['EMBEDDED', 'ATSC']
+    assert '\nPROGRAM 5\n' in convert_scc(cc_files[:1])
+
+
+def test_probe():
+    # Captions in CC1 of an H.264 program, and in CC4 of an MPEG-2 program with SCTE-20 user data
+    pairs = pop_on_pairs('HELLO WORLD') * 40
+    programs = [Program(program_number=1, codec='h264', field1=pairs, service_name='One'),
+                Program(program_number=2, codec='mpeg2', caption_format='SCTE20',
+                        field2=pop_on_pairs('HELLO WORLD', channel=2) * 40, service_name='Two')]
+    ts_data = b''.join(TsGenerator(programs, bitrate=2000000).packets(10000))
+
+    metrics = Metrics()
+    summary = probe(ts_data, metrics=metrics, probe_samples=4, probe_seconds=0.5)
+    assert summary['samples'] == 4
+    assert summary['has_captions']
+    assert summary['bytes_read'] < len(ts_data) // 2
+    assert metrics.counters['packets'] < len(ts_data) // 188 // 4
+    captions = {number: [(caption['source'], caption['video'], caption['field'], caption['channels'])
+                         for caption in program['captions'] if caption['caption_pairs']]
+                for number, program in summary['programs'].items()}
+    assert captions == {1: [('EMBEDDED', 'H.264', 1, ['CC1'])], 2: [('SCTE', 'MPEG2', 2, ['CC4'])]}
+    assert summary['programs'][1]['service_name'] == 'One'
+    assert json.loads(json.dumps(summary))['programs']['2']['captions']
+
+    summary = probe(ts_data, programs=[2])
+    assert list(summary['programs']) == [2]
+
+    program = Program(codec='h264')
+    summary = probe(b''.join(TsGenerator([program]).packets(300)))
+    assert not summary['has_captions']
+    assert summary['programs'][1]['captions'][0]['padding_pairs']
+
+
+def test_pmt_version_change(monkeypatch):
+    # After a splice, the video continues on another PID, announced by a new version of the PMT
+    before = TsGenerator([Program(field1=pop_on_pairs('BEFORE'))])
+    after = TsGenerator([Program(field1=pop_on_pairs('AFTER'), video_pid=0x200, pmt_version=1)])
+    after.start_pts = before.start_pts + int(60 * before.frame_duration)
+    ts_data = b''.join(before.packets(60)) + b''.join(after.packets(60))
+
+    pmt_versions = []
+    parse_pmt = ts.pmt
+
+    def counting_pmt(data, display=False):
+        pmt = parse_pmt(data, display)
+        pmt_versions.append(pmt.version_number)
+        return pmt
+
+    monkeypatch.setattr(ts, 'pmt', counting_pmt)
+    srt = extract_subtitles(ts_data, fmt='SRT', show_progress=False)
+    assert '\nBEFORE\n' in srt and '\nAFTER\n' in srt
+    # The repeated PMTs are not parsed
+    assert pmt_versions == [0, 1]
+
+
+def test_psi_sections():
+    # ISO 639 language descriptors make the PMT continue in a second packet
+    program = Program(field1=pop_on_pairs('HELLO WORLD'), program_info=b'\x0a\x04eng\x00' * 40)
+    packets = list(TsGenerator([program]).packets(60))
+    pmt_packets = [i for i, packet in enumerate(packets)
+                   if ((packet[1] & 0x1F) << 8 | packet[2]) == program.pmt_pid]
+    assert pmt_packets[1] == pmt_packets[0] + 1
+    # The first PMT is corrupted, and found again in its next repetition
+    corrupted = bytearray(packets[pmt_packets[1]])
+    corrupted[20] ^= 0xff
+    packets[pmt_packets[1]] = bytes(corrupted)
+
+    metrics = Metrics()
+    srt = extract_subtitles(b''.join(packets), fmt='SRT', show_progress=False, metrics=metrics)
+    assert srt == '1\n00:00:00,400 --> 00:00:04,400\nHELLO WORLD\n'
+    assert metrics.counters['crc_errors'] == 1
+    # The seeker, the index and the probe find the video stream the same way
+    assert ts.find_video_stream(b''.join(packets)) == (0x1B, program.video_pid)
+    assert probe(io.BytesIO(b''.join(packets)))['has_captions']
+
+
+def test_crc32_mpeg2():
+    section = bytes(range(256)) * 3
+    crc = crc32_mpeg2(section)
+    assert ts.crc32_mpeg2_table(section) == ts.crc32_mpeg2_zlib(section) == crc
+    assert ts.crc32_mpeg2(section + crc.to_bytes(4, 'big')) == 0
@@ -0,0 +1,17 @@
+import pytest
+from ts_cc_extractor.media_tools.timecode import PtsTimeline, TimecodeFormat
+
+
+@pytest.mark.parametrize('frame_rate, frames, ticks_per_frame, expected', [
+    ('30', [0, 29, 30, 108000], 3000, ['00:00:00:00', '00:00:00:29', '00:00:01:00', '01:00:00:00']),
+    ('25', [24, 25, 90000], 3600, ['00:00:00:24', '00:00:01:00', '01:00:00:00']),
+    ('29.97', [1799, 1800, 17981, 17982], 3003, ['00:00:59;29', '00:01:00;02', '00:09:59;29', '00:10:00;00']),
+])
+def test_timecodes(frame_rate, frames, ticks_per_frame, expected):
+    deltas = [frame * ticks_per_frame for frame in frames]
+    assert TimecodeFormat(frame_rate).format_many(deltas) == expected
+
+
+def test_pts_wrap_around():
+    timeline = PtsTimeline((1 << 33) - 90000)
+    assert timeline.deltas([(1 << 33) - 45000, 45000]) == [45000, 135000]
@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from ts_cc_extractor import extract_subtitles
+from ts_cc_extractor.media_tools import tsindex
+from tests.tsgen import PADDING_PAIR, Program, TsGenerator, pop_on_pairs
+
+
+@pytest.fixture(params=['h264', 'hevc', 'mpeg2'])
+def ts_path(request, tmp_path):
+    field1 = []
+    for text in ('FIRST', 'SECOND', 'THIRD', 'FOURTH', 'FIFTH'):
+        pairs = pop_on_pairs(text)
+        field1 += pairs + [PADDING_PAIR] * (120 - len(pairs))
+    program = Program(codec=request.param, field1=field1)
+    path = tmp_path / 'captions.ts'
+    with path.open('wb') as f:
+        TsGenerator([program], bitrate=2000000, gop_size=15).write(f, num_frames=600)
+    return path
+
+
+def test_build_index(ts_path):
+    index = tsindex.get_index(str(ts_path))
+    assert len(index) == 600
+    assert index.keyframes.count(1) == 40
+    assert list(index.dts) == sorted(index.dts)
+    assert index.size == ts_path.stat().st_size
+
+    loaded = tsindex.TsIndex.load(str(ts_path) + tsindex.SUFFIX)
+    assert loaded.is_valid(str(ts_path))
+    for name in ('offsets', 'pts', 'dts', 'keyframes'):
+        assert getattr(loaded, name) == getattr(index, name)
+
+    # A keyframe is found at or before the time, and the end after it
+    start = index.find_offset(index.first_pts + 9 * 90000)
+    assert index.keyframes[index.offsets.index(start)]
+    assert start < index.find_offset(index.first_pts + 9 * 90000, after=True)
+
+
+def test_stale_index(ts_path):
+    index_path = str(ts_path) + tsindex.SUFFIX
+    tsindex.get_index(str(ts_path))
+    with ts_path.open('ab') as f:
+        f.write(b'\x47\x1f\xff\x10' + b'\xff' * 184)
+    assert not tsindex.TsIndex.load(index_path).is_valid(str(ts_path))
+
+    index = tsindex.get_index(str(ts_path))
+    assert index.size == ts_path.stat().st_size
+    assert tsindex.TsIndex.load(index_path).is_valid(str(ts_path))
+
+
+def test_extract_with_index(ts_path):
+    with ts_path.open('rb') as f:
+        expected = extract_subtitles(f, show_progress=False, start=9, end=15, preroll=3)
+    with ts_path.open('rb') as f:
+        srt = extract_subtitles(f, show_progress=False, start=9, end=15, preroll=3, index=True)
+    assert os.path.exists(str(ts_path) + tsindex.SUFFIX)
+    assert srt == expected
+    assert 'THIRD' in srt and 'FIRST' not in srt
@@ -0,0 +1,400 @@
+"""Synthetic MPEG-TS generator for tests and benchmarks.
+
+Writes a transport stream with PAT/PMT and one video PID per program, where every frame carries
+CEA-608 byte pairs as ATSC A/53 cc_data (H.264 or HEVC SEI, or MPEG-2 user_data) or as SCTE-20 user_data.
+The video is only a skeleton: picture/slice headers padded to the configured bitrate.
+Output is deterministic, so large fixtures can be recreated offline instead of being stored.
+
+Example:
+    program = Program(codec='h264', field1=pop_on_pairs('HELLO'))
+    with open('captions.ts', 'wb') as f:
+        TsGenerator([program], b_frames=2).write(f, num_frames=300)
+"""
+from __future__ import annotations
+
+from fractions import Fraction
+from typing import IO, Iterator, Sequence
+
+from ts_cc_extractor.media_tools.timecode import FRAME_RATES
+
+TS_PACKET_SIZE = 188
+PAT_PID = 0x0000
+SDT_PID = 0x0011
+NULL_PID = 0x1FFF
+PTS_MASK = (1 << 33) - 1
+
+STREAM_TYPES = {'mpeg2': 0x02, 'h264': 0x1B, 'hevc': 0x24}
+CAPTION_FORMATS = {'mpeg2': ('ATSC', 'SCTE20'), 'h264': ('ATSC',), 'hevc': ('ATSC',)}
+
+PADDING_PAIR = b'\x80\x80'
+# Start of H.264 slice headers: first_mb_in_slice = 0, slice_type, pic_parameter_set_id = 0, frame_num
+SLICE_HEADERS = {'I': bytes((0b10001000, 0b10000000)),  # slice_type 7
+                 'P': bytes((0b10011010, 0b00000000)),  # slice_type 5
+                 'B': bytes((0b10011110, 0b00000000))}  # slice_type 6
+# Bit reversed bytes, for SCTE-20
+REVERSED = bytes(int('{:08b}'.format(byte)[::-1], 2) for byte in range(256))
+
+
+def crc32_mpeg2(data: bytes) -> int:
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+    return crc
+
+
+def odd_parity(byte: int) -> int:
+    byte &= 0x7F
+    return byte | (0x80 if bin(byte).count('1') % 2 == 0 else 0)
+
+
+def with_parity(data: bytes) -> bytes:
+    return bytes(odd_parity(byte) for byte in data)
+
+
+def pop_on_pairs(text: str, channel: int = 1, row: int = 15) -> list[bytes]:
+    """CEA-608 byte pairs of a pop-on caption showing text on one row.
+
+    Channel 1 or 2 of a field (CC1/CC2 in field 1, CC3/CC4 in field 2)."""
+    # Row to PAC bytes for indent 0, white (CEA-608 Table 53)
+    pac_rows = {1: (0x11, 0x40), 2: (0x11, 0x60), 3: (0x12, 0x40), 4: (0x12, 0x60), 5: (0x15, 0x40),
+                6: (0x15, 0x60), 7: (0x16, 0x40), 8: (0x16, 0x60), 9: (0x17, 0x40), 10: (0x17, 0x60),
+                11: (0x10, 0x40), 12: (0x13, 0x40), 13: (0x13, 0x60), 14: (0x14, 0x40), 15: (0x14, 0x60)}
+    channel_bit = 0x08 if channel == 2 else 0x00
+    control = 0x14 | channel_bit
+
+    def command(code: int) -> list[bytes]:
+        # Control codes are sent twice
+        return [with_parity(bytes((control, code)))] * 2
+
+    pac_1, pac_2 = pac_rows[row]
+    pairs = command(0x20)  # Resume caption loading
+    pairs += command(0x2E)  # Erase non-displayed memory
+    pairs += [with_parity(bytes((pac_1 | channel_bit, pac_2)))] * 2
+    text_bytes = text.encode('ascii')
+    if len(text_bytes) % 2:
+        text_bytes += b'\x00'
+    pairs += [with_parity(text_bytes[i:i + 2]) for i in range(0, len(text_bytes), 2)]
+    pairs += command(0x2F)  # End of caption
+    return pairs
+
+
+class Program:
+    """A program with one video PID carrying captions.
+
+    field1 and field2 are the CEA-608 byte pairs of each field, one pair per frame in display order.
+    When a field runs out of pairs it is padded. If any program has a service_name, an SDT is sent.
+    pmt_version is the version_number of the PMT, and program_info its program descriptors."""
+
+    def __init__(self, program_number: int = 1, codec: str = 'h264', caption_format: str = 'ATSC',
+                 field1: Sequence[bytes] = (), field2: Sequence[bytes] = (),
+                 pmt_pid: int | None = None, video_pid: int | None = None, service_name: str | None = None,
+                 pmt_version: int = 0, program_info: bytes = b''):
+        if codec not in STREAM_TYPES:
+            raise ValueError('Unsupported codec: %s' % codec)
+        if caption_format not in CAPTION_FORMATS[codec]:
+            raise ValueError('Unsupported caption format for %s: %s' % (codec, caption_format))
+        self.program_number = program_number
+        self.codec = codec
+        self.caption_format = caption_format
+        self.fields = (list(field1), list(field2))
+        self.pmt_pid = pmt_pid if pmt_pid is not None else 0x1000 + program_number - 1
+        self.video_pid = video_pid if video_pid is not None else 0x100 + 0x10 * (program_number - 1)
+        self.service_name = service_name
+        self.pmt_version = pmt_version
+        self.program_info = program_info
+
+    def frame_pairs(self, display_index: int) -> tuple[bytes, bytes]:
+        return tuple(  # type: ignore[return-value]
+            field[display_index] if display_index < len(field) else PADDING_PAIR for field in self.fields
+        )
+
+
+class TsGenerator:
+    """Generate TS packets for programs.
+
+    Args:
+        programs: Programs to multiplex.
+        bitrate: Total TS bitrate in bits/s, including stuffing.
+        frame_rate: Video frame rate, one of timecode.FRAME_RATES.
+        stuffing_ratio: Fraction of the packets that are null packets.
+        b_frames: Number of B-frames between anchor frames, which are sent in decoding order.
+        gop_size: Number of frames in a GOP.
+        psi_interval: Number of frames between PAT/PMT repetitions.
+        pts_types: Picture types ('I', 'P', 'B') whose PES has a PTS and DTS.
+        start_frame: Decoding index of the first frame sent, e.g. to start in the middle of a GOP.
+    """
+
+    def __init__(self, programs: Sequence[Program], bitrate: int = 4000000, frame_rate: str = '29.97',
+                 stuffing_ratio: float = 0.0, b_frames: int = 2, gop_size: int = 15, psi_interval: int = 15,
+                 pts_types: str = 'IPB', start_frame: int = 0):
+        if not 0 <= stuffing_ratio < 1:
+            raise ValueError('Stuffing ratio must be in [0, 1)')
+        self.programs = list(programs)
+        self.bitrate = bitrate
+        numerator, denominator = FRAME_RATES[frame_rate][:2]
+        self.frame_duration = Fraction(90000 * denominator, numerator)
+        self.stuffing_ratio = stuffing_ratio
+        self.b_frames = b_frames
+        self.gop_size = gop_size
+        self.psi_interval = psi_interval
+        self.pts_types = pts_types
+        self.start_frame = start_frame
+        self.start_pts = 90000
+        self.counters: dict[int, int] = {}
+        # Video bytes per frame and program, leaving room for TS and PES headers
+        frames_per_second = numerator / denominator
+        packets_per_frame = bitrate * (1 - stuffing_ratio) / 8 / TS_PACKET_SIZE / frames_per_second
+        self.frame_size = max(64, int(packets_per_frame / len(self.programs) * 176) - 32)
+
+    def decode_order(self, num_frames: int) -> list[tuple[int, str]]:
+        "Display index and picture type of frames, in decoding order."
+        order = []
+        pending_b: list[int] = []
+        for display_index in range(num_frames):
+            gop_index = display_index % self.gop_size
+            if gop_index == 0 or (gop_index % (self.b_frames + 1) == 0) or display_index == num_frames - 1:
+                order.append((display_index, 'I' if gop_index == 0 else 'P'))
+                order.extend((index, 'B') for index in pending_b)
+                pending_b = []
+            else:
+                pending_b.append(display_index)
+        return order
+
+    def packets(self, num_frames: int) -> Iterator[bytes]:
+        "Generate TS packets for num_frames frames of every program."
+        stuffing = 0.0
+        for decode_index, (display_index, picture_type) in enumerate(self.decode_order(num_frames)):
+            if decode_index < self.start_frame:
+                continue
+            if (decode_index - self.start_frame) % self.psi_interval == 0:
+                yield from self.psi_packets()
+            dts = self.start_pts + int(decode_index * self.frame_duration)
+            pts = self.start_pts + int((display_index + self.b_frames) * self.frame_duration)
+            has_pts = picture_type in self.pts_types
+            for program in self.programs:
+                payload = self.frame_payload(program, display_index, picture_type)
+                for packet in self.pes_packets(program.video_pid, payload, pts, dts, has_pts):
+                    yield packet
+                    stuffing += self.stuffing_ratio / (1 - self.stuffing_ratio)
+                    while stuffing >= 1:
+                        stuffing -= 1
+                        yield self.null_packet()
+
+    def write(self, f: IO[bytes], num_frames: int | None = None, min_size: int | None = None) -> int:
+        """Write num_frames frames, or enough frames for at least min_size bytes.
+
+        Returns:
+            Number of bytes written.
+        """
+        if num_frames is None:
+            if min_size is None:
+                raise ValueError('Either num_frames or min_size is needed')
+            bytes_per_frame = self.bitrate / 8 * float(self.frame_duration) / 90000
+            num_frames = int(min_size / bytes_per_frame) + 1
+        num_bytes = 0
+        for packet in self.packets(num_frames):
+            f.write(packet)
+            num_bytes += len(packet)
+        return num_bytes
+
+    # Video
+
+    def frame_payload(self, program: Program, display_index: int, picture_type: str) -> bytes:
+        field1, field2 = program.frame_pairs(display_index)
+        if program.codec == 'h264':
+            return self.h264_frame(field1, field2, picture_type)
+        if program.codec == 'hevc':
+            return self.hevc_frame(field1, field2, picture_type)
+        return self.mpeg2_frame(program, field1, field2, display_index, picture_type)
+
+    def h264_frame(self, field1: bytes, field2: bytes, picture_type: str) -> bytes:
+        # Access unit delimiter, SEI with A/53 captions and a single slice
+        aud = b'\x00\x00\x00\x01\x09\xf0'
+        sei = b'\x00\x00\x00\x01\x06' + emulation_prevention(caption_sei_rbsp(field1, field2))
+        slice_header = SLICE_HEADERS[picture_type]
+        nal_type = b'\x65' if picture_type == 'I' else b'\x41'
+        slice_nal = b'\x00\x00\x00\x01' + nal_type + slice_header
+        return aud + sei + filler(slice_nal, self.frame_size - len(aud) - len(sei))
+
+    def hevc_frame(self, field1: bytes, field2: bytes, picture_type: str) -> bytes:
+        # Access unit delimiter, prefix SEI with A/53 captions and a single slice, with 2 byte NAL headers
+        aud = b'\x00\x00\x00\x01\x46\x01\x50'
+        sei = b'\x00\x00\x00\x01\x4e\x01' + emulation_prevention(caption_sei_rbsp(field1, field2))
+        # IDR_W_RADL or TRAIL_R, with first_slice_segment_in_pic_flag set
+        nal_header = b'\x26\x01' if picture_type == 'I' else b'\x02\x01'
+        slice_nal = b'\x00\x00\x00\x01' + nal_header + b'\x80'
+        return aud + sei + filler(slice_nal, self.frame_size - len(aud) - len(sei))
+
+    def mpeg2_frame(self, program: Program, field1: bytes, field2: bytes, display_index: int,
+                    picture_type: str) -> bytes:
+        data = b''
+        if picture_type == 'I':
+            # Sequence header 720x480, 4:3, 29.97 Hz, and a GOP header
+            data += b'\x00\x00\x01\xb3\x2d\x01\xe0\x24\xff\xff\xe0\x00'
+            data += b'\x00\x00\x01\xb8\x00\x08\x00\x00'
+        temporal_reference = self.temporal_reference(display_index)
+        coding_type = {'I': 1, 'P': 2, 'B': 3}[picture_type]
+        header = (temporal_reference << 22) | (coding_type << 19) | (0xFFFF << 3)
+        data += b'\x00\x00\x01\x00' + header.to_bytes(4, 'big')
+        if program.caption_format == 'ATSC':
+            data += b'\x00\x00\x01\xb2GA94' + atsc_cc_data(field1, field2)
+        else:
+            data += b'\x00\x00\x01\xb2' + scte20_cc_data(field1, field2)
+        return data + filler(b'\x00\x00\x01\x01', self.frame_size - len(data))
+
+    def temporal_reference(self, display_index: int) -> int:
+        "Display index in the GOP, which starts with the B-frames sent after its I-frame."
+        leading_b_frames = (self.gop_size - 1) % (self.b_frames + 1)
+        if display_index < self.gop_size - leading_b_frames:
+            # The first GOP is closed
+            return display_index
+        return (display_index + leading_b_frames) % self.gop_size
+
+    # Transport
+
+    def pes_packets(self, pid: int, payload: bytes, pts: int, dts: int,
+                    has_pts: bool = True) -> Iterator[bytes]:
+        if has_pts:
+            pes_header = b'\x00\x00\x01\xe0\x00\x00\x84\xc0\x0a' + timestamp(0x3, pts) + timestamp(0x1, dts)
+        else:
+            pes_header = b'\x00\x00\x01\xe0\x00\x00\x84\x00\x00'
+        data = pes_header + payload
+        pcr = (dts - 9000) & PTS_MASK  # 100 ms before decoding
+        pcr_field = bytes((
+            (pcr >> 25) & 0xFF, (pcr >> 17) & 0xFF, (pcr >> 9) & 0xFF, (pcr >> 1) & 0xFF,
+            ((pcr & 0x01) << 7) | 0x7E, 0x00,
+        ))
+        offset = 0
+        first = True
+        while offset < len(data):
+            adaptation = b'\x10' + pcr_field if first else b''
+            space = TS_PACKET_SIZE - 4 - (len(adaptation) + 1 if adaptation else 0)
+            chunk = data[offset:offset + space]
+            offset += len(chunk)
+            yield self.ts_packet(pid, chunk, adaptation, payload_start=first)
+            first = False
+
+    def ts_packet(self, pid: int, payload: bytes, adaptation: bytes = b'',
+                  payload_start: bool = False) -> bytes:
+        "TS packet with payload, padded with adaptation field stuffing."
+        counter = self.counters.get(pid, 0)
+        self.counters[pid] = (counter + 1) & 0x0F
+        if not adaptation and len(payload) == TS_PACKET_SIZE - 4:
+            return self.ts_header(pid, payload_start, 0x10, counter) + payload
+        stuffing_length = TS_PACKET_SIZE - 4 - 1 - len(adaptation) - len(payload)
+        if not adaptation and stuffing_length > 0:
+            adaptation = b'\x00'  # No flags
+            stuffing_length -= 1
+        adaptation += b'\xff' * stuffing_length
+        header = self.ts_header(pid, payload_start, 0x30, counter)
+        return header + bytes((len(adaptation),)) + adaptation + payload
+
+    @staticmethod
+    def ts_header(pid: int, payload_start: bool, adaptation_field_control: int, counter: int) -> bytes:
+        return bytes((0x47, (0x40 if payload_start else 0x00) | (pid >> 8), pid & 0xFF,
+                      adaptation_field_control | counter))
+
+    def null_packet(self) -> bytes:
+        return b'\x47\x1f\xff\x10' + b'\xff' * (TS_PACKET_SIZE - 4)
+
+    def psi_packets(self) -> Iterator[bytes]:
+        programs = b''.join(
+            program.program_number.to_bytes(2, 'big') + (0xE000 | program.pmt_pid).to_bytes(2, 'big')
+            for program in self.programs
+        )
+        yield from self.section_packets(PAT_PID, 0x00, 0x0001, programs)
+        for program in self.programs:
+            pmt = ((0xE000 | program.video_pid).to_bytes(2, 'big')
+                   + (0xF000 | len(program.program_info)).to_bytes(2, 'big') + program.program_info
+                   + bytes((STREAM_TYPES[program.codec],))
+                   + (0xE000 | program.video_pid).to_bytes(2, 'big') + b'\xf0\x00')
+            yield from self.section_packets(program.pmt_pid, 0x02, program.program_number, pmt,
+                                            version=program.pmt_version)
+        if any(program.service_name for program in self.programs):
+            yield from self.section_packets(SDT_PID, 0x42, 0x0001, self.sdt_data())
+
+    def sdt_data(self) -> bytes:
+        "Original network id and services of an SDT, with a service descriptor for named programs."
+        data = b'\x00\x01\xff'
+        for program in self.programs:
+            descriptors = b''
+            if program.service_name:
+                provider, name = b'tsgen', program.service_name.encode('latin-1')
+                service = b'\x01' + bytes((len(provider),)) + provider + bytes((len(name),)) + name
+                descriptors = b'\x48' + bytes((len(service),)) + service
+            # No EIT, running, not scrambled
+            data += (program.program_number.to_bytes(2, 'big') + b'\xfc'
+                     + (0x8000 | len(descriptors)).to_bytes(2, 'big') + descriptors)
+        return data
+
+    def section_packets(self, pid: int, table_id: int, table_id_extension: int,
+                        data: bytes, version: int = 0) -> Iterator[bytes]:
+        "Packets of a section, which continues in as many packets as needed."
+        section_length = 5 + len(data) + 4
+        section = (bytes((table_id, 0xB0 | (section_length >> 8), section_length & 0xFF))
+                   + table_id_extension.to_bytes(2, 'big') + bytes((0xC1 | (version << 1), 0x00, 0x00))
+                   + data)
+        section += crc32_mpeg2(section).to_bytes(4, 'big')
+        payload = b'\x00' + section
+        payload_size = TS_PACKET_SIZE - 4
+        for start in range(0, len(payload), payload_size):
+            chunk = payload[start:start + payload_size]
+            yield self.ts_packet(pid, chunk + b'\xff' * (payload_size - len(chunk)), payload_start=start == 0)
+
+
+def atsc_cc_data(field1: bytes, field2: bytes) -> bytes:
+    "A/53 cc_data() with one CEA-608 pair per field."
+    return (b'\x03' + bytes((0x40 | 2, 0xFF))
+            + b'\xfc' + field1 + b'\xfd' + field2 + b'\xff')
+
+
+def caption_sei_rbsp(field1: bytes, field2: bytes) -> bytes:
+    "SEI RBSP with one registered user data message (payload type 4) of A/53 captions."
+    sei_message = b'\xb5\x00\x31GA94' + atsc_cc_data(field1, field2)
+    return b'\x04' + sei_size(len(sei_message)) + sei_message + b'\x80'
+
+
+def scte20_cc_data(field1: bytes, field2: bytes) -> bytes:
+    "SCTE-20 user data with one CEA-608 pair per field."
+    bits = '0000000' + '1' + '{:05b}'.format(2)
+    for field_number, pair in ((1, field1), (2, field2)):
+        bits += '00' + '{:02b}'.format(field_number) + '{:05b}'.format(11)
+        bits += ''.join('{:08b}'.format(REVERSED[byte]) for byte in pair) + '1'
+    bits += '0000'
+    bits += '0' * (-len(bits) % 8)
+    return b'\x03' + int(bits, 2).to_bytes(len(bits) // 8, 'big')
+
+
+def sei_size(size: int) -> bytes:
+    return b'\xff' * (size // 255) + bytes((size % 255,))
+
+
+def emulation_prevention(rbsp: bytes) -> bytes:
+    "Insert emulation prevention bytes, so that no start code is found in the NAL unit."
+    data = bytearray()
+    zeros = 0
+    for byte in rbsp:
+        if zeros == 2 and byte <= 0x03:
+            data.append(0x03)
+            zeros = 0
+        data.append(byte)
+        zeros = zeros + 1 if byte == 0 else 0
+    return bytes(data)
+
+
+def filler(header: bytes, size: int) -> bytes:
+    "Header padded to size with bytes that can't form a start code."
+    return header + b'\x55' * max(0, size - len(header))
+
+
+def timestamp(prefix: int, value: int) -> bytes:
+    value &= PTS_MASK
+    return bytes((
+        (prefix << 4) | ((value >> 29) & 0x0E) | 0x01,
+        (value >> 22) & 0xFF,
+        ((value >> 14) & 0xFE) | 0x01,
+        (value >> 7) & 0xFF,
+        ((value << 1) & 0xFE) | 0x01,
+    ))
@@ -1,7 +1,18 @@
-from .extractor import extract_subtitles
+# Same as typing.TYPE_CHECKING, without importing typing at startup
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from .extractor import extract_subtitles
 
 __all__ = [
     'extract_subtitles',
 ]
 
 __version__ = '0.0.3'
+
+
+def __getattr__(name):
+    # The extractor is imported on first use, so that `--version` and `--help` start fast
+    if name == 'extract_subtitles':
+        from .extractor import extract_subtitles
+        return extract_subtitles
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
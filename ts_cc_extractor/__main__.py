@@ -1,6 +1,12 @@
 import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
 
-from . import __version__, extract_subtitles
+from . import __version__
+from .media_tools.metrics import Metrics
 
 
 def main():
@@ -9,23 +15,89 @@ def main():
     optional_group = parser.add_argument_group('optional arguments')
     required_group.add_argument('-i', dest='ts_path', metavar='PATH', required=True,
                                 help='Path to *.ts file')
-    required_group.add_argument('-o', dest='out_path', metavar='PATH', required=True,
-                                help='Output subtitles file')
+    required_group.add_argument('-o', dest='out_path', metavar='PATH',
+                                help='Output subtitles file, or with --probe an optional output JSON file')
     optional_group.add_argument('-f', dest='format', choices=['SRT', 'VTT'], default='SRT',
                                 help='Subtitles format (default: %(default)s)')
+    optional_group.add_argument('--start', type=float, metavar='SECONDS',
+                                help='Start of the extracted time range, from the first video frame')
+    optional_group.add_argument('--end', type=float, metavar='SECONDS',
+                                help='End of the extracted time range, from the first video frame')
+    optional_group.add_argument('--program', type=int, metavar='NUMBER',
+                                help='Program number to extract from a multi-program TS '
+                                     '(default: the first one)')
+    optional_group.add_argument('--index', action='store_true',
+                                help='Use a .tsidx index next to the TS file for --start/--end, '
+                                     'built if missing or outdated')
+    optional_group.add_argument('--cache-dir', metavar='PATH',
+                                default=os.environ.get('TS_CC_EXTRACTOR_CACHE_DIR'),
+                                help='Cache extracted captions in this directory '
+                                     '(default: $TS_CC_EXTRACTOR_CACHE_DIR, no cache if unset)')
+    optional_group.add_argument('--no-cache', action='store_true',
+                                help='Extract from the TS file without reading or writing the cache')
+    optional_group.add_argument('--probe', action='store_true',
+                                help='Print a JSON summary of the captions found in samples of the file, '
+                                     'instead of extracting them')
+    optional_group.add_argument('--sidecar', dest='sidecar_path', metavar='PATH',
+                                help='Also write the CEA-608 byte pairs of the captions as NumPy arrays '
+                                     'to this .npz file')
+    optional_group.add_argument('--metrics', dest='metrics_path', metavar='PATH',
+                                help='Write extraction metrics as JSON to this file')
+    optional_group.add_argument('--verbose', action='count', default=0,
+                                help='Log the frames and statistics of the TS file to stderr, '
+                                     'repeat to also log its tables and packets')
     optional_group.add_argument('-v', '--version', action='version',
                                 version=f'%(prog)s {__version__}')
     optional_group.add_argument('-h', '--help', action='help',
                                 help='show this help message and exit')
 
     args = parser.parse_args()
+    if args.out_path is None and not args.probe:
+        parser.error('the following arguments are required: -o')
 
-    with open(args.ts_path, 'rb') as f_ts:
-        subs_text = extract_subtitles(f_ts, fmt=args.format)
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
 
-        if subs_text is not None:
-            if args.out_path == '-':
-                print(subs_text)
-            else:
-                with open(args.out_path, 'w') as f_out:
-                    print(subs_text, file=f_out)
+    metrics = Metrics()
+    if args.probe:
+        from .extractor import probe
+
+        with open(args.ts_path, 'rb') as f_ts:
+            summary = probe(f_ts, metrics=metrics, verbose=args.verbose,
+                            programs='all' if args.program is None else [args.program])
+        if args.out_path is None or args.out_path == '-':
+            print(json.dumps(summary, indent=2))
+        else:
+            with open(args.out_path, 'w') as f_out:
+                print(json.dumps(summary, indent=2), file=f_out)
+        write_metrics(args.metrics_path, metrics)
+        return
+
+    from .extractor import extract_subtitles_to
+
+    with contextlib.ExitStack() as stack:
+        f_ts = stack.enter_context(open(args.ts_path, 'rb'))
+        f_sidecar = stack.enter_context(open(args.sidecar_path, 'wb')) if args.sidecar_path else None
+        options = dict(fmt=args.format, metrics=metrics, start=args.start, end=args.end, index=args.index,
+                       cache_dir=None if args.no_cache else args.cache_dir,
+                       programs=None if args.program is None else [args.program], sidecar_file=f_sidecar,
+                       verbose=args.verbose)
+        if args.out_path == '-':
+            extract_subtitles_to(f_ts, sys.stdout, **options)
+        else:
+            with open(args.out_path, 'w') as f_out:
+                written = extract_subtitles_to(f_ts, f_out, **options)
+            if not written:
+                os.remove(args.out_path)
+
+    write_metrics(args.metrics_path, metrics)
+
+
+def write_metrics(metrics_path, metrics):
+    if metrics_path:
+        with open(metrics_path, 'w') as f_metrics:
+            print(metrics.to_json(indent=2), file=f_metrics)
+
+
+if __name__ == '__main__':
+    main()
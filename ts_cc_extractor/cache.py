@@ -0,0 +1,193 @@
+"""On-disk cache of extracted caption data.
+
+Entries are keyed by a fingerprint of the TS file (its size and a hash of sampled blocks) and the
+options that change the extracted data. An entry stores the CEA-608 byte pairs and PTS of every
+channel, so SCC, SRT or VTT can be produced again without reading the TS file.
+The total size of the entries is bounded, and the least recently used entries are evicted first.
+"""
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import IO, TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .media_tools.scc import SccFile
+
+MAGIC = b'TSCC\x01'
+# Magic, number of files
+HEADER = struct.Struct('<5sI')
+# Length of the name, channel, PTS offset, number of pairs, number of lines
+FILE_HEADER = struct.Struct('<HBqII')
+SUFFIX = '.cc'
+# Options that change the extracted data
+KEY_OPTIONS = ('start', 'end', 'start_pts', 'end_pts', 'preroll', 'programs')
+SAMPLE_BLOCKS = 16
+SAMPLE_BLOCK_SIZE = 64 * 1024
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(ts_file: IO[bytes]) -> str | None:
+    """Fingerprint of a seekable file from its size and evenly spaced blocks, including the first and last.
+
+    The file position is kept. Returns None if the file is not seekable.
+    """
+    try:
+        if not ts_file.seekable():
+            return None
+        position = ts_file.tell()
+        size = ts_file.seek(0, os.SEEK_END)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    try:
+        if size <= SAMPLE_BLOCKS * SAMPLE_BLOCK_SIZE:
+            ts_file.seek(0)
+            digest.update(ts_file.read())
+        else:
+            step = (size - SAMPLE_BLOCK_SIZE) // (SAMPLE_BLOCKS - 1)
+            for block in range(SAMPLE_BLOCKS):
+                ts_file.seek(block * step)
+                digest.update(ts_file.read(SAMPLE_BLOCK_SIZE))
+    finally:
+        ts_file.seek(position)
+    return digest.hexdigest()
+
+
+def cache_key(file_fingerprint: str, options: dict[str, Any]) -> str:
+    """Cache key of a file fingerprint and the options that change the extracted data."""
+    key_options = json.dumps([options.get(name) for name in KEY_OPTIONS])
+    return hashlib.blake2b((file_fingerprint + key_options).encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """Directory of cache entries with a bound on their total size.
+
+    Args:
+        directory: Directory of the entries, created if missing
+        max_bytes: Entries are evicted, least recently used first, when they take more
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key: str, frame_rate: str = '30') -> list[SccFile] | None:
+        """Return the files of an entry, with SCC timecodes at frame_rate, or None if it is not readable."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                cc_files = read_files(f, frame_rate)
+            # The modification time orders the entries for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring cache entry %s: %s', path, e)
+            return None
+        return cc_files
+
+    def put(self, key: str, cc_files: list[SccFile]) -> None:
+        """Store the files as an entry, replacing it atomically, and evict old entries."""
+        path = self.path(key)
+        tmp_path = None
+        try:
+            # A temporary file per writer, so that concurrent writers of an entry do not mix their data
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                                            dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                write_files(f, cc_files)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning('Could not write cache entry %s: %s', path, e)
+            if tmp_path is not None:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the entries fit in max_bytes."""
+        entries = []
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(SUFFIX):
+                    try:
+                        entry_stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+
+def write_files(f: IO[bytes], cc_files: list[SccFile]) -> None:
+    f.write(HEADER.pack(MAGIC, len(cc_files)))
+    for cc_file in cc_files:
+        name = (cc_file['name'] or '').encode('utf-8')
+        f.write(FILE_HEADER.pack(len(name), cc_file['channel'], cc_file['pts_offset'],
+                                 len(cc_file['pairs']), len(cc_file.line_ends)))
+        f.write(name)
+        for values in (cc_file['pts'], cc_file['pairs'], array('q', cc_file.line_ends)):
+            write_array(f, values)
+
+
+def read_files(f: IO[bytes], frame_rate: str = '30') -> list[SccFile]:
+    from .media_tools.scc import SccFile
+
+    magic, count = HEADER.unpack(read_exactly(f, HEADER.size))
+    if magic != MAGIC:
+        raise ValueError('Not a cache entry')
+    cc_files = []
+    for _ in range(count):
+        name_length, channel, pts_offset, num_pairs, num_lines = FILE_HEADER.unpack(
+            read_exactly(f, FILE_HEADER.size))
+        name = read_exactly(f, name_length).decode('utf-8')
+        pts = read_array(f, 'q', num_pairs)
+        pairs = read_array(f, 'H', num_pairs)
+        line_ends = array('L', read_array(f, 'q', num_lines))
+        cc_files.append(SccFile(name, channel, pts, pairs, pts_offset, line_ends, frame_rate))
+    return cc_files
+
+
+def read_exactly(f: IO[bytes], size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated data')
+    return data
+
+
+def write_array(f: IO[bytes], values: array) -> None:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    f.write(values.tobytes())
+
+
+def read_array(f: IO[bytes], typecode: str, count: int) -> array:
+    values = array(typecode)
+    values.frombytes(read_exactly(f, values.itemsize * count))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
@@ -5,11 +5,16 @@ import logging
 import sys
 import time
 from contextlib import contextmanager
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, cast
 
-from pycaption import CaptionReadError, SCCReader, SRTWriter, WebVTTWriter
+from .cache import DEFAULT_MAX_BYTES, ResultCache, cache_key, fingerprint
+from .media_tools.metrics import Metrics
+from .media_tools.timecode import FRAME_RATES
 
-from .media_tools.ts import handle_file
+TS_PACKET_SIZE = 188
+
+# The TS parsers and the subtitle writers are imported when first used, so that importing the package,
+# or running the CLI for --help or --version, stays fast.
 
 if TYPE_CHECKING:
     from typing import IO, Any, Callable, Generator, Optional
@@ -19,7 +24,40 @@ if TYPE_CHECKING:
     else:
         from typing_extensions import TypedDict
 
-    SCCFile = TypedDict('SCCFile', {'content': str, 'channel': int, 'type': Optional[str]})
+    from array import array
+
+    from .media_tools.scc import SccFile
+
+    SCCFile = TypedDict('SCCFile', {
+        'name': Optional[str],
+        'channel': int,
+        'content': str,  # Rendered on first lookup
+        'pts': 'array[int]',
+        'pairs': 'array[int]',
+        'pts_offset': int,
+    })
+    ProgramCaptions = TypedDict('ProgramCaptions', {
+        'service_name': Optional[str],
+        'files': 'list[SCCFile]',
+    })
+    ProbeCaptions = TypedDict('ProbeCaptions', {
+        'source': str,
+        'video': str,
+        'field': int,
+        'channels': 'list[str]',
+        'caption_pairs': int,
+        'padding_pairs': int,
+    })
+    ProgramProbe = TypedDict('ProgramProbe', {
+        'service_name': Optional[str],
+        'captions': 'list[ProbeCaptions]',
+    })
+    ProbeResult = TypedDict('ProbeResult', {
+        'samples': int,
+        'bytes_read': int,
+        'has_captions': bool,
+        'programs': 'dict[int, ProgramProbe]',
+    })
 
 
 logger = logging.getLogger(__name__)
@@ -33,81 +71,317 @@ def set_options(options: dict[str, Any]) -> dict[str, Any]:
         'verbose': 0,  # Verbose level
         'log_cc': False,  # CC logging
         'show_progress': True,  # Show progress in stderr
+        'check_cc': True,  # Count continuity counter errors in the statistics
+        'scc_frame_rate': '30',  # SCC timecode rate: '30' | '25' (non-drop), '29.97' | '59.94' (drop-frame)
+        'start': None,  # Start of the time range in seconds from the first video PTS
+        'end': None,  # End of the time range in seconds from the first video PTS
+        'start_pts': None,  # Start of the time range as PTS, instead of start
+        'end_pts': None,  # End of the time range as PTS, instead of end
+        'preroll': 10.0,  # Seconds parsed before the start, to get the CEA-608 state at the start
+        'index': False,  # Use (and build if needed) a .tsidx index sidecar for time ranges
+        'cache_dir': None,  # Directory of the result cache, None to extract without it
+        'cache_size': DEFAULT_MAX_BYTES,  # Bound of the total size of the result cache
+        'programs': None,  # Programs to extract: None for the first one in the PAT, 'all' or program numbers
+        'probe_samples': 5,  # Number of evenly spaced samples of the file parsed by probe()
+        'probe_seconds': 1.0,  # Seconds of each sample parsed by probe()
     }
 
     return {**default_options, **options}
 
 
+def format_progress(current: int, total: int | None, elapsed: float) -> str:
+    """Progress line with throughput and, if the total size is known, percentage and ETA.
+
+    Args:
+        current: Bytes parsed so far
+        total: Size of the file, or None if unknown
+        elapsed: Seconds since the start
+    """
+    rate = current / elapsed if elapsed > 0 else 0.0
+    throughput = '%.1f MB/s, %d packets/s' % (rate / 1e6, rate / TS_PACKET_SIZE)
+    if not total:
+        return 'Progress: %.1f MB (%s)' % (current / 1e6, throughput)
+
+    percent = min(current / total * 100, 100)
+    if rate > 0:
+        eta = time.strftime('%H:%M:%S', time.gmtime(max(total - current, 0) / rate))
+    else:
+        eta = '--:--:--'
+    return 'Progress: %d%% (%s, ETA %s)' % (percent, throughput, eta)
+
+
 @contextmanager
-def show_progress(mininterval: float = 0.1) -> Generator[Callable[[int, int, bool], None], None, None]:
-    show_time = time.time()
+def show_progress(
+    mininterval: float = 0.1,
+) -> Generator[Callable[[int, Optional[int], bool], None], None, None]:
+    start_time = show_time = time.time()
+    last_current = 0
+    last_total: int | None = None
 
-    def _show_progress(current: int, total: int, is_final: bool = False):
-        nonlocal show_time
+    def _show_progress(current: int, total: int | None, is_final: bool = False):
+        nonlocal show_time, last_current, last_total
+        last_current, last_total = current, total
         current_time = time.time()
         if current_time - show_time > mininterval or is_final:
             show_time = current_time
-            percent = current / total * 100
-            print('Progress: %d%%' % percent, end='\n' if is_final else '\r', file=sys.stderr)
+            line = format_progress(current, total, current_time - start_time)
+            print(line.ljust(79), end='\n' if is_final else '\r', file=sys.stderr)
     try:
         yield _show_progress
     finally:
-        _show_progress(1, 1, is_final=True)
+        _show_progress(last_total or last_current, last_total, is_final=True)
 
 
-def extract_scc(ts_file: bytes | IO[bytes], **options) -> list[SCCFile]:
+def extract_scc(ts_file: bytes | IO[bytes], metrics: Metrics | None = None, **options) -> list[SCCFile]:
     """Extracts CEA-608 `SCC` (Scenarist Closed Captions) from `TS`.
 
+    The `scc_frame_rate` option selects the SCC timecodes: '30' (default) or '25' non-drop-frame,
+    '29.97' or '59.94' drop-frame.
+
+    The `start` and `end` options (seconds from the first video PTS), or `start_pts` and `end_pts`,
+    limit the extraction to a time range of a seekable file. The file is bisected on the PTS of the
+    video PES, and only the range plus `preroll` seconds before it is parsed. SCC time 00:00:00:00
+    is then at the start, and a caption shown at the start begins at 00:00:00:00.
+    With the `index` option, the offsets are looked up in a `.tsidx` sidecar next to the file instead,
+    which is built by scanning the file if it is missing or the file has changed.
+
+    With the `cache_dir` option, the extracted data is cached in that directory, keyed by a fingerprint
+    of the file and the time range options, and later extractions of the same file return it.
+
+    Only the first program of the PAT is extracted, unless the `programs` option is 'all' or a list of
+    program numbers. See `extract_programs()` to get the files per program.
+
+    Args:
+        ts_file: TS file
+        metrics: If given, filled with the time spent per stage, packet counters per PID,
+            caption pair counters and continuity errors. See `Metrics.to_dict()` and `Metrics.to_json()`.
+
     Returns:
         List of files:
         [
             {
                 'name': 'EMBEDDED' | 'SCTE' | 'ATSC',
                 'channel': 0 | 1,
-                'content': ...,
+                'content': ...,  # SCC text, rendered on first lookup
+                'pts': ...,  # array of PTS per byte pair
+                'pairs': ...,  # array of byte pairs as (a << 8) | b
+                'pts_offset': ...,  # PTS of SCC time 00:00:00:00
             },
         ]
     """
     cc_files: list[SCCFile] = []
     options = set_options(options)
+    if options['scc_frame_rate'] not in FRAME_RATES:
+        raise ValueError('Unsupported SCC frame rate: %s' % options['scc_frame_rate'])
+
+    if isinstance(ts_file, bytes):
+        ts_file = io.BytesIO(ts_file)
+
+    cache = key = None
+    if options['cache_dir']:
+        if metrics is None:
+            metrics = Metrics()
+        previous_stage = metrics.switch('cache')
+        file_fingerprint = fingerprint(ts_file)
+        if file_fingerprint:
+            cache = ResultCache(options['cache_dir'], options['cache_size'])
+            key = cache_key(file_fingerprint, options)
+            cached_files = cache.get(key, options['scc_frame_rate'])
+            if cached_files is not None:
+                metrics.switch(previous_stage)
+                return cast('list[SCCFile]', cached_files)
+        metrics.switch(previous_stage)
+
+    parse_file(ts_file, options, metrics, cc_files=cc_files)
+
+    if cache and key:
+        cache.put(key, cast('list[SccFile]', cc_files))
+    return cc_files
+
+
+def extract_programs(ts_file: bytes | IO[bytes], metrics: Metrics | None = None,
+                     **options) -> dict[int, ProgramCaptions]:
+    """Extracts CEA-608 SCC of the programs of a multi-program TS, in one pass over the file.
+
+    Every program has its own codec parsers and SCC writers. The `programs` option selects them:
+    'all' (default) or a list of program numbers. The other options are those of `extract_scc()`,
+    except that the result is not cached.
+
+    Args:
+        ts_file: TS file
+        metrics: If given, filled with metrics of the extraction, see `extract_scc()`
+
+    Returns:
+        Captions per program number:
+        {
+            program_number: {
+                'service_name': ...,  # Name in the DVB SDT, None if there is none
+                'files': [...],  # SCC files of the program, see `extract_scc()`
+            },
+        }
+    """
+    options = set_options({'programs': 'all', **options})
+    if options['scc_frame_rate'] not in FRAME_RATES:
+        raise ValueError('Unsupported SCC frame rate: %s' % options['scc_frame_rate'])
 
     if isinstance(ts_file, bytes):
         ts_file = io.BytesIO(ts_file)
 
+    programs: dict[int, ProgramCaptions] = {}
+    parse_file(ts_file, options, metrics, program_files=programs)
+    return programs
+
+
+def probe(ts_file: bytes | IO[bytes], metrics: Metrics | None = None, **options) -> ProbeResult:
+    """Reports the captions found in samples of a TS, without extracting them.
+
+    `probe_samples` evenly spaced samples of `probe_seconds` each are parsed, the first one at the start
+    of the file. Of every video PES only the start is parsed, where the SEI (H.264, HEVC) or user data
+    (MPEG-2) with the captions are, so a probe takes a fraction of the time of an extraction.
+    A file that is not seekable is parsed from its position instead. All programs are probed,
+    unless the `programs` option selects some.
+
+    Args:
+        ts_file: TS file
+        metrics: If given, filled with metrics of the parsing, see `extract_scc()`
+
+    Returns:
+        Summary of the captions, JSON serializable:
+        {
+            'samples': ...,  # Number of samples parsed
+            'bytes_read': ...,
+            'has_captions': ...,  # Whether caption data other than padding was found
+            'programs': {
+                program_number: {
+                    'service_name': ...,  # Name in the DVB SDT, None if there is none
+                    'captions': [
+                        {
+                            'source': 'EMBEDDED' | 'SCTE' | 'ATSC',  # As the 'name' of the SCC files
+                            'video': 'H.264' | 'HEVC' | 'MPEG2',
+                            'field': 1 | 2,
+                            'channels': [...],  # 'CC1', 'CC2' in field 1, 'CC3', 'CC4' in field 2
+                            'caption_pairs': ...,
+                            'padding_pairs': ...,
+                        },
+                    ],
+                },
+            },
+        }
+    """
+    from .media_tools.ts import probe_file
+
+    options = set_options({'programs': 'all', **options})
+    if isinstance(ts_file, bytes):
+        ts_file = io.BytesIO(ts_file)
+    summary = probe_file(ts_file, options['probe_samples'], options['probe_seconds'], metrics, **options)
+    return cast('ProbeResult', summary)
+
+
+def parse_file(ts_file: IO[bytes], options: dict[str, Any], metrics: Metrics | None,
+               cc_files: list[SCCFile] | None = None, program_files: dict[int, ProgramCaptions] | None = None,
+               ) -> None:
+    "Parse the TS file with progress and index as set in options, see `handle_file()`."
+    from .media_tools.ts import handle_file, has_time_range
+    from .media_tools.tsindex import get_index
+
+    seeker = None
+    if options['index'] and has_time_range(options):
+        ts_path = getattr(ts_file, 'name', None)
+        if isinstance(ts_path, str) and ts_file.tell() == 0:
+            seeker = get_index(ts_path)
+        else:
+            logger.warning('No index without a file path, seeking in the file instead')
+
     if options['show_progress']:
         with show_progress() as progress_callback:
-            handle_file(ts_file, progress_callback, cc_files, **options)
+            handle_file(ts_file, progress_callback, cc_files, metrics=metrics, seeker=seeker,
+                        program_files=program_files, **options)
     else:
-        handle_file(ts_file, cc_files=cc_files, **options)
-
-    return cc_files
+        handle_file(ts_file, cc_files=cc_files, metrics=metrics, seeker=seeker, program_files=program_files,
+                    **options)
 
 
-def extract_subtitles(ts_file: bytes | IO[bytes], fmt: str = 'SRT', **options) -> str | None:
+def extract_subtitles(ts_file: bytes | IO[bytes], fmt: str = 'SRT', metrics: Metrics | None = None,
+                      **options) -> str | None:
     """Extract subtitles out of TS file.
 
     Args:
         ts_file: TS file
         format: Subtitles format: 'SRT' or 'VTT'
+        metrics: If given, filled with metrics of the extraction, see `extract_scc()`
+    """
+    subs_file = io.StringIO()
+    if not extract_subtitles_to(ts_file, subs_file, fmt, metrics, **options):
+        return None
+    return subs_file.getvalue()
+
+
+def extract_subtitles_to(ts_file: bytes | IO[bytes], subs_file: IO[str], fmt: str = 'SRT',
+                         metrics: Metrics | None = None, sidecar_file: IO[bytes] | None = None,
+                         **options) -> bool:
+    """Extract subtitles out of TS file and write them to a text file, cue by cue.
+
+    Args:
+        ts_file: TS file
+        subs_file: Text file the subtitles are written to, nothing is written if there are none
+        format: Subtitles format: 'SRT' or 'VTT'
+        metrics: If given, filled with metrics of the extraction, see `extract_scc()`
+        sidecar_file: If given, the byte pairs of the SCC files are also written to this binary file
+            as NumPy arrays, see `sidecar.write_npz()`
+
+    Returns:
+        Whether subtitles were written
     """
-    scc_files = extract_scc(ts_file, **options)
+    if metrics is None:
+        metrics = Metrics()
+    scc_files = extract_scc(ts_file, metrics=metrics, **options)
+    if sidecar_file is not None:
+        from .sidecar import write_npz
+
+        metrics.switch('sidecar_write')
+        write_npz(sidecar_file, cast('list[SccFile]', scc_files))
+        metrics.stop()
     if not scc_files:
         logger.error('No EIA captions found!')
+        return False
+
+    metrics.switch('subtitles_write')
+    try:
+        return write_subtitles(scc_files, subs_file, fmt)
+    finally:
+        metrics.stop()
+
+
+def convert_scc(scc_files: list[SCCFile], fmt: str = 'SRT') -> str | None:
+    """Convert the first SCC file with captions to subtitles.
+
+    Args:
+        scc_files: SCC files, as returned by `extract_scc()`
+        format: Subtitles format: 'SRT' or 'VTT'
+    """
+    subs_file = io.StringIO()
+    if not write_subtitles(scc_files, subs_file, fmt):
         return None
+    return subs_file.getvalue()
+
+
+def write_subtitles(scc_files: list[SCCFile], subs_file: IO[str], fmt: str = 'SRT') -> bool:
+    """Write the first SCC file with captions as subtitles to a text file.
+
+    Args:
+        scc_files: SCC files, as returned by `extract_scc()`
+        subs_file: Text file the subtitles are written to
+        format: Subtitles format: 'SRT' or 'VTT'
+
+    Returns:
+        Whether subtitles were written
+    """
+    from .subtitles import write_cues
 
     # TODO extract all files?
     for scc_file in scc_files:
-        try:
-            scc_captions = SCCReader().read(content=scc_file['content'])
-            break
-        except CaptionReadError:
-            scc_captions = None
-
-    if not scc_captions:
-        logger.error('SCC caption read failed!')
-        return None
-
-    if fmt.upper() == 'SRT':
-        return SRTWriter().write(scc_captions)
+        if write_cues(cast('SccFile', scc_file), subs_file, fmt):
+            return True
 
-    return WebVTTWriter().write(scc_captions)
+    logger.error('SCC caption read failed!')
+    return False
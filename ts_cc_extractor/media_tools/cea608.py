@@ -32,6 +32,10 @@ Can generate WebVTT output according to http://www.w3.org/community/texttracks/w
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
+import logging
+import sys
+from array import array
+
 NR_ROWS = 15
 NR_COLS = 32
 
@@ -46,9 +50,14 @@ background_colors = ('white', 'green', 'blue', 'cyan', 'red', 'yellow', 'magenta
 
 
 class Logger(object):
-    "Simple logger class to be able to write with time-stamps and filter_top_boxes on level."
+    """Simple logger class to be able to write with time-stamps and filter_top_boxes on level.
+
+    Every field processor has its own instance, which holds the time of the pairs being decoded.
+    Messages are passed on to the logging module."""
 
     verbose_filter = {'DATA': 3, 'DEBUG': 3, 'INFO': 2, 'WARNING': 2, 'TEXT': 1, 'ERROR': 0}
+    levels = {'DATA': logging.DEBUG, 'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARNING': logging.WARNING,
+              'TEXT': logging.INFO, 'ERROR': logging.ERROR}
 
     def __init__(self, verbose_level=0):
         self.time = ""
@@ -60,19 +69,21 @@ class Logger(object):
     def set_verbose_level(self, verbose_level):
         self.verbose_level = verbose_level
 
+    def is_enabled(self, severity):
+        "Return True if messages of severity would be written (cheap guard before formatting)."
+        return self.verbose_level >= self.verbose_filter.get(severity, 0)
+
     def log(self, severity, msg):
         try:
             minimal_level = self.verbose_filter[severity]
         except KeyError:
-            print("WARNING: Severity %s not defined" % severity)
+            module_logger.warning("Severity %s not defined", severity)
         else:
             if self.verbose_level >= minimal_level:
-                print("%s [%s] %s" % (self.time, severity, msg))
+                module_logger.log(self.levels[severity], "%s [%s] %s", self.time, severity, msg)
 
 
-# Here comes the global logger instance
-logger = Logger()
-# logger = Logger(verbose_level=3)
+module_logger = logging.getLogger(__name__)
 
 byte_to_utf8 = {
     # Regular line-21 character set, mostly ASCII except these exceptions
@@ -176,19 +187,31 @@ byte_to_utf8 = {
 }
 
 
-def get_char_from_byte(byte):
-    "Get character given byte."
+def decode_byte_to_utf8(byte):
+    "Decode character given byte."
     if byte in byte_to_utf8:
-        char = (byte_to_utf8[byte]
-                .encode('latin1')
-                .decode('unicode-escape')
-                .encode('latin1')
-                .decode('utf8'))
+        try:
+            char = (byte_to_utf8[byte]
+                    .encode('latin1')
+                    .decode('unicode-escape')
+                    .encode('latin1')
+                    .decode('utf8'))
+        except UnicodeDecodeError:
+            char = byte_to_utf8[byte]  # A lone backslash is not a valid escape
     else:
         char = chr(byte)
     return char
 
 
+# Decoded characters for all byte values (special characters are offset above 0x7f)
+utf8_chars = tuple(decode_byte_to_utf8(byte) for byte in range(256))
+
+
+def get_char_from_byte(byte):
+    "Get character given byte."
+    return utf8_chars[byte]
+
+
 def old_div(a, b):
     if isinstance(a, int) and isinstance(b, int):
         return a // b
@@ -274,7 +297,8 @@ class Utf8Char(object):
 
 class Row(object):
     "A CEA-608 row consisting of NR_COLS instances of Utf8Char."
-    def __init__(self):
+    def __init__(self, logger):
+        self.logger = logger
         self.uchars = [Utf8Char() for _ in range(NR_COLS)]
         self.pos = 0
         self.is_used = False
@@ -292,7 +316,7 @@ class Row(object):
         return not self.__eq__(other)
 
     def copy(self):
-        r = Row()
+        r = Row(self.logger)
         for i in range(len(r.uchars)):
             r.uchars[i] = self.uchars[i].copy()
         return r
@@ -310,10 +334,10 @@ class Row(object):
         if abs_pos != self.pos:
             self.pos = abs_pos
         if self.pos < 0:
-            logger.log("ERROR", "Negative cursor position %d" % self.pos)
+            self.logger.log("ERROR", "Negative cursor position %d" % self.pos)
             self.pos = 0
         if self.pos > NR_COLS:
-            logger.log("ERROR", "Too large cursor position %d" % self.pos)
+            self.logger.log("ERROR", "Too large cursor position %d" % self.pos)
             self.pos = NR_COLS
 
     def move_cursor(self, rel_pos):
@@ -334,7 +358,7 @@ class Row(object):
             self.back_space()
         uchar = get_char_from_byte(byte)
         if self.pos >= NR_COLS:
-            logger.log("ERROR", "Cannot insert %02x (%s) at position %d. Skipping it!" %
+            self.logger.log("ERROR", "Cannot insert %02x (%s) at position %d. Skipping it!" %
                        (byte, uchar, self.pos))
             return
         self.uchars[self.pos].set_char(uchar, self.currPenState)
@@ -364,6 +388,26 @@ class Row(object):
             utf8str = ""
         return utf8str
 
+    def get_text_segments(self):
+        "Return the column of the first character and the (text, italics) runs up to the last one, or None if blank."
+        uchars = self.uchars
+        first = 0
+        while first < NR_COLS and uchars[first].uchar == ' ':
+            first += 1
+        if first == NR_COLS:
+            return None
+        last = NR_COLS
+        while uchars[last - 1].uchar == ' ':
+            last -= 1
+        segments = []
+        for c in uchars[first:last]:
+            italics = c.penState.italics
+            if segments and segments[-1][1] == italics:
+                segments[-1][0] += c.uchar
+            else:
+                segments.append([c.uchar, italics])
+        return first, [(text, italics) for text, italics in segments]
+
     def setPen(self, foreground=None, underline=None, italics=None, background=None, flash=None):
         if foreground is not None:
             self.currPenState.foreground = foreground
@@ -380,8 +424,9 @@ class Row(object):
 class CaptionScreen(object):
     "Representation of the screen which has 15 rows of 32 characters"
 
-    def __init__(self):
-        self.rows = [Row() for _ in range(NR_ROWS)]  # Note that we use zero-based numbering (0-14)
+    def __init__(self, logger):
+        self.logger = logger
+        self.rows = [Row(logger) for _ in range(NR_ROWS)]  # Note that we use zero-based numbering (0-14)
         self.curr_row = NR_ROWS - 1
         self.nr_roll_up_rows = None
         self.reset()
@@ -403,7 +448,7 @@ class CaptionScreen(object):
         return not self.__eq__(other)
 
     def copy(self):
-        c = CaptionScreen()
+        c = CaptionScreen(self.logger)
         for i in range(len(c.rows)):
             c.rows[i] = self.rows[i].copy()
         return c
@@ -438,12 +483,14 @@ class CaptionScreen(object):
         row.move_cursor(rel_pos)
 
     def set_cursor(self, abs_pos):
-        logger.log("INFO", "set_cursor: %d" % abs_pos)
+        if self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "set_cursor: %d" % abs_pos)
         row = self.rows[self.curr_row]
         row.set_cursor(abs_pos)
 
     def set_pac(self, pac_data):
-        logger.log("INFO", "pac_data = %s" % pac_data)
+        if self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "pac_data = %s" % pac_data)
         new_row = pac_data['row'] - 1
         if self.nr_roll_up_rows:
             if new_row < self.nr_roll_up_rows - 1:
@@ -460,7 +507,8 @@ class CaptionScreen(object):
     def set_bkg_data(self, bkg_data):
         "Set background/extra foreground, but first do back_space, "
         "and then insert space (backwards compatibility)."
-        logger.log("INFO", "bkg_data = %s" % bkg_data)
+        if self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "bkg_data = %s" % bkg_data)
         self.back_space()
         self.setPen(**bkg_data)
         self.insert_char(0x20)  # Space
@@ -472,15 +520,16 @@ class CaptionScreen(object):
     def roll_up(self):
         "Roll up the rolls."
         if self.nr_roll_up_rows is None:
-            logger.log("DEBUG", "roll_up but nr_roll_up_rows not set yet")
+            self.logger.log("DEBUG", "roll_up but nr_roll_up_rows not set yet")
             return  # Not properly setup
-        logger.log("TEXT", self.get_display_text())
+        if self.logger.is_enabled("TEXT"):
+            self.logger.log("TEXT", self.get_display_text())
         top_row_index = self.curr_row + 1 - self.nr_roll_up_rows
         top_row = self.rows.pop(top_row_index)
         top_row.clear()
         self.rows.insert(self.curr_row, top_row)
-        logger.log("INFO", "Rolling up")
-        # logger.log("TEXT", self.get_display_text())
+        self.logger.log("INFO", "Rolling up")
+        # self.logger.log("TEXT", self.get_display_text())
 
     def get_display_text(self):
         "Get all non-empty rows as UTF-8 text."
@@ -497,22 +546,54 @@ class CaptionScreen(object):
     def get_text_and_format(self):
         return self.rows
 
+    def get_cue_rows(self, row_index=None):
+        """Return the non-blank rows as (row number 1-15, column, [(text, italics)]).
+
+        Only the row at row_index, if given."""
+        cue_rows = []
+        for index in range(NR_ROWS) if row_index is None else (row_index,):
+            segments = self.rows[index].get_text_segments()
+            if segments is not None:
+                cue_rows.append((index + 1, segments[0], segments[1]))
+        return cue_rows
+
+
+class OutputFilter(object):
+    """Receiver of the output of a Cea608Channel.
+
+    updateData gets the displayed memory whenever it may have changed. add_cue gets every caption
+    once it is replaced or erased, as the rows of CaptionScreen.get_cue_rows shown from start to end,
+    both times being those given to Cea608FieldProcessor.add_pairs. end is None for a caption still
+    shown at close."""
+
+    def updateData(self, time, screen):
+        pass
+
+    def add_cue(self, start, end, rows):
+        pass
+
+    def close(self):
+        pass
+
 
 class Cea608Channel(object):
     "A CEA608 captioning channel (two in each field)"
 
     modes = ("MODE_ROLL-UP", "MODE_POP-ON", "MODE_PAINT-ON", "MODE_TEXT")
 
-    def __init__(self, channel=1, outputFilter=None, verbose=1):
+    def __init__(self, channel=1, outputFilter=None, verbose=1, logger=None):
         self.channel = channel
         self.verbose = verbose
+        self.logger = logger if logger is not None else Logger()
         self.outputFilter = outputFilter
-        self.displayed_memory = CaptionScreen()
-        self.nondisplayed_memory = CaptionScreen()
+        self.displayed_memory = CaptionScreen(self.logger)
+        self.nondisplayed_memory = CaptionScreen(self.logger)
         self.curr_roll_up_row = self.displayed_memory.rows[NR_ROWS - 1]
         self.write_screen = self.displayed_memory
         self.last_cmd = None
         self.mode = None
+        # Time since the displayed caption is shown, None if there is none
+        self.cue_start = None
 
     def set_pac(self, pac_data):
         "Set Preamble Address Code."
@@ -526,9 +607,13 @@ class Cea608Channel(object):
         "Set the CC mode."
         if new_mode not in self.modes:
             raise KeyError("Mode %s not supported!")
-        logger.log("INFO", "MODE=%s" % new_mode)
+        if self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "MODE=%s" % new_mode)
         if new_mode == self.mode:
             return
+        if new_mode != "MODE_POP-ON":
+            # The displayed memory is erased
+            self.output_cue(start_new=False)
         self.mode = new_mode
         if self.mode == "MODE_POP-ON":
             self.write_screen = self.nondisplayed_memory
@@ -543,21 +628,23 @@ class Cea608Channel(object):
         "Insert characters in the screen."
         for c in chars:
             self.write_screen.insert_char(c)
-        screen = self.write_screen == self.displayed_memory and "DISP" or "NON-DISP"
-        logger.log("INFO", "%s: %s" % (screen, self.write_screen.get_display_text()))
+        if self.logger.is_enabled("INFO"):
+            screen = self.write_screen == self.displayed_memory and "DISP" or "NON-DISP"
+            self.logger.log("INFO", "%s: %s" % (screen, self.write_screen.get_display_text()))
         if self.mode in ("MODE_PAINT-ON", "MODE_ROLL-UP"):
-            logger.log("TEXT", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
+            if self.logger.is_enabled("TEXT"):
+                self.logger.log("TEXT", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
             self.outputDataUpdate()
 
 # Here are Control Code commands corresponding to table
     def cc_RCL(self):
         "Resume Caption Loading"
-        logger.log("DEBUG", "> RCL")
+        self.logger.log("DEBUG", "> RCL")
         self.set_mode("MODE_POP-ON")
 
     def cc_BS(self):
         "Backspace"
-        logger.log("DEBUG", "> BS")
+        self.logger.log("DEBUG", "> BS")
         if self.mode == "MODE_TEXT":
             return
         self.write_screen.back_space()
@@ -573,17 +660,19 @@ class Cea608Channel(object):
 
     def cc_DER(self):
         "Delete to End of Row"
-        logger.log("DEBUG", "> DER")
+        self.logger.log("DEBUG", "> DER")
         self.write_screen.clear_to_end_of_row()
         self.outputDataUpdate()
 
     def cc_RU(self, nr_rows):
         "Roll-Up Captions-2,3,or 4 Rows"
         assert(2 <= nr_rows <= 4)
-        logger.log("INFO", "ROLL-UP %d" % nr_rows)
+        if self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "ROLL-UP %d" % nr_rows)
         self.write_screen = self.displayed_memory
         self.set_mode("MODE_ROLL-UP")
         self.write_screen.set_roll_up_rows(nr_rows)
+        self.output_cue(start_new=True)
 
     def cc_FON(self):
         "Flash On"
@@ -591,8 +680,9 @@ class Cea608Channel(object):
 
     def cc_RDC(self):
         "Resume Direct Captioning"
-        logger.log("DEBUG", "> RDC")
+        self.logger.log("DEBUG", "> RDC")
         self.set_mode("MODE_PAINT-ON")
+        self.output_cue(start_new=True)
 
     def cc_TR(self):
         "Text Restart in text mode."
@@ -606,56 +696,90 @@ class Cea608Channel(object):
 
     def cc_EDM(self):
         "Erase Displayed Memory"
-        logger.log("DEBUG", "> EDM")
+        self.logger.log("DEBUG", "> EDM")
+        self.output_cue(start_new=self.mode != "MODE_POP-ON")
         self.displayed_memory.reset()
         self.outputDataUpdate()
 
     def cc_CR(self):
         "Carriage Return"
-        logger.log("DEBUG", "> CR")
+        self.logger.log("DEBUG", "> CR")
+        if self.mode == "MODE_ROLL-UP" and self.cue_rows():
+            self.output_cue(start_new=True)
         self.write_screen.roll_up()
         self.outputDataUpdate()
 
     def cc_ENM(self):
         "Erase Non-Displayed Memory"
-        logger.log("DEBUG", "> ENM")
+        self.logger.log("DEBUG", "> ENM")
         self.nondisplayed_memory.reset()
 
     def cc_EOC(self):
         "End of Caption (Flip Memories)"
-        logger.log("DEBUG", "> EOC")
+        self.logger.log("DEBUG", "> EOC")
         if self.mode == "MODE_POP-ON":
+            self.output_cue(start_new=False)
             tmp = self.displayed_memory
             self.displayed_memory = self.nondisplayed_memory
             self.nondisplayed_memory = tmp
             self.write_screen = self.nondisplayed_memory
-            logger.log("TEXT", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
-            logger.log("INFO", "NON-DISPLAYED: %s" % self.nondisplayed_memory.get_display_text())
-        else:
-            logger.log("INFO", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
+            if not self.displayed_memory.isEmpty():
+                self.cue_start = self.logger.time
+            if self.logger.is_enabled("TEXT"):
+                self.logger.log("TEXT", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
+            if self.logger.is_enabled("INFO"):
+                self.logger.log("INFO", "NON-DISPLAYED: %s" % self.nondisplayed_memory.get_display_text())
+        elif self.logger.is_enabled("INFO"):
+            self.logger.log("INFO", "DISPLAYED: %s" % self.displayed_memory.get_display_text())
         self.outputDataUpdate()
 
     def cc_TO(self, nr_cols):
         "Tab Offset 1,2, or 3 columns"
         assert(1 <= nr_cols <= 3)
-        logger.log("DEBUG", "Tab Offset - TO%d" % nr_cols)
+        if self.logger.is_enabled("DEBUG"):
+            self.logger.log("DEBUG", "Tab Offset - TO%d" % nr_cols)
         self.write_screen.move_cursor(nr_cols)
 
     def cc_MIDROW(self, second_byte):
         "Parse MIDROW command."
-        underline = second_byte % 2 == 1
-        italics = second_byte >= 0x2e
-        if not italics:
-            color_index = old_div(second_byte, 2) - 0x10
-            colors = ["white", "green", "blue", "cyan", "red", "yellow", "magenta"]
-            color = colors[color_index]
-        else:
-            color = "white"
+        self.set_midrow(*interpret_midrow(second_byte))
+
+    def set_midrow(self, color, underline, italics):
+        "Set pen from decoded MIDROW attributes. The code is shown as a space before the new style."
+        self.write_screen.insert_char(0x20)
         self.write_screen.setPen(color, underline, italics, flash=False)
 
     def outputDataUpdate(self):
         if self.outputFilter:
-            self.outputFilter.updateData(logger.time, self.displayed_memory)
+            self.outputFilter.updateData(self.logger.time, self.displayed_memory)
+
+    def cue_rows(self):
+        "Rows of the displayed caption. In roll-up mode every row is a caption of its own, so only the base row."
+        if self.mode == "MODE_ROLL-UP":
+            return self.displayed_memory.get_cue_rows(self.displayed_memory.curr_row)
+        return self.displayed_memory.get_cue_rows()
+
+    def output_cue(self, start_new):
+        """Pass the displayed caption to the output filter as a cue ending now.
+
+        The next cue starts now if start_new, as in paint-on and roll-up mode where the caption is built
+        on screen, else when a caption is next displayed."""
+        if not self.outputFilter:
+            return
+        time = self.logger.time
+        if self.cue_start is not None and time > self.cue_start:
+            rows = self.cue_rows()
+            if rows:
+                self.outputFilter.add_cue(self.cue_start, time, rows)
+        self.cue_start = time if start_new else None
+
+    def close(self):
+        "Pass the caption still displayed to the output filter, without an end."
+        if self.outputFilter and self.cue_start is not None:
+            rows = self.cue_rows()
+            if rows:
+                self.outputFilter.add_cue(self.cue_start, None, rows)
+        self.cue_start = None
 
 
 PARITY_CHECK_TABLE = (0, 1, 1, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0, 1, 1, 0)
@@ -668,25 +792,181 @@ def odd_parity_check(byte):
     return PARITY_CHECK_TABLE[high_nible] != PARITY_CHECK_TABLE[low_nibble]
 
 
+# bytes.translate() table stripping the parity bit, bytes with bad parity become BAD_PARITY.
+# Cleaned bytes are 7-bit, so a byte pair with bad parity has a code with a bit in 0x8080 set.
+BAD_PARITY = 0x80
+PARITY_STRIP_TABLE = bytes((byte & 0x7f) if odd_parity_check(byte) else BAD_PARITY for byte in range(256))
+
+# Byte pairs are read as big-endian 16-bit codes (a << 8) | b
+SWAP_CODES = sys.byteorder == 'little'
+
+
+# Control commands (Table F.1.1.4) keyed by second byte, as (Cea608Channel method, arguments)
+control_commands = {
+    0x20: ('cc_RCL', ()),
+    0x21: ('cc_BS', ()),
+    0x22: ('cc_AOF', ()),
+    0x23: ('cc_AON', ()),
+    0x24: ('cc_DER', ()),
+    0x25: ('cc_RU', (2,)),
+    0x26: ('cc_RU', (3,)),
+    0x27: ('cc_RU', (4,)),
+    0x28: ('cc_FON', ()),
+    0x29: ('cc_RDC', ()),
+    0x2A: ('cc_TR', ()),
+    0x2B: ('cc_RTD', ()),
+    0x2C: ('cc_EDM', ()),
+    0x2D: ('cc_CR', ()),
+    0x2E: ('cc_ENM', ()),
+    0x2F: ('cc_EOC', ()),
+}
+
+
+def interpret_midrow(byte):
+    "Interpret the second byte of a MIDROW command, and return (color, underline, italics)."
+    underline = byte % 2 == 1
+    italics = byte >= 0x2e
+    if not italics:
+        color_index = old_div(byte, 2) - 0x10
+        colors = ["white", "green", "blue", "cyan", "red", "yellow", "magenta"]
+        color = colors[color_index]
+    else:
+        color = "white"
+    return (color, underline, italics)
+
+
+def interpret_pac(row, byte):
+    "Interpret the second byte of the pac, and return the information."
+    pac_index = byte
+    color = 'None'
+    italics = False
+    indent = None
+    if byte > 0x5F:
+        pac_index = byte - 0x60
+    else:
+        pac_index = byte - 0x40
+    underline = (pac_index & 1) == 1
+    if pac_index <= 0xd:
+        color = ['white', 'green', 'blue', 'cyan', 'red',
+                 'yellow', 'magenta', 'white'][old_div(pac_index, 2)]
+    elif pac_index <= 0xf:
+        italics = True
+        color = 'white'
+    else:
+        indent = old_div(pac_index - 0x10, 2) * 4
+    # Note that we have a zero-offset for the row
+    return {'color': color, 'underline': underline, 'italics': italics, 'indent': indent, 'row': row}
+
+
+def interpret_background_attributes(a, b):
+    "Interpret extended background attributes as well as new foreground color black."
+    data = {}
+    if a in (0x10, 0x18):
+        index = old_div(b - 0x20, 2)
+        data['background'] = background_colors[index]
+        if b % 2 == 1:
+            data['background'] = "%s_semi" % data['background']
+    elif b == 0x2d:
+        data['background'] = "transparent"
+    else:
+        data['foreground'] = "black"
+        if b == 0x2f:
+            data['underline'] = True
+    return data
+
+
+def decode_pair(a, b):
+    """Decode a cleaned (7-bit) byte pair.
+
+    Returns (kind, channel, args) where kind is one of 'cmd', 'midrow', 'pac',
+    'bkg', 'chars' or 'other'. The checks are done in the order of priority
+    of the CEA-608 code space, so that e.g. 0x17 0x21 is a Tab Offset and not a PAC."""
+    if (a in (0x14, 0x1C) and (0x20 <= b <= 0x2F)) or (a in (0x17, 0x1F) and (0x21 <= b <= 0x23)):
+        channel = 1 if a in (0x14, 0x17) else 2
+        if a in (0x14, 0x1C):
+            method_name, method_args = control_commands[b]
+        else:
+            method_name, method_args = 'cc_TO', (b - 0x20,)
+        return ('cmd', channel, (getattr(Cea608Channel, method_name), method_args))
+
+    if a in (0x11, 0x19) and 0x20 <= b <= 0x2f:
+        return ('midrow', 1 if a == 0x11 else 2, interpret_midrow(b))
+
+    if (((0x11 <= a <= 0x17 or 0x19 <= a <= 0x1F) and (0x40 <= b <= 0x7F))
+            or (a in (0x10, 0x18) and (0x40 <= b <= 0x5F))):
+        channel = 1 if a <= 0x17 else 2
+        if 0x40 <= b <= 0x5F:
+            row = (rows_low_ch1 if channel == 1 else rows_low_ch2)[a]
+        else:  # 0x60 <= b <= 0x7F
+            row = (rows_high_ch1 if channel == 1 else rows_high_ch2)[a]
+        return ('pac', channel, interpret_pac(row, b))
+
+    if (a in (0x10, 0x18) and 0x20 <= b <= 0x2f) or (a in (0x17, 0x1f) and 0x2d <= b <= 0x2f):
+        return ('bkg', 1 if a < 0x18 else 2, interpret_background_attributes(a, b))
+
+    char_1 = a - 8 if a >= 0x19 else a
+    if 0x11 <= char_1 <= 0x13:
+        # Special character. The channel is only informative, chars go to the current channel
+        offset = {0x11: 0x50, 0x12: 0x70, 0x13: 0x90}[char_1]
+        return ('chars', 2 if a >= 0x19 else 1, (b + offset,))
+    if 0x20 <= a <= 0x7f:
+        return ('chars', None, (a,) if b == 0 else (a, b))
+
+    return ('other', None, None)
+
+
+# Lazily built table of decoded pairs, indexed by the cleaned pair code (a << 8) | b
+# It is never modified, so concurrent builds in several threads just produce equal tables.
+_pair_table = None
+
+
+def get_pair_table():
+    "Return the table mapping every cleaned byte pair to (handler, channel, args)."
+    global _pair_table
+    if _pair_table is None:
+        handlers = {
+            'cmd': Cea608FieldProcessor.handle_cmd,
+            'midrow': Cea608FieldProcessor.handle_midrow,
+            'pac': Cea608FieldProcessor.handle_pac,
+            'bkg': Cea608FieldProcessor.handle_bkg,
+            'chars': Cea608FieldProcessor.handle_chars,
+            'other': Cea608FieldProcessor.handle_other,
+        }
+        table = [None] * (1 << 15)
+        for a in range(0x80):
+            for b in range(0x80):
+                kind, channel, args = decode_pair(a, b)
+                table[(a << 8) | b] = (handlers[kind], channel, args)
+        _pair_table = tuple(table)
+    return _pair_table
+
+
 class Cea608FieldProcessor(object):
     """Parse and process an CEA-608 field provided byte pairs via add_data.
 
     The data is sorted according to time, to get the right order."""
 
-    def __init__(self, field=1, outputFilter1=None, outputFilter2=None):
+    def __init__(self, field=1, outputFilter1=None, outputFilter2=None, logger=None):
         self.field = field
-        self.caption_channels = [Cea608Channel(1, outputFilter1), Cea608Channel(2, outputFilter2)]
+        self.logger = logger if logger is not None else Logger()
+        self.caption_channels = [Cea608Channel(1, outputFilter1, logger=self.logger),
+                                 Cea608Channel(2, outputFilter2, logger=self.logger)]
         self.current_channel = None
         self.last_cmd = None
         self.buffered_data = []  # Entries are (time, (list of byte pairs))
         self.data_counters = {'padding': 0, 'char': 0, 'cmd': 0, 'other': 0}
+        self.dropped_pairs = 0  # Pairs with bad parity
+        self.used_channels = set()  # Channels (1 or 2) with commands or preamble address codes
         self.start_time = None
         self.last_time = None
         self.outputFilter1 = outputFilter1
         self.outputFilter2 = outputFilter2
+        self.pair_table = get_pair_table()
 
     def close(self):
         "Close files"
+        for caption_channel in self.caption_channels:
+            caption_channel.close()
         if self.outputFilter1:
             self.outputFilter1.close()
 
@@ -711,222 +991,108 @@ class Cea608FieldProcessor(object):
 
     def add_data(self, data, time_data):
         "Add data as pair of bytes. time_data needs to be sortable."
-        if self.start_time is None:
-            self.start_time = time_data
-        self.last_time = time_data
-        logger.set_time(time_data)
-        if (not odd_parity_check(data[0])) or (not odd_parity_check(data[1])):
-            # print "WARNING: Bad parity data: (%02x, %02x)" % data
-            return
-        cleaned_data = (data[0] & 0x7f, data[1] & 0x7f)
-        if cleaned_data == (0, 0):
-            self.data_counters['padding'] += 2
-            return
-        else:
-            logger.log("DATA", "(%02x, %02x) [%02x, %02x]" %
-                       (data[0], data[1], data[0] & 0x7f, data[1] & 0x7f))
-
-        cmd_found = self.parse_cmd(cleaned_data)
-        if not cmd_found:
-            cmd_found = self.parse_midrow(cleaned_data)
-        if not cmd_found:
-            cmd_found = self.parse_pac(cleaned_data)
-        if not cmd_found:
-            cmd_found = self.parse_background_attributes(cleaned_data)
-        if not cmd_found:
-            chars_found = self.parse_char(cleaned_data)
-            if chars_found:
-                if self.current_channel is not None:
-                    ch = self.caption_channels[self.current_channel - 1]
-                    ch.insert_chars(chars_found)
-                else:
-                    logger.log("WARNING", "No channel found yet. TEXT-MODE?")
-        if cmd_found:
-            self.data_counters['cmd'] += 2
-        elif chars_found:
-            self.data_counters['char'] += 2
-        else:
-            self.data_counters['other'] += 2
-            logger.log("WARNING", "Couldn't parse cleaned data (%02x,%02x)" % cleaned_data)
+        self.add_pairs(bytes(data), time_data)
 
-    def parse_cmd(self, data):
-        "Parse and act on a command."
-        a, b = data
+    def count_padding(self, time_data, nr_pairs=1):
+        "Count padding pairs that were dropped before reaching add_data."
+        if self.start_time is None or time_data < self.start_time:
+            self.start_time = time_data
+        if self.last_time is None or time_data > self.last_time:
+            self.last_time = time_data
+        self.data_counters['padding'] += 2 * nr_pairs
 
-        if not ((a in (0x14, 0x1C) and (0x20 <= b <= 0x2F)) or (a in (0x17, 0x1F) and (0x21 <= b <= 0x23))):
-            return False
+    def add_pairs(self, data, time_data):
+        """Add data as bytes of consecutive byte pairs, all for the same time_data.
 
-        if data == self.last_cmd:
+        Parity is checked and stripped for all pairs at once, and pairs with bad
+        parity as well as padding are dropped before dispatching."""
+        if self.start_time is None:
+            self.start_time = time_data
+        self.last_time = time_data
+        self.logger.set_time(time_data)
+        if len(data) & 1:
+            data = data[:-1]
+        codes = array('H', data.translate(PARITY_STRIP_TABLE))
+        if SWAP_CODES:
+            codes.byteswap()
+        nr_padding = codes.count(0)
+        if nr_padding:
+            self.data_counters['padding'] += 2 * nr_padding
+            if nr_padding == len(codes):
+                return
+
+        pair_table = self.pair_table
+        data_counters = self.data_counters
+        log_data = self.logger.is_enabled("DATA")
+        for i, code in enumerate(codes):
+            if not code or code & 0x8080:
+                if code:
+                    self.dropped_pairs += 1
+                continue  # Padding or bad parity
+            if log_data:
+                self.logger.log("DATA", "(%02x, %02x) [%02x, %02x]" %
+                           (data[2 * i], data[2 * i + 1], code >> 8, code & 0xff))
+            handler, channel, args = pair_table[code]
+            data_counters[handler(self, code, channel, args)] += 2
+
+    # Handlers of decoded pairs, see get_pair_table(). They return the data counter to increment.
+    def handle_cmd(self, code, channel, args):
+        "Act on a command."
+        if code == self.last_cmd:
             self.last_cmd = None
-            logger.log("DEBUG", "Repeated cmd (%x,%x)" % data)
-            return True  # Repeated commands are dropped (once)
-
-        channel = None
-        if a in (0x14, 0x17):
-            channel = 1
-        elif a in (0x1C, 0x1f):
-            channel = 2
-        ch = self.caption_channels[channel - 1]
-
-        if a in (0x14, 0x1C):
-            # Follow CEA-608 Table F.1.1.4
-            if b == 0x20:
-                ch.cc_RCL()
-            elif b == 0x21:
-                ch.cc_BS()
-            elif b == 0x22:
-                ch.cc_AOF()
-            elif b == 0x23:
-                ch.cc_AON()
-            elif b == 0x24:
-                ch.cc_DER()
-            elif b == 0x25:
-                ch.cc_RU(2)
-            elif b == 0x26:
-                ch.cc_RU(3)
-            elif b == 0x27:
-                ch.cc_RU(4)
-            elif b == 0x28:
-                ch.cc_FON()
-            elif b == 0x29:
-                ch.cc_RDC()
-            elif b == 0x2A:
-                ch.cc_TR()
-            elif b == 0x2B:
-                ch.cc_RTD()
-            elif b == 0x2C:
-                ch.cc_EDM()
-            elif b == 0x2D:
-                ch.cc_CR()
-            elif b == 0x2E:
-                ch.cc_ENM()
-            elif b == 0x2F:
-                ch.cc_EOC()
-        else:  # a in (0x17, 0x1F):
-            ch.cc_TO(b - 0x20)
-        self.last_cmd = data
+            if self.logger.is_enabled("DEBUG"):
+                self.logger.log("DEBUG", "Repeated cmd (%x,%x)" % (code >> 8, code & 0xff))
+            return 'cmd'  # Repeated commands are dropped (once)
+        method, method_args = args
+        method(self.caption_channels[channel - 1], *method_args)
+        self.last_cmd = code
         self.current_channel = channel
-        return True
-
-    def parse_midrow(self, data):
-        "Parse midrow styling command"
-        a, b = data
-        if a in (0x11, 0x19) and 0x20 <= b <= 0x2f:
-            if a == 0x11:
-                channel = 1
-            else:
-                channel = 2
-            if channel != self.current_channel:
-                raise Exception("Mismatch channel in midrow parsing")
-            ch = self.caption_channels[channel - 1]
-            ch.cc_MIDROW(b)
-            logger.log("DEBUG", "MIDROW %x %x" % data)
-            return True
-        return False
-
-    def parse_pac(self, data):
-        "Parse Preable Access Codes (Table 53)."
-        a, b = data
-        if not (((0x11 <= a <= 0x17 or 0x19 <= a <= 0x1F) and (0x40 <= b <= 0x7F))
-           or (a in (0x10, 0x18) and (0x40 <= b <= 0x5F))):
-            return False
-
-        if data == self.last_cmd:
+        self.used_channels.add(channel)
+        return 'cmd'
+
+    def handle_midrow(self, code, channel, args):
+        "Act on a midrow styling command."
+        if channel != self.current_channel:
+            raise Exception("Mismatch channel in midrow parsing")
+        if code == self.last_cmd:
             self.last_cmd = None
-            return True  # Repeated commands are dropped (once)
-
-        if a <= 0x17:
-            channel = 1
-        else:
-            channel = 2
-
-        if 0x40 <= b <= 0x5F:
-            if channel == 1:
-                row = rows_low_ch1[a]
-            else:
-                row = rows_low_ch2[a]
-        else:  # 0x60 <= b <= 0x7F
-            if channel == 1:
-                row = rows_high_ch1[a]
-            else:
-                row = rows_high_ch2[a]
-        pac_data = self.interpret_pac(row, b)
-        ch = self.caption_channels[channel - 1]
-        ch.set_pac(pac_data)
-        self.last_cmd = data
+            return 'cmd'  # Repeated commands are dropped (once)
+        self.caption_channels[channel - 1].set_midrow(*args)
+        self.last_cmd = code
+        if self.logger.is_enabled("DEBUG"):
+            self.logger.log("DEBUG", "MIDROW %x %x" % (code >> 8, code & 0xff))
+        return 'cmd'
+
+    def handle_pac(self, code, channel, args):
+        "Act on a Preamble Address Code (Table 53)."
+        if code == self.last_cmd:
+            self.last_cmd = None
+            return 'cmd'  # Repeated commands are dropped (once)
+        self.caption_channels[channel - 1].set_pac(dict(args))
+        self.last_cmd = code
         self.current_channel = channel
-        return True
-
-    def interpret_pac(self, row, byte):
-        "Interpret the second byte of the pac, and return the information."
-        pac_index = byte
-        color = 'None'
-        italics = False
-        indent = None
-        if byte > 0x5F:
-            pac_index = byte - 0x60
-        else:
-            pac_index = byte - 0x40
-        underline = (pac_index & 1) == 1
-        if pac_index <= 0xd:
-            color = ['white', 'green', 'blue', 'cyan', 'red',
-                     'yellow', 'magenta', 'white'][old_div(pac_index, 2)]
-        elif pac_index <= 0xf:
-            italics = True
-            color = 'white'
-        else:
-            indent = old_div(pac_index - 0x10, 2) * 4
-        # Note that we have a zero-offset for the row
-        return {'color': color, 'underline': underline, 'italics': italics, 'indent': indent, 'row': row}
-
-    def parse_char(self, data):
-        "Return an array with 1 to 2 bytes corresponding to chars, if found. None otherwise."
-        a, b = data
-        chars = None
-        if a >= 0x19:
-            channel = 2
-            char_1 = a - 8
-        else:
-            channel = 1
-            char_1 = a
-        if 0x11 <= char_1 <= 0x13:
-            # Special character
-            c = b
-            if char_1 == 0x11:
-                c = b + 0x50
-            elif char_1 == 0x12:
-                c = b + 0x70
-            else:
-                c = b + 0x90
-            logger.log("INFO", "Special char %s in channel %d" % (byte_to_utf8[c], channel))
-            chars = (c,)
-        elif 0x20 <= a <= 0x7f:
-            if b == 0:
-                chars = (a,)
-            else:
-                chars = (a, b)
-        if chars:
-            logger.log("DEBUG", "Chars = %s" % ",".join(["%02x" % c for c in chars]))
-        return chars
-
-    def parse_background_attributes(self, data):
-        "Parse extended background attributes as well as new foreground color black."
-        a, b = data
-        if not ((a in (0x10, 0x18) and 0x20 <= b <= 0x2f) or ((a in (0x17, 0x1f) and 0x2d <= b <= 0x2f))):
-            return False
-        data = {}
-        if a in (0x10, 0x18):
-            index = old_div(b - 0x20, 2)
-            data['background'] = background_colors[index]
-            if b % 2 == 1:
-                data['background'] = "%s_semi" % data['background']
-        elif b == 0x2d:
-            data['background'] = "transparent"
+        self.used_channels.add(channel)
+        return 'cmd'
+
+    def handle_bkg(self, code, channel, args):
+        "Act on extended background attributes as well as new foreground color black."
+        self.caption_channels[channel - 1].set_bkg_data(args)
+        return 'cmd'
+
+    def handle_chars(self, code, channel, args):
+        "Insert 1 to 2 characters in the current channel."
+        if self.logger.is_enabled("INFO") and channel is not None:
+            self.logger.log("INFO", "Special char %s in channel %d" % (get_char_from_byte(args[0]), channel))
+        if self.logger.is_enabled("DEBUG"):
+            self.logger.log("DEBUG", "Chars = %s" % ",".join(["%02x" % c for c in args]))
+        if self.current_channel is not None:
+            self.caption_channels[self.current_channel - 1].insert_chars(args)
         else:
-            data['foreground'] = "black"
-            if b == 0x2f:
-                data['underline'] = True
-        channel = (a < 0x18) and 1 or 2
-        ch = self.caption_channels[channel - 1]
-        ch.set_bkg_data(data)
-        return True
+            self.logger.log("WARNING", "No channel found yet. TEXT-MODE?")
+        return 'char'
+
+    def handle_other(self, code, channel, args):
+        "Count data that could not be decoded."
+        if self.logger.is_enabled("WARNING"):
+            self.logger.log("WARNING", "Couldn't parse cleaned data (%02x,%02x)" % (code >> 8, code & 0xff))
+        return 'other'
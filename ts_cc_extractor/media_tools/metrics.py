@@ -0,0 +1,60 @@
+"""Timings and counters of an extraction.
+
+The time is charged to one stage at a time. Parsers switch to their own stage and back,
+so the time of a stage does not include the stages it calls. A switch costs one clock read.
+No time is charged before the first switch and after stop().
+"""
+
+import json
+import time
+
+
+class Metrics(object):
+    "Time per stage and counters of an extraction."
+
+    def __init__(self):
+        self.stage_times = {}
+        self.stage = None
+        self.last_time = time.perf_counter()
+        self.pids = {}
+        self.captions = {}
+        self.counters = {'packets': 0, 'bytes': 0, 'stuffing_packets': 0, 'transport_errors': 0,
+                         'cc_errors': 0, 'duplicate_packets': 0, 'crc_errors': 0}
+
+    def switch(self, stage):
+        "Charge the time since the last switch to the current stage, and make stage current. Returns the previous stage."
+        now = time.perf_counter()
+        previous = self.stage
+        if previous is not None:
+            self.stage_times[previous] = self.stage_times.get(previous, 0.0) + now - self.last_time
+        self.stage = stage
+        self.last_time = now
+        return previous
+
+    def stop(self):
+        "Stop charging time to any stage."
+        self.switch(None)
+
+    def set_caption_counters(self, name, counters):
+        "Set counters of the caption stream name, e.g. 'ATSC-0'."
+        self.captions[name] = counters
+
+    def to_dict(self):
+        "Return metrics as a dict of plain types."
+        totals = {}
+        for counters in self.captions.values():
+            for key, value in counters.items():
+                totals[key] = totals.get(key, 0) + value
+        counters = dict(self.counters)
+        counters.update(totals)
+        return {
+            'stage_times': dict(self.stage_times),
+            'total_time': sum(self.stage_times.values()),
+            'counters': counters,
+            'pids': dict((str(pid), dict(pid_counters)) for pid, pid_counters in self.pids.items()),
+            'captions': dict((name, dict(caption)) for name, caption in self.captions.items()),
+        }
+
+    def to_json(self, **kwargs):
+        "Return metrics as JSON, kwargs are passed to json.dumps."
+        return json.dumps(self.to_dict(), **kwargs)
@@ -34,15 +34,19 @@ Reference: http://www.theneitherworld.com/mcpoodle/SCC_TOOLS/DOCS/SCC_FORMAT.HTM
 #  ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 #  POSSIBILITY OF SUCH DAMAGE.
 
-import io
+import logging
+import sys
+from array import array
 
-from . import cea608
+from . import cea608, timecode
+from .metrics import Metrics
 
+logger = logging.getLogger(__name__)
 
-def old_div(a, b):
-    if isinstance(a, int) and isinstance(b, int):
-        return a // b
-    return a / b
+# CEA-608 null padding, (0x00, 0x00) with odd parity
+PADDING_PAIR = (0x80, 0x80)
+# Number of timestamps held back for sorting, when the reordering of the stream is unknown
+SORTING_OVERLAP = 5
 
 
 class SccParser(object):
@@ -93,95 +97,214 @@ class SccParser(object):
         self.cea608_field_processor.close()
 
 
+class SccFile(dict):
+    """SCC data of a channel, as appended to cc_files by SccWriter.
+
+    Besides 'name' and 'channel', the byte pairs are kept as parallel arrays:
+    'pts' (unwrapped PTS of each pair) and 'pairs' (each pair as (a << 8) | b),
+    with 'pts_offset' being the PTS of SCC time 00:00:00:00.
+    The SCC text 'content' is only rendered when it is first looked up,
+    with timecodes at frame_rate (see timecode.FRAME_RATES)."""
+
+    def __init__(self, name, channel, pts, pairs, pts_offset, line_ends, frame_rate='30'):
+        dict.__init__(self, name=name, channel=channel, pts=pts, pairs=pairs, pts_offset=pts_offset)
+        self.line_ends = line_ends
+        self.frame_rate = frame_rate
+
+    def __missing__(self, key):
+        if key != 'content':
+            raise KeyError(key)
+        content = self.render()
+        self['content'] = content
+        return content
+
+    def render(self):
+        "Render the SCC text, one line per time stamp."
+        pairs = array('H', self['pairs'])
+        if cea608.SWAP_CODES:
+            pairs.byteswap()
+        hex_pairs = hex_join(pairs.tobytes())
+        pts = self['pts']
+        pts_offset = self['pts_offset']
+        line_starts = [0]
+        line_starts.extend(self.line_ends[:-1])
+        time_strings = timecode.TimecodeFormat(self.frame_rate).format_many(
+            [pts[start] - pts_offset for start in line_starts])
+        lines = ["Scenarist_SCC V1.0"]
+        # Each pair takes 4 hex digits and a separating space
+        lines.extend("%s %s" % (time_str, hex_pairs[5 * start:5 * end - 1])
+                     for time_str, start, end in zip(time_strings, line_starts, self.line_ends))
+        return "\n\n".join(lines) + "\n"
+
+    def clip(self, start_pts, end_pts=None, preroll=0):
+        """Return the lines from start_pts to end_pts as a new SccFile, with SCC time 0 at start_pts.
+
+        Lines up to preroll before start_pts are kept at start_pts, so that a caption loaded
+        or shown before the start is complete. PTS values may be wrapped."""
+        pts_offset = self['pts_offset']
+        # Unwrap start_pts and end_pts next to the PTS values of this file
+        half_wrap = timecode.PTS_WRAP // 2
+        start = pts_offset + (start_pts - pts_offset + half_wrap) % timecode.PTS_WRAP - half_wrap
+        end = start + (end_pts - start_pts) % timecode.PTS_WRAP if end_pts is not None else None
+        pts = self['pts']
+        pairs = self['pairs']
+        clipped_pts = array('q')
+        clipped_pairs = array('H')
+        clipped_line_ends = array('L')
+        line_start = 0
+        for line_end in self.line_ends:
+            line_pts = pts[line_start]
+            if line_pts >= start - preroll and (end is None or line_pts < end):
+                clipped_pairs.extend(pairs[line_start:line_end])
+                clipped_pts.extend([max(line_pts, start)] * (line_end - line_start))
+                clipped_line_ends.append(len(clipped_pairs))
+            line_start = line_end
+        return SccFile(self['name'], self['channel'], clipped_pts, clipped_pairs, start, clipped_line_ends,
+                       self.frame_rate)
+
+
+def hex_join(data):
+    "Hex string of data with a space between each pair of bytes."
+    if sys.version_info >= (3, 8):
+        return data.hex(' ', 2)
+    hex_data = data.hex()
+    return ' '.join(hex_data[i:i + 4] for i in range(0, len(hex_data), 4))
+
+
+def time_string(delta_time, frame_rate='30'):
+    "Calculate time string in scenarist format for a non-negative PTS delta. Default is 30Hz."
+    return timecode.TimecodeFormat(frame_rate).format(delta_time)
+
+
 class SccWriter(object):
     """Collect CEA-608 and write SCC file for a channel.
 
     Make filename given base. No file if no data.
     Lines are sorted according to time stamp to handle B-frames.
+    The byte pairs are stored in arrays, and only rendered as SCC text on demand, see SccFile,
+    with timecodes at frame_rate.
     """
 
-    def __init__(self, base_name=None, channel=0, cc_files=None):
-        self.file_handle = None
+    def __init__(self, base_name=None, channel=0, cc_files=None, metrics=None, frame_rate='30'):
         self.cc_files = cc_files
+        self.frame_rate = frame_rate
         self.base_name = base_name
         self.channel = channel
-        self.pts_offset = None
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.dropped_pairs = 0
+        self.timeline = timecode.PtsTimeline()
+        self.first_pts_offset = None
+        self.first_padding_pts = None
         self.data_sorter = DataSorter()
+        self.sorting_overlap = SORTING_OVERLAP
         self.written_header = False
+        self.reset_data()
         self.cea608_field_processor = cea608.Cea608FieldProcessor(channel)
 
+    def reset_data(self):
+        "Start new arrays of pts and byte pairs."
+        self.pts = array('q')
+        self.pairs = array('H')
+        self.line_ends = array('L')
+
     def get_cc_summary(self):
         "Get summary of CEA-608 data."
         cc = self.cea608_field_processor.get_cc_summary()
         return cc
 
+    def calc_delta_time(self, new_pts):
+        "Calculate PTS relative to pts_offset, handling wrap-around."
+        return self.timeline.delta(new_pts)
+
     def calc_time_string(self, new_pts):
         "Calculate time string in scenarist format. This is done for 30Hz."
-        delta_time = new_pts - self.pts_offset
-        if delta_time < -1 * (1 << 32):
-            self.pts_offset -= 1 << 33
-            print("WARNING: PTS wrap-around")
-            delta_time = new_pts - self.pts_offset
-        r_time = delta_time
-        hours = old_div(r_time, 3600 * 90000)
-        r_time = r_time - hours * (3600 * 90000)
-        minutes = old_div(r_time, 60 * 90000)
-        r_time = r_time - minutes * (60 * 90000)
-        seconds = old_div(r_time, 90000)
-        r_time = r_time - seconds * 90000
-        frames = old_div(r_time, 3000)  # 30Hz
-        return "%02d:%02d:%02d:%02d" % (hours, minutes, seconds, frames)
+        delta_time = self.calc_delta_time(new_pts)
+        if delta_time < 0:
+            return "-" + time_string(-delta_time, self.frame_rate)
+        return time_string(delta_time, self.frame_rate)
 
     def add_data(self, byte_pair, pts_time):
         "Add a pair of bytes for a given pts_time."
-        if not self.file_handle and self.base_name and self.cc_files is not None:
-            self.file_handle = io.BytesIO()
-            self.file_handle.write(b"Scenarist_SCC V1.0")
+        if not self.written_header and self.base_name and self.cc_files is not None:
             self.written_header = True
         self.data_sorter.add_data(pts_time, byte_pair)
-        self.write_lines()
+        self.write_lines(self.sorting_overlap)
 
-    def write_lines(self, sorting_overlap=5):
-        "Write lines in scenarist file."
+    def count_padding(self, pts_time):
+        """Count a padding pair for a given pts_time, without adding it to the SCC data.
+
+        The earliest padding time is kept, so that SCC time stamps are still relative
+        to the start of the stream if no explicit pts offset is set."""
+        if self.timeline.pts_offset is None and (self.first_padding_pts is None or pts_time < self.first_padding_pts):
+            self.first_padding_pts = pts_time
+        self.cea608_field_processor.count_padding(pts_time)
+
+    def write_lines(self, sorting_overlap=SORTING_OVERLAP):
+        "Write lines of byte pairs to the arrays and the CEA-608 processor."
+        switch = self.metrics.switch
+        previous_stage = switch('scc_write')
         data_list = self.data_sorter.retrieve_data(sorting_overlap)
 
         for data_line in data_list:
             pts_time, data = data_line
-            if self.pts_offset is None:
-                self.pts_offset = pts_time
-            line = "%s" % self.calc_time_string(pts_time)
-            if line[0] == "-":
-                print("WARNING: Negative timestamp for SCC %s" % line)
+            if self.timeline.pts_offset is None:
+                self.timeline.pts_offset = pts_time
+                if self.first_padding_pts is not None and self.first_padding_pts < pts_time:
+                    self.timeline.pts_offset = self.first_padding_pts
+            if self.first_pts_offset is None:
+                self.first_pts_offset = int(self.timeline.pts_offset)
+            delta_time = self.calc_delta_time(pts_time)
+            if delta_time < 0:
+                logger.warning("Negative timestamp for SCC -%s", time_string(-delta_time))
+                self.dropped_pairs += len(data)
                 continue
-            for byte_pair in data:
-                line += (" %02x%02x" % byte_pair)
-                self.cea608_field_processor.add_data(byte_pair, pts_time)
-            if self.file_handle:
-                self.file_handle.write(str.encode("\n\n%s" % line))
+            line_data = bytes(b for byte_pair in data for b in byte_pair)
+            switch('cea608_decode')
+            self.cea608_field_processor.add_pairs(line_data, pts_time)
+            switch('scc_write')
+            if self.written_header:
+                line_pairs = array('H', line_data)
+                if cea608.SWAP_CODES:
+                    line_pairs.byteswap()
+                self.pairs.extend(line_pairs)
+                # Unwrapped PTS, relative to the first pts offset
+                self.pts.extend([int(delta_time) + self.first_pts_offset] * len(line_pairs))
+                self.line_ends.append(len(self.pairs))
+        switch(previous_stage)
 
     def close(self):
-        "Write out the last data and close file handle."
+        "Write out the last data and hand over the SCC file."
         self.write_lines(sorting_overlap=0)
-        if self.file_handle:
-            self.file_handle.write(b"\n")
-            self.file_handle.flush()
-            scc_content = self.file_handle.getvalue()
-            cc_file = {
-                'name': self.base_name,
-                'channel': self.channel,
-                'content': scc_content.decode('utf-8'),
-            }
+        self.update_metrics()
+        if self.written_header:
+            cc_file = SccFile(self.base_name, self.channel, self.pts, self.pairs,
+                              self.first_pts_offset, self.line_ends, self.frame_rate)
             self.cc_files.append(cc_file)
-            self.file_handle.close()
-            self.file_handle = None
+            self.written_header = False
+            self.reset_data()
+
+    def update_metrics(self):
+        "Set the pair counters of this channel in the metrics, if there was any data."
+        data_counters = self.cea608_field_processor.data_counters
+        counters = {
+            'caption_pairs': (data_counters['char'] + data_counters['cmd'] + data_counters['other']) // 2,
+            'padding_pairs': data_counters['padding'] // 2,
+            'dropped_pairs': self.dropped_pairs + self.cea608_field_processor.dropped_pairs,
+        }
+        if any(counters.values()):
+            self.metrics.set_caption_counters("%s-%d" % (self.base_name, self.channel), counters)
 
     def has_pts_offset(self):
-        if self.pts_offset is not None:
+        if self.timeline.pts_offset is not None:
             return True
         return False
 
     def set_pts_offset(self, pts_offset):
-        self.pts_offset = pts_offset
+        self.timeline.pts_offset = pts_offset
+
+    def set_sorting_overlap(self, sorting_overlap):
+        "Set the number of timestamps held back for sorting, i.e. how far later data can be earlier."
+        self.sorting_overlap = sorting_overlap
 
 
 class DataSorter(object):
@@ -203,7 +326,7 @@ class DataSorter(object):
         else:
             self.last_data[1].append(data)
 
-    def retrieve_data(self, sorting_overlap=5):
+    def retrieve_data(self, sorting_overlap=SORTING_OVERLAP):
         "Retrieve sorted data, except last sorting_overlap items."
         # print "Sorting %s" % sorting_overlap
         self.data_list.sort()
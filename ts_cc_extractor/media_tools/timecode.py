@@ -0,0 +1,99 @@
+"""SMPTE timecodes from 90 kHz PTS values.
+
+Supports 25 and 30 fps non-drop-frame as well as 29.97 and 59.94 fps drop-frame timecodes.
+Timecodes are formatted in bulk, with the hh:mm:ss part cached per second.
+"""
+
+import logging
+
+PTS_CLOCK = 90000
+PTS_WRAP = 1 << 33
+
+# Frame rate name: (numerator, denominator, nominal frames per second, frames dropped per minute)
+FRAME_RATES = {
+    '25': (25, 1, 25, 0),
+    '30': (30, 1, 30, 0),
+    '29.97': (30000, 1001, 30, 2),
+    '59.94': (60000, 1001, 60, 4),
+}
+
+FRAME_STRINGS = tuple("%02d" % i for i in range(60))
+
+logger = logging.getLogger(__name__)
+
+
+class PtsTimeline(object):
+    """PTS offset with 33-bit wrap-around handling.
+
+    Deltas are relative to the offset, which is moved back by 2^33 when the PTS wraps."""
+
+    def __init__(self, pts_offset=None):
+        self.pts_offset = pts_offset
+
+    def delta(self, pts):
+        "Return pts relative to the offset, unwrapping a PTS wrap-around."
+        delta_time = pts - self.pts_offset
+        if delta_time < -1 * (1 << 32):
+            self.pts_offset -= PTS_WRAP
+            logger.warning("PTS wrap-around")
+            delta_time = pts - self.pts_offset
+        return delta_time
+
+    def deltas(self, pts_list):
+        "Return a list of deltas for PTS values in decoding order."
+        delta = self.delta
+        return [delta(pts) for pts in pts_list]
+
+
+class TimecodeFormat(object):
+    "Conversion of PTS deltas to SMPTE timecodes at a given frame rate."
+
+    def __init__(self, frame_rate='30'):
+        if frame_rate not in FRAME_RATES:
+            raise ValueError("Frame rate %s not supported, use one of %s" %
+                             (frame_rate, ", ".join(sorted(FRAME_RATES))))
+        self.frame_rate = frame_rate
+        self.numerator, self.denominator, self.nominal_fps, self.drop_frames = FRAME_RATES[frame_rate]
+        self.separator = ';' if self.drop_frames else ':'
+        self.frames_per_minute = 60 * self.nominal_fps - self.drop_frames
+        self.frames_per_10_minutes = 600 * self.nominal_fps - 9 * self.drop_frames
+        self.prefix_cache = {}
+
+    def frames(self, delta_time):
+        "Return number of whole frames in a non-negative PTS delta."
+        return delta_time * self.numerator // (PTS_CLOCK * self.denominator)
+
+    def frame_label(self, frame_count):
+        "Return the frame number shown in the timecode, skipping dropped frame numbers."
+        drop = self.drop_frames
+        if not drop:
+            return frame_count
+        tens, rest = divmod(frame_count, self.frames_per_10_minutes)
+        frame_count += 9 * drop * tens
+        if rest > drop:
+            frame_count += drop * ((rest - drop) // self.frames_per_minute)
+        return frame_count
+
+    def format(self, delta_time):
+        "Return the timecode of a non-negative PTS delta."
+        return self.format_many((delta_time,))[0]
+
+    def format_many(self, delta_times):
+        "Return timecodes for a sequence of non-negative PTS deltas."
+        numerator = self.numerator
+        divisor = PTS_CLOCK * self.denominator
+        nominal_fps = self.nominal_fps
+        frame_label = self.frame_label
+        prefix_cache = self.prefix_cache
+        separator = self.separator
+        timecodes = []
+        append = timecodes.append
+        for delta_time in delta_times:
+            seconds, frame = divmod(frame_label(int(delta_time) * numerator // divisor), nominal_fps)
+            prefix = prefix_cache.get(seconds)
+            if prefix is None:
+                minutes, second = divmod(seconds, 60)
+                hours, minute = divmod(minutes, 60)
+                prefix = prefix_cache[seconds] = "%02d:%02d:%02d%s" % (hours, minute, second, separator)
+            append(prefix + FRAME_STRINGS[frame])
+        return timecodes
@@ -37,29 +37,29 @@ MPEG2 Transport Stream parser
 #pylint: disable=missing-docstring
 #pylint: disable=line-too-long
 
+import os
+import stat
+from array import array
 import time
 import binascii
+import logging
 import datetime
 
+try:
+    import zlib
+except ImportError:
+    zlib = None  # type: ignore
+
 
 def old_div(a, b):
     if isinstance(a, int) and isinstance(b, int):
         return a // b
     return a / b
 
-class Logger:
-    "Simple log class where output can be turned off."
-
-    def __init__(self, silent=False):
-        self.silent = silent
-
-    def log(self, text):
-        if not self.silent:
-            print(text)
-
-logger = Logger()
+# Diagnostics go to the logging module, so that concurrent extractions share no output state
+logger = logging.getLogger(__name__)
 def log(text):
-    logger.log(text)
+    logger.info(text)
 
 try:
     from . import scc
@@ -67,10 +67,13 @@ except ImportError:
     log("Warning: Couldn't import scc. SCC extraction disabled.")
     scc = None  # type: ignore
 
+from . import timecode
+from .metrics import Metrics
+
 try:
     from . import cea708
 except ImportError as e:
-    print(e)
+    log(e)
     log("Warning: Couldn't import cea708. Parsing disabled.")
     cea708 = None  # type: ignore
 
@@ -85,14 +88,11 @@ def dump_hex(src, length=8):
     return ''.join(result)
 
 def dump_to_array(src, length=8):
-    print('data=[', end=' ')
-    l = 0
-    for b in src:
-        print('{0},'.format(hex(b)), end=' ')
-        l += 1
-        if l % length == 0:
-            print('\n', end=' ')
-    print(']')
+    result = ['data=[']
+    for i in range(0, len(src), length):
+        result.append(' '.join('{0},'.format(hex(b)) for b in src[i:i+length]))
+    result.append(']')
+    return '\n'.join(result)
 
 # TS format:    http://en.wikipedia.org/wiki/MPEG_transport_stream
 # PAT/PMT:      http://en.wikipedia.org/wiki/Program_Specific_Information
@@ -120,6 +120,7 @@ STREAM_TYPE_H264          = 0x1b
 STREAM_TYPE_MPEG4_VIDEO   = 0x10
 STREAM_TYPE_METADATA      = 0x15
 STREAM_TYPE_AAC           = 0x11
+STREAM_TYPE_HEVC          = 0x24
 STREAM_TYPE_MPEG2_VIDEO_2 = 0x80
 STREAM_TYPE_AC3           = 0x81
 STREAM_TYPE_PCM           = 0x83
@@ -138,6 +139,7 @@ STREAM_TYPES = {
     STREAM_TYPE_PRIVATE : 'Private stream',
     STREAM_TYPE_AUDIO_ADTS : 'Audio ADTS',
     STREAM_TYPE_H264 : 'H264 video',
+    STREAM_TYPE_HEVC : 'HEVC video',
     STREAM_TYPE_MPEG4_VIDEO : 'MPEG4 video',
     STREAM_TYPE_METADATA : 'Metadata',
     STREAM_TYPE_AAC : 'AAC',
@@ -280,13 +282,11 @@ class frame:
                     self.dts / 90.0,
                     self.pts - self.dts)
 
-cc_map = {}
-
 #
 # TS packet parser
 #
 class ts_packet:
-    def __init__(self, data, display=False, check_cc=False):
+    def __init__(self, data, display=False):
         self.reader = bitreader(data)
         self.data = data
 
@@ -303,22 +303,6 @@ class ts_packet:
         self.adaptation_field_exist         = read_bits(self.reader,  2, '  adaptation field exist', display)
         self.continuity_counter             = read_bits(self.reader,  4, '  continuity counter', display)
 
-        global cc_map
-        if self.pid not in cc_map:
-            cc_map[self.pid] = -1
-
-        if cc_map[self.pid] >= 0:
-            cc_map[self.pid] = cc_map[self.pid] + 1
-            if cc_map[self.pid] > 15:
-                cc_map[self.pid] = 0
-
-            if check_cc:
-                if not self.continuity_counter == cc_map[self.pid]:
-                    #print 'CC error:', self.continuity_counter, ' != ', cc_map[self.pid]
-	                pass
-        
-        cc_map[self.pid] = self.continuity_counter
-
         if (self.adaptation_field_exist == 2) or (self.adaptation_field_exist == 3):
             tell_1 = self.reader.index
             self.adaptation_field_length            = read_bits(self.reader, 8, '   adaptation field length', display)
@@ -707,6 +691,89 @@ class nit(ts_packet):
 
         self.crc32 = read_bits(self.reader, 32, '  crc32', display, to_hex = True)
 
+#
+# SDT parser
+# en_300468v011101p section 5.2.3
+#
+SDT_ACTUAL_TABLE_ID = 0x42
+SERVICE_DESCRIPTOR = 0x48
+
+class sdt(ts_packet):
+    "Service description table, data is a TS packet followed by the payload of the next packets of the section."
+
+    def __init__(self, data, display=False):
+        ts_packet.__init__(self, data, display)
+
+        if display:
+            log('[SERVICE DESCRIPTION TABLE]')
+
+        self.pointer_field              = read_bits(self.reader, 8,  '  pointer field', display)
+        if self.pointer_field:
+            self.reader.step_bytes(self.pointer_field)
+
+        self.table_id                   = read_bits(self.reader, 8,  '  table id', display, to_hex=True)
+        self.section_syntax_indicator   = read_bits(self.reader, 1,  '  section syntax indicator', display)
+        self.marker                     = read_bits(self.reader, 1,  '  reserved future use', display)
+        self.reserved_1                 = read_bits(self.reader, 2,  '  reserved', display)
+        self.section_length             = read_bits(self.reader, 12, '  section length', display)
+        section_end = self.reader.index - 1 + self.section_length - 4
+        self.transport_stream_id        = read_bits(self.reader, 16, '  transport stream id', display)
+        self.reserved_2                 = read_bits(self.reader, 2,  '  reserved', display)
+        self.version_number             = read_bits(self.reader, 5,  '  version', display)
+        self.current_next_indicator     = read_bits(self.reader, 1,  '  current next indicator', display)
+        self.section_number             = read_bits(self.reader, 8,  '  section number', display)
+        self.last_section_number        = read_bits(self.reader, 8,  '  last section number', display)
+        self.original_network_id        = read_bits(self.reader, 16, '  original network id', display)
+        read_bits(self.reader, 8,  '  reserved future use', display)
+
+        # Service name per service id, which is the program number
+        self.service_names = {}
+        if self.table_id != SDT_ACTUAL_TABLE_ID:
+            return
+        while self.reader.index - 1 + 5 <= section_end:
+            if display:
+                log('  [SERVICE]')
+            service_id = read_bits(self.reader, 16, '    service id', display)
+            read_bits(self.reader, 6,  '    reserved future use', display)
+            read_bits(self.reader, 1,  '    EIT schedule flag', display)
+            read_bits(self.reader, 1,  '    EIT present following flag', display)
+            read_bits(self.reader, 3,  '    running status', display)
+            read_bits(self.reader, 1,  '    free CA mode', display)
+            descriptors_loop_length = read_bits(self.reader, 12, '    descriptors loop length', display)
+            position = self.reader.index - 1
+            descriptors = self.data[position : min(position + descriptors_loop_length, section_end)]
+            name = parse_service_name(descriptors)
+            if name is not None:
+                if display:
+                    log('    service name: {0}'.format(name))
+                self.service_names[service_id] = name
+            self.reader.step_bytes(descriptors_loop_length)
+
+def parse_service_name(descriptors):
+    "Service name of the service descriptor in descriptors, or None if there is none."
+    offset = 0
+    while offset + 2 <= len(descriptors):
+        tag = descriptors[offset]
+        length = descriptors[offset + 1]
+        if tag == SERVICE_DESCRIPTOR and length >= 3:
+            # service_type, service_provider_name_length, name, service_name_length, name
+            provider_name_length = descriptors[offset + 3]
+            name_offset = offset + 4 + provider_name_length
+            name_length = descriptors[name_offset]
+            return decode_dvb_string(descriptors[name_offset + 1 : name_offset + 1 + name_length])
+        offset += 2 + length
+    return None
+
+def decode_dvb_string(data):
+    "Decode a DVB text string (en_300468 annex A), with ISO/IEC 8859-1 for the single byte tables."
+    if data and data[0] == 0x15:
+        return data[1:].decode('utf-8', 'replace')
+    if data and data[0] == 0x10:
+        data = data[3:]
+    elif data and data[0] < 0x20:
+        data = data[1:]
+    return data.decode('latin-1')
+
 #
 # EIT parser
 # en_300468v011101p section 5.2.4
@@ -973,6 +1040,124 @@ class pes:
     def size(self):
         return len(self.data) - 6
 
+#
+# PSI sections
+#
+CRC32_MPEG2_POLYNOMIAL = 0x04C11DB7
+MAX_SECTION_SIZE = 4096
+SCTE35_TABLE_ID = 0xFC
+
+def make_crc32_mpeg2_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC32_MPEG2_POLYNOMIAL) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xffffffff)
+    return table
+
+CRC32_MPEG2_TABLE = make_crc32_mpeg2_table()
+# Each byte with its bits in reverse order
+BIT_REVERSED = bytes(int('{:08b}'.format(byte)[::-1], 2) for byte in range(256))
+
+def crc32_mpeg2_table(data):
+    "CRC-32/MPEG-2 of data, one table lookup per byte."
+    crc = 0xffffffff
+    table = CRC32_MPEG2_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xffffffff) ^ table[(crc >> 24) ^ byte]
+    return crc
+
+def crc32_mpeg2_zlib(data):
+    """CRC-32/MPEG-2 of data with zlib.crc32, which is the same CRC with reflected bits and a final xor.
+
+    The bytes are reflected with bytes.translate, so all the per byte work is done in C."""
+    crc = zlib.crc32(bytes(data).translate(BIT_REVERSED)) ^ 0xffffffff
+    return int('{:032b}'.format(crc)[::-1], 2)
+
+def crc32_mpeg2(data):
+    "CRC-32/MPEG-2 of data, which is 0 for a section including its CRC_32."
+    if zlib is not None:
+        return crc32_mpeg2_zlib(data)
+    return crc32_mpeg2_table(data)
+
+def section_packet_data(pid, section):
+    "A TS packet header and pointer field followed by section, as the PSI parsers take it."
+    return bytes((0x47, 0x40 | (pid >> 8), pid & 0xff, 0x10, 0x00)) + section
+
+class section_assembler:
+    """Reassembles the PSI sections of TS packets, per PID.
+
+    A section may continue in the next packets of its PID, and the packet where a section starts has
+    a pointer_field to it, after the end of the previous section. More sections may follow in the same
+    packet, until stuffing bytes. Sections with a wrong CRC_32 are dropped, and so are sections equal
+    to the last one with the same table_id, table_id_extension and section_number, so that the
+    repetitions of a table are not parsed again."""
+
+    def __init__(self):
+        # Collected bytes of the incomplete section per PID
+        self.data = {}
+        self.last_sections = {}
+        self.crc_errors = 0
+
+    def add_packet(self, packet):
+        "Return the new sections that are completed by the packet."
+        pid = packet.pid
+        payload = packet.payload
+        sections = []
+        if packet.payload_unit_start_indicator:
+            if not payload:
+                return sections
+            pointer_field = payload[0]
+            data = self.data.pop(pid, None)
+            if data is not None:
+                self.take_sections(pid, data + payload[1:1 + pointer_field], sections)
+            data = self.take_sections(pid, payload[1 + pointer_field:], sections)
+        elif pid in self.data:
+            data = self.take_sections(pid, self.data.pop(pid) + payload, sections)
+        else:
+            # The start of the section was missed
+            return sections
+        if data is not None:
+            self.data[pid] = data
+        return sections
+
+    def take_sections(self, pid, data, sections):
+        "Add the new complete sections at the start of data to sections, and return the rest, or None if there is none."
+        while len(data) >= 3:
+            if data[0] == 0xff:
+                # Stuffing until the next payload unit start
+                return None
+            size = 3 + (((data[1] & 0x0f) << 8) | data[2])
+            if size > MAX_SECTION_SIZE:
+                return None
+            if len(data) < size:
+                return data
+            section = bytes(data[:size])
+            data = data[size:]
+            if self.is_new(pid, section):
+                sections.append(section)
+        if not data or data[0] == 0xff:
+            return None
+        return data
+
+    def is_new(self, pid, section):
+        "Check a complete section, remembering it if it is valid and new."
+        # Long sections and SCTE-35 splice_info_section end with a CRC_32
+        has_crc = section[1] & 0x80 or section[0] == SCTE35_TABLE_ID
+        if section[1] & 0x80 and len(section) >= 8:
+            key = (pid, section[0], section[3], section[4], section[6])
+        else:
+            key = (pid, section[0])
+        if self.last_sections.get(key) == section:
+            return False
+        if has_crc and crc32_mpeg2(section):
+            self.crc_errors += 1
+            logger.warning('CRC error in section with table id 0x%02x on pid %d', section[0], pid)
+            return False
+        self.last_sections[key] = section
+        return True
+
 #
 # TS Importer Observer interface
 #
@@ -981,23 +1166,38 @@ class observer:
         pass
     def on_pmt(self, importer, pmt):
         pass
+    def on_sdt(self, sdt):
+        pass
+    def get_pids(self):
+        return []
     def on_pes(self, pid, pes):
         pass
     def flush(self):
         pass
     def get_scte35_pids(self):
         return set()
+    def get_video_pids(self):
+        return []
+    def get_cc_summaries(self):
+        return []
+
+# Number of packets between progress reports
+PROGRESS_INTERVAL = 4096
+# Packets kept while waiting for the PMT of every program, before parsing without the missing ones
+MAX_PENDING_BYTES = 188 * 100000
 
 #
 # TS importer
 #
 class ts_importer:
-    def __init__(self, observer, options, log_cc=False):
-        self.preflight_packets = 0
+    def __init__(self, observer, options, log_cc=False, metrics=None):
         self.has_pat = False
         self.has_pmt = False
         self.has_nit = False
-        self.pmt_pid = -1
+        self.has_sdt = False
+        # Program number per PMT PID of the observed programs, and their PMT per program number
+        self.pmt_pids = {}
+        self.pmts = {}
         self.nit_pid = -1
         self.observer = observer
         self.options = options
@@ -1010,55 +1210,90 @@ class ts_importer:
         self.num_stuffing_packets = 0
         self.pid_counter = {}
         self.packet_errors = 0
+        self.cc_errors = 0
+        self.duplicate_packets = 0
+        # Last continuity counter per PID, -1 until the first packet of the PID
+        self.last_cc = array('b', [-1]) * 8192
+        self.metrics = metrics if metrics is not None else Metrics()
 
         self.first_pts = 0
         self.last_pts = 0
 
-        self.eit_data = b''
-
-    # Use the preflight for vod to get pat and pmt
-    def preflight(self, data):
-        offset = 0
-        pids = {}
-        while offset < len(data) and data[offset] == 0x47:
-            packet = ts_packet(data[offset:offset+188], display=False, check_cc=False)
-            #log(dump_hex(packet.data, 16))
-
-            if packet.pid not in pids:
-                pids[packet.pid] = 0
-            pids[packet.pid] += 1
-            self.preflight_packets += 1
-
-            if packet.pid == PAT_PID:
-                self._handle_pat(packet)
-            elif packet.pid == self.pmt_pid:
-                self._handle_pmt(packet)
-                #return True
-            elif packet.pid == self.nit_pid:
-                self._handle_nit(packet)
-                #return True
-            elif packet.pid == EIT_PID or packet.pid == EIT_PID2:
-                self._handle_eit(packet)
-            offset += 188
-
-            if self.has_pmt and self.preflight_packets > 100:
-                return True
-
-        log('pids found: %s' % pids)
-        raise Exception('Could not find pat/pmt during preflight')
+        self.sections = section_assembler()
+        self.sdt_sections = set()
+        # Packets before the PMTs, parsed when the PMTs tell which PIDs to observe
+        self.pending_data = bytearray()
 
     def observe_pid(self, pid):
         if pid not in self.pids:
             self.pids[pid] = None
 
+    def skip(self):
+        """Pass on the PES being assembled and forget the continuity counters, before adding data from
+        another position in the file."""
+        for pid, pes in self.pids.items():
+            if pes:
+                self.observer.on_pes(pid, pes)
+                self.pids[pid] = None
+        self.observer.flush()
+        self.last_cc = array('b', [-1]) * 8192
+
     def add_data(self, data, progress_callback=None):
+        """Parse TS packets in data.
+
+        progress_callback is called with the total number of bytes parsed so far,
+        every PROGRESS_INTERVAL packets.
+
+        Until the PMT of every observed program is found, only PAT and PMT packets are parsed.
+        The other packets are kept in pending_data and parsed right after the last PMT, so every
+        packet is parsed once. The observed programs are set by the 'programs' option, see _handle_pat."""
         offset = 0
+        packets_to_progress = PROGRESS_INTERVAL
+        waiting_for_pmt = not self.has_pmt
+        display_psi = self.options['verbose'] >= 2
+        # Payload of PES packets is collected as part of packet parsing, and only
+        # the start of a PES is timed separately, to keep the per packet overhead low.
+        switch = self.metrics.switch
+        previous_stage = switch('packet_parse')
+        check_cc = self.options['check_cc']
+        last_cc = self.last_cc
 
         while offset + 188 <= len(data) and data[offset] == 0x47:
-            if progress_callback:
-                progress_callback(offset + 188, len(data))
-
-            packet = ts_packet(data[offset:offset+188], display=self.options['verbose'] >= 3, check_cc=True)
+            packets_to_progress -= 1
+            if not packets_to_progress:
+                packets_to_progress = PROGRESS_INTERVAL
+                if progress_callback:
+                    progress_callback(self.num_bytes)
+
+            if waiting_for_pmt:
+                pid = ((data[offset + 1] & 0x1f) << 8) | data[offset + 2]
+                if pid != PAT_PID and pid not in self.pmt_pids:
+                    self.pending_data += data[offset:offset+188]
+                    offset += 188
+                    if len(self.pending_data) >= MAX_PENDING_BYTES and self.pmts:
+                        waiting_for_pmt = False
+                        self._parse_pending()
+                    continue
+
+            packet = ts_packet(data[offset:offset+188], display=self.options['verbose'] >= 3)
+            duplicate = False
+            if check_cc and packet.pid != STUFFING_PID:
+                # The counter is incremented by packets with payload only. A repeated counter with payload
+                # is a duplicate packet, whose payload is dropped, and a discontinuity indicator allows any
+                # counter.
+                last = last_cc[packet.pid]
+                cc = packet.continuity_counter
+                if last < 0 or (packet.has_adap and packet.discontinuity_indicator):
+                    pass
+                elif cc == last:
+                    if packet.adaptation_field_exist & 1:
+                        duplicate = True
+                        self.duplicate_packets += 1
+                elif not packet.adaptation_field_exist & 1 or cc != (last + 1) & 0x0F:
+                    self.cc_errors += 1
+                    if self.options['verbose'] >= 1:
+                        log('CC error, pid={0}: {1} after {2}'.format(packet.pid, cc, last))
+                last_cc[packet.pid] = cc
             #log(dump_hex(packet.data, 16))
 
             if packet.pid not in self.pid_counter:
@@ -1073,21 +1308,28 @@ class ts_importer:
 
             if packet.transport_error_indicator:
                 self.packet_errors += 1
+            elif duplicate:
+                pass
             elif packet.pid == PAT_PID:
-                self._handle_pat(packet)
+                self._handle_sections(packet, self._handle_pat)
             elif packet.pid == CA_PID:
                 #log('TODO: CA packet')
                 pass
             elif packet.pid == STUFFING_PID:
                 self.num_stuffing_packets += 1
-            #elif packet.pid == SDT_PID:
-            #    log('TODO: SDT packet')
-            elif packet.pid == self.pmt_pid:
-                self._handle_pmt(packet)
+            elif packet.pid == SDT_PID:
+                if not self.has_sdt:
+                    self._handle_sections(packet, self._handle_sdt)
+            elif packet.pid in self.pmt_pids:
+                self._handle_sections(packet, self._handle_pmt)
+                if waiting_for_pmt and len(self.pmts) == len(self.pmt_pids):
+                    waiting_for_pmt = False
+                    self._parse_pending()
             elif packet.pid == self.nit_pid:
-                self._handle_nit(packet)
+                if not self.has_nit:
+                    self._handle_sections(packet, self._handle_nit)
             elif packet.pid in self.scte35_pids:
-                self._handle_scte35(packet)
+                self._handle_sections(packet, self._handle_scte35)
             elif packet.pid in self.pids.keys():
                 if len(packet.payload) > 3 and \
                    packet.payload[0] == 0x00 and \
@@ -1105,7 +1347,9 @@ class ts_importer:
                         self.observer.on_pes(packet.pid, self.pids[packet.pid])
 
                     # Create new pes
+                    switch('pes_assembly')
                     p = pes(packet.payload, display=self.options['verbose'] >= 2)
+                    switch('packet_parse')
                     self.pid_counter[packet.pid]['pes_header_bytes'] += p.header_len
                     if self.first_pts == 0:
                         self.first_pts = p.pts
@@ -1120,6 +1364,8 @@ class ts_importer:
 
                 elif self.pids[packet.pid]:
                     self.pids[packet.pid].add_data(packet.payload)
+            elif display_psi and (packet.pid == EIT_PID or packet.pid == EIT_PID2):
+                self._handle_sections(packet, self._handle_eit)
 
             self.pid_counter[packet.pid]['num_packets'] += 1
             self.pid_counter[packet.pid]['num_bytes'] += 188
@@ -1128,8 +1374,21 @@ class ts_importer:
             self.num_packets += 1
             self.num_bytes += 188
             offset += 188
+        switch(previous_stage)
+        if progress_callback:
+            progress_callback(self.num_bytes)
+
+    def _parse_pending(self):
+        "Stop waiting for PMTs, and parse the packets kept while waiting."
+        self.has_pmt = True
+        pending_data, self.pending_data = self.pending_data, bytearray()
+        self.add_data(pending_data)
 
     def flush(self):
+        if self.pending_data and self.pmts:
+            missing = [program for program in self.pmt_pids.values() if program not in self.pmts]
+            logger.warning('No PMT found for programs %s', missing)
+            self._parse_pending()
         for pid in self.pids:
             pes = self.pids[pid]
             if pes:
@@ -1138,16 +1397,30 @@ class ts_importer:
 
     def close(self):
         self.observer.close()
+        self.update_metrics()
+
+    def update_metrics(self):
+        "Copy packet counters to the metrics."
+        self.metrics.pids = self.pid_counter
+        self.metrics.counters.update({
+            'packets': self.num_packets,
+            'bytes': self.num_bytes,
+            'stuffing_packets': self.num_stuffing_packets,
+            'transport_errors': self.packet_errors,
+            'cc_errors': self.cc_errors,
+            'duplicate_packets': self.duplicate_packets,
+            'crc_errors': self.sections.crc_errors,
+        })
 
     def print_cc_summary(self, video, data):
-        print("CC in %s video stream" % video)
+        log("CC in %s video stream" % video)
         for d in data:
-            print("  Format: %s" % d['format'])
+            log("  Format: %s" % d['format'])
             if 'field' in d:
-                print("    Standard: %s, field=%d" % (d['std'], d['field']))
+                log("    Standard: %s, field=%d" % (d['std'], d['field']))
             else:
-                print("    Standard: %s" % d['std'])
-            print("    Data: bitrate=%(bitrate)d, #chars=%(char)d, #padding=%(padding)d" % d['data'])
+                log("    Standard: %s" % d['std'])
+            log("    Data: bitrate=%(bitrate)d, #chars=%(char)d, #padding=%(padding)d" % d['data'])
 
     def report(self):
         duration = (self.last_pts - self.first_pts) / 90000.0
@@ -1189,52 +1462,90 @@ class ts_importer:
             log('############################################')
 
         if self.log_cc:
-            mpeg_video_cc = self.observer.mpeg_video_parser.get_cc_summary()
-            h264_cc = self.observer.h264_parser.get_cc_summary()
-            if mpeg_video_cc:
-                self.print_cc_summary("MPEG2", mpeg_video_cc)
-            if h264_cc:
-                self.print_cc_summary("H.264", h264_cc)
-
-    def _handle_pat(self, packet):
+            for video, cc_summary in self.observer.get_cc_summaries():
+                self.print_cc_summary(video, cc_summary)
+
+    def _handle_sections(self, packet, handler):
+        "Pass the PID and each new section completed by the packet to handler."
+        for section in self.sections.add_packet(packet):
+            handler(packet.pid, section)
+
+    def _handle_pat(self, pid, section):
+        """Find the PMT PIDs of the observed programs.
+
+        The 'programs' option selects them: None for the first program, 'all', or a list of program numbers."""
         if self.has_pat:
             return
-        pat_packet = pat(packet.data, display=self.options['verbose'] >= 2)
+        pat_packet = pat(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
         self.observer.on_pat(pat_packet)
+        programs = self.options.get('programs')
         for info in pat_packet.pmt_info:
+            self.has_pat = True
             if info.program_num == 0x00:
                 self.nit_pid = info.program_pid
-                self.has_pat = True
-            else:
-                self.pmt_pid = info.program_pid
-                self.has_pat = True
-                return
+            elif programs is None:
+                if not self.pmt_pids:
+                    self.pmt_pids[info.program_pid] = info.program_num
+            elif programs == 'all' or info.program_num in programs:
+                self.pmt_pids[info.program_pid] = info.program_num
+
+    def _handle_pmt(self, pid, section):
+        """Parse a PMT, unless it has the version of the current PMT of the program.
+
+        On a new version, the PES of the streams that are gone are passed to the observer,
+        which then observes the new streams, and the PIDs no longer observed are dropped."""
+        if section[0] != 0x02 or len(section) < 6:
+            return
+        program_num = (section[3] << 8) | section[4]
+        version_number = (section[5] >> 1) & 0x1f
+        current_next_indicator = section[5] & 0x01
+        if program_num != self.pmt_pids[pid] or not current_next_indicator:
+            # Another program with its PMT on the same PID, or a version that is not valid yet
+            return
+        old_pmt = self.pmts.get(program_num)
+        if old_pmt is not None and old_pmt.version_number == version_number:
+            return
 
-    def _handle_pmt(self, packet):
-        #if self.has_pmt:
-        #    return
-        pmt_packet = pmt(packet.data, display=self.options['verbose'] >= 2)
+        pmt_packet = pmt(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
+        removed_pids = []
+        if old_pmt is not None:
+            logger.info('PMT of program %d changed from version %d to %d',
+                        program_num, old_pmt.version_number, version_number)
+            elementary_pids = set(stream.elementary_pid for stream in pmt_packet.stream_list)
+            for stream in old_pmt.stream_list:
+                elementary_pid = stream.elementary_pid
+                if elementary_pid not in elementary_pids and elementary_pid in self.pids:
+                    removed_pids.append(elementary_pid)
+                    if self.pids[elementary_pid]:
+                        self.observer.on_pes(elementary_pid, self.pids[elementary_pid])
+                        self.pids[elementary_pid] = None
         self.observer.on_pmt(self, pmt_packet)
-        self.has_pmt = True
+        self.pmts[program_num] = pmt_packet
         self.scte35_pids = self.observer.get_scte35_pids()
+        observed_pids = set(self.observer.get_pids())
+        for elementary_pid in removed_pids:
+            if elementary_pid not in observed_pids:
+                del self.pids[elementary_pid]
 
-    def _handle_nit(self, packet):
-        if self.has_nit:
-            return
-        nit_packet = nit(packet.data, display=self.options['verbose'] >= 2)
+    def _handle_nit(self, pid, section):
+        nit_packet = nit(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
         self.has_nit = True
 
-    def _handle_eit(self, packet):
-        if packet.payload_unit_start_indicator:
-            if self.eit_data:
-                eit_packet = eit(self.eit_data, display=self.options['verbose'] >= 2)
-            self.eit_data = packet.data
-        elif self.eit_data:
-            self.eit_data += packet.payload
+    def _handle_sdt(self, pid, section):
+        "Pass the sections of the SDT of this TS to the observer, until all are seen."
+        if section[0] != SDT_ACTUAL_TABLE_ID or self.has_sdt:
+            return
+        sdt_packet = sdt(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
+        self.observer.on_sdt(sdt_packet)
+        self.sdt_sections.add(sdt_packet.section_number)
+        self.has_sdt = len(self.sdt_sections) > sdt_packet.last_section_number
+
+    def _handle_eit(self, pid, section):
+        eit_packet = eit(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
 
-    def _handle_scte35(self, packet):
-        scte35 = SCTE35(packet.data, display=self.options['verbose'] >= 2)
-        print("SCTE35 parsed: %s" % scte35)
+    def _handle_scte35(self, pid, section):
+        scte35 = SCTE35(section_packet_data(pid, section), display=self.options['verbose'] >= 2)
+        log("SCTE35 parsed: %s" % scte35)
 
 #
 # MPEG audio parser
@@ -1260,13 +1571,48 @@ class mpeg_audio_parser:
 #
 # MPEG video parser
 #
+PICTURE_START_CODE = b'\x00\x00\x01\x00'
+USER_DATA_START_CODE = b'\x00\x00\x01\xb2'
+SEQUENCE_HEADER_CODE = b'\x00\x00\x01\xb3'
+GOP_START_CODE = b'\x00\x00\x01\xb8'
+PICTURE_TYPE_I = 1
+PICTURE_TYPE_B = 3
+# Frame duration in 90 kHz units of each frame_rate_code
+FRAME_DURATIONS = {1: 3753.75, 2: 3750, 3: 3600, 4: 3003, 5: 3000, 6: 1800, 7: 1501.5, 8: 1500}
+
 class mpeg_video_parser:
-    def __init__(self, display=False, cc_files=None):
+    """Parser of MPEG-1/2 video PES, passing the captions in user data to the ATSC and SCTE parsers.
+
+    Unless headers are displayed or frames are asked for, only the user data is parsed, found with
+    bytes.find. With picture_info, the temporal reference and picture coding type of the picture
+    of each user data are then kept in temporal_reference and picture_type, and the user data gets
+    the PTS of its picture, see set_picture. User data of a picture without a known PTS is dropped."""
+
+    def __init__(self, display=False, cc_files=None, metrics=None, frames=False, picture_info=False,
+                 scc_frame_rate='30'):
         self.display = display
+        self.fast = not display and not frames
+        self.picture_info = picture_info
+        self.temporal_reference = None
+        self.picture_type = None
+        # PTS of the current picture, -1 if it is unknown
+        self.picture_pts = -1
+        self.pictures_in_pes = 0
+        self.frame_duration = FRAME_DURATIONS[4]
+        # PTS and temporal reference of a picture of the current GOP
+        self.anchor = None
+        # Pictures and B-pictures since the last I-picture
+        self.gop_pictures = 0
+        self.gop_b_pictures = 0
+        self.metrics = metrics if metrics is not None else Metrics()
         atsc_basename = "ATSC"
         scte_basename = "SCTE"
-        self.ATSC_parser = ATSCParser(display, atsc_basename, cc_files)
-        self.SCTE_parser = SCTEParser(display, scte_basename, cc_files)
+        self.ATSC_parser = ATSCParser(display, atsc_basename, cc_files, self.metrics, scc_frame_rate)
+        self.SCTE_parser = SCTEParser(display, scte_basename, cc_files, self.metrics, scc_frame_rate)
+        self.reorder_depth = None
+        if picture_info:
+            # Until the GOP structure is known, B-pictures are assumed
+            self.set_reorder_depth(1)
 
         self.codes = {0x00 : self.parse_picture_header,
                       0xb2 : self.parse_user_data,
@@ -1289,6 +1635,11 @@ class mpeg_video_parser:
         self.pts = pts
         self.dts = dts
         self.offset = 0
+        self.pictures_in_pes = 0
+
+        if self.fast:
+            self.scan_user_data()
+            return []
 
         if self.display:
             log('')
@@ -1305,6 +1656,90 @@ class mpeg_video_parser:
             code, valid = self.next_startcode()
         return frames
 
+    def scan_user_data(self):
+        "Parse the user data of the PES only, skipping all other start codes."
+        data = self.data
+        position = data.find(USER_DATA_START_CODE)
+        if self.picture_info:
+            position = self.scan_pictures(position)
+        while position >= 0:
+            self.offset = position + 4
+            self.parse_user_data()
+            position = data.find(USER_DATA_START_CODE, position + 4)
+
+    def scan_pictures(self, position):
+        """Set the picture of each user data from position on, and parse it.
+
+        User data before the first picture header of the PES belongs to that picture.
+        Returns the position of user data after the last picture header, which needs no picture."""
+        data = self.data
+        sequence = data.find(SEQUENCE_HEADER_CODE)
+        if sequence >= 0 and sequence + 8 <= len(data):
+            self.set_frame_rate(data[sequence + 7] & 0x0f)
+        gop = data.find(GOP_START_CODE)
+        picture = data.find(PICTURE_START_CODE)
+        while 0 <= picture and picture + 6 <= len(data):
+            while 0 <= gop < picture:
+                self.start_gop()
+                gop = data.find(GOP_START_CODE, gop + 4)
+            self.set_picture((data[picture + 4] << 2) | (data[picture + 5] >> 6), (data[picture + 5] >> 3) & 0x07)
+            picture = data.find(PICTURE_START_CODE, picture + 4)
+            while position >= 0 and (picture < 0 or position < picture):
+                self.offset = position + 4
+                self.parse_user_data()
+                position = data.find(USER_DATA_START_CODE, position + 4)
+        if gop >= 0:
+            self.start_gop()
+        return position
+
+    def set_frame_rate(self, frame_rate_code):
+        if frame_rate_code in FRAME_DURATIONS:
+            self.frame_duration = FRAME_DURATIONS[frame_rate_code]
+
+    def start_gop(self):
+        "Temporal references restart at a GOP header."
+        self.anchor = None
+
+    def set_picture(self, temporal_reference, picture_type):
+        """Set the current picture, and its display time in picture_pts.
+
+        The PTS of a PES is the PTS of its first picture. Other pictures, e.g. when encoders only put
+        a PTS on I- and P-pictures, are timed by their temporal reference (the display order in the GOP),
+        relative to a picture of the same GOP with a PTS. Without such a picture, e.g. when the stream
+        starts in the middle of a GOP, picture_pts is -1. The GOP structure sets the reorder depth."""
+        self.temporal_reference = temporal_reference
+        self.picture_type = picture_type
+        if self.pictures_in_pes == 0 and self.pts > -1:
+            self.picture_pts = self.pts
+            self.anchor = (self.pts, temporal_reference)
+        elif self.anchor is not None:
+            anchor_pts, anchor_reference = self.anchor
+            offset = int(round((temporal_reference - anchor_reference) * self.frame_duration))
+            self.picture_pts = (anchor_pts + offset) % timecode.PTS_WRAP
+        else:
+            self.picture_pts = -1
+        self.pictures_in_pes += 1
+
+        if picture_type == PICTURE_TYPE_I:
+            if self.gop_pictures:
+                self.set_reorder_depth(1 if self.gop_b_pictures else 0)
+            self.gop_pictures = 0
+            self.gop_b_pictures = 0
+        self.gop_pictures += 1
+        if picture_type == PICTURE_TYPE_B:
+            self.gop_b_pictures += 1
+
+    def set_reorder_depth(self, reorder_depth):
+        """Hold back reorder_depth timestamps of the captions for sorting.
+
+        B-pictures are sent after the I- or P-picture that follows them in display order,
+        and no picture refers to a B-picture. With the PTS of each picture, only the last
+        I- or P-picture needs to be held back, and nothing without B-pictures."""
+        if reorder_depth != self.reorder_depth:
+            self.reorder_depth = reorder_depth
+            self.ATSC_parser.set_sorting_overlap(reorder_depth)
+            self.SCTE_parser.set_sorting_overlap(reorder_depth)
+
     def next_startcode(self):
         while self.offset + 3 < len(self.data):
             if self.data[self.offset + 0] == 0x00 and \
@@ -1320,8 +1755,13 @@ class mpeg_video_parser:
     def parse_picture_header(self):
         print_bits('  [PICTURE HEADER]', 0x0100, self.display, to_hex = True)
         reader = bitreader(self.data[self.offset : self.offset + 4])
-        read_bits(reader,  10, '    temporal sequence number', self.display)
+        temporal_reference = read_bits(reader,  10, '    temporal sequence number', self.display)
         frame_type = read_bits(reader,  3, '    frame type', self.display)
+        if self.picture_info:
+            self.set_picture(temporal_reference, frame_type)
+        else:
+            self.temporal_reference = temporal_reference
+            self.picture_type = frame_type
         read_bits(reader,  16, '    vbv delay', self.display)
 
         data = self.data[self.offset : self.offset + 4]
@@ -1344,7 +1784,8 @@ class mpeg_video_parser:
         read_bits(reader,  12, '    horizontal size', self.display)
         read_bits(reader,  12, '    vertical size', self.display)
         read_bits(reader,  4, '    aspect ratio', self.display)
-        read_bits(reader,  4, '    frame rate', self.display)
+        frame_rate_code = read_bits(reader,  4, '    frame rate', self.display)
+        self.set_frame_rate(frame_rate_code)
         read_bits(reader,  18, '    bit rate', self.display)
         read_bits(reader,  1, '    marker (1)', self.display)
         read_bits(reader,  10, '    vbv buffer size', self.display)
@@ -1367,24 +1808,37 @@ class mpeg_video_parser:
         read_bits(reader,  1, '    closed GOP', self.display)
         read_bits(reader,  1, '    broken GOP', self.display)
         read_bits(reader,  5, '    marker (0)', self.display)
+        self.start_gop()
 
     def parse_user_data(self):
         """Parse user data, and look for ATSC CC information in particular."""
         print_bits('  [user_data]', 0x01b2, display=self.display, to_hex = True)
+        previous_stage = self.metrics.switch('user_data')
         reader = bitreader(self.data[self.offset:])
+        if self.picture_info and (self.pictures_in_pes or self.pts == -1):
+            pts = self.picture_pts
+        else:
+            pts = self.pts
+        if pts == -1:
+            # A made up time would shift the SCC time of all the captions
+            self.metrics.switch(previous_stage)
+            return
         first_byte = read_bits(reader, 8, '    user_data_type_code', display=self.display, to_hex=True)
         if first_byte != 0x3:
             user_identifier = read_bits(reader, 24, '    user identifier_3', display=self.display, to_hex=True)
             if first_byte == 0x47 and int(user_identifier) == 0x413934:
-                self.ATSC_parser.parse(reader, self.pts)
+                self.ATSC_parser.parse(reader, pts)
         else:
-            self.SCTE_parser.parse(reader, self.pts)
+            self.SCTE_parser.parse(reader, pts)
+        self.metrics.switch(previous_stage)
 
     def close(self):
         self.ATSC_parser.close()
         self.SCTE_parser.close()
 
 
+EMULATION_PREVENTION = b'\x00\x00\x03'
+
 def bit(command, num):
     return (command >> num) & 0x01
 
@@ -1444,12 +1898,14 @@ def RBSPtoSODB(streamBuffer, last_byte_pos):
     return last_byte_pos
 
 class SEIParser:
-    "Parser of SEI NAL unit."
+    "Parser of SEI NAL unit, of H.264 or HEVC."
 
-    def __init__(self, display=False, cc_files=None):
+    def __init__(self, display=False, cc_files=None, metrics=None, codec='H264', scc_frame_rate='30'):
         self.display = display
+        self.codec = codec
+        self.metrics = metrics if metrics is not None else Metrics()
         cc_basename = "EMBEDDED"
-        self.ATSC_parser = ATSCParser(display, cc_basename, cc_files)
+        self.ATSC_parser = ATSCParser(display, cc_basename, cc_files, self.metrics, scc_frame_rate)
 
     def get_cc_summary(self):
         cc_data = self.ATSC_parser.get_cc_summary()
@@ -1457,18 +1913,23 @@ class SEIParser:
             cc_data['format'] = 'ATSC'
         return cc_data
 
-    def parse(self, nal_data, pts):
-        "Parse SEI NAL unit."
+    def parse(self, nal_data, pts, header_size=5):
+        "Parse SEI NAL unit, where the SEI messages start after header_size bytes."
+        previous_stage = self.metrics.switch('user_data')
+        try:
+            self.parse_sei(nal_data, pts, header_size)
+        finally:
+            self.metrics.switch(previous_stage)
 
-        #log('nal_data: %d' % len(nal_data))
-        length, nal_data_2 = EBSPtoRBSP(nal_data, len(nal_data), 5)
-        #log('length=%d' %  len(nal_data_2))
-        length2 = RBSPtoSODB(nal_data_2, length)
+    def parse_sei(self, nal_data, pts, header_size=5):
+        "Parse the SEI messages of a NAL unit."
 
-        reader = bitreader(nal_data_2[5:])
+        # Remove the emulation prevention bytes, the SEI messages end with the rbsp trailing bits
+        rbsp = nal_data[header_size:].replace(EMULATION_PREVENTION, b'\x00\x00')
+        reader = bitreader(rbsp)
 
         if self.display:
-            log('[H264 SEI] ({0} bytes) pts={1}'.format(len(nal_data), pts))
+            log('[{0} SEI] ({1} bytes) pts={2}'.format(self.codec, len(nal_data), pts))
         #log(dump_hex(nal_data, 16))
         #log(dump_hex(nal_data_2, 16))
 
@@ -1539,11 +2000,11 @@ class SEIParser:
 class UserDataParser:
     "Baseclass for user data, and Closed Captioning in particular"
 
-    def __init__(self, display=False, cc_basename=None, cc_files=None):
+    def __init__(self, display=False, cc_basename=None, cc_files=None, metrics=None, scc_frame_rate='30'):
         self.display = display
         if scc is not None:
-            self.cc_writers = (scc.SccWriter(cc_basename, 0, cc_files),
-                               scc.SccWriter(cc_basename, 1, cc_files))
+            self.cc_writers = (scc.SccWriter(cc_basename, 0, cc_files, metrics, scc_frame_rate),
+                               scc.SccWriter(cc_basename, 1, cc_files, metrics, scc_frame_rate))
         self.format = None
 
     def has_pts_offset(self):
@@ -1553,9 +2014,21 @@ class UserDataParser:
         self.cc_writers[0].set_pts_offset(pts_offset)
         self.cc_writers[1].set_pts_offset(pts_offset)
 
+    def set_sorting_overlap(self, sorting_overlap):
+        if scc is not None:
+            for writer in self.cc_writers:
+                writer.set_sorting_overlap(sorting_overlap)
+
     def parse(self, reader, pts_time):
         "Must be overridden by subclass."
 
+    def add_cc_data(self, field, cc_data, pts_time):
+        "Add a CEA-608 byte pair for field 0 or 1. Padding is only counted."
+        if cc_data == scc.PADDING_PAIR:
+            self.cc_writers[field].count_padding(pts_time)
+        else:
+            self.cc_writers[field].add_data(cc_data, pts_time)
+
     def get_cc_summary(self):
         field_data = []
         for i,cw in enumerate(self.cc_writers):
@@ -1576,13 +2049,14 @@ class UserDataParser:
 class ATSCParser(UserDataParser):
     "Parser of ATSC user data, and Closed Captioning in particular."
 
-    def __init__(self, display=False, cc_basename=None, cc_files=None):
-        UserDataParser.__init__(self, display, cc_basename, cc_files)
+    def __init__(self, display=False, cc_basename=None, cc_files=None, metrics=None, scc_frame_rate='30'):
+        UserDataParser.__init__(self, display, cc_basename, cc_files, metrics, scc_frame_rate)
         if cea708:
             self.cea708_parser = cea708.Cea708Parser()
         else:
             self.cea708_parser = None
         self.format = "ATSC"
+        self.timecode_format = timecode.TimecodeFormat('29.97')
 
     def get_cc_summary(self):
         cc_summary = UserDataParser.get_cc_summary(self)
@@ -1599,14 +2073,8 @@ class ATSCParser(UserDataParser):
         return cc_summary
 
     def calc_time(self, pts_time):
-        pts_time -= 900000
-        ss = old_div(pts_time, 90000)
-        fr = int(29.97 * (pts_time % 90000) / 90000.0)
-        hh = old_div(ss, 3600)
-        mm = old_div(ss, 60)
-        ss -= hh*3600 + mm*60
-        newtime = "%02d:%02d:%02d:%02d" % (hh, mm, ss, fr)
-        return newtime
+        "Drop-frame timecode at 29.97Hz for pts_time, shifted by 10 seconds."
+        return self.timecode_format.format(max(pts_time - 900000, 0))
 
     def parse(self, reader, pts_time):
         "Parse data using provided reader."
@@ -1663,7 +2131,7 @@ class ATSCParser(UserDataParser):
                     # http://en.wikipedia.org/wiki/EIA-608
                     if self.display:
                         log('          [CEA-608 PACKET DATA type=%d] (%02x, %02x)' % (cc_type, cc_data_1, cc_data_2))
-                    self.cc_writers[cc_type].add_data(cc_data, pts_time)
+                    self.add_cc_data(cc_type, cc_data, pts_time)
                 elif cc_type == 2 or cc_type == 3:
                     if self.display:
                         log('          [CEA-708 PACKET DATA type=%d] (%02x, %02x)' % (cc_type, cc_data_1, cc_data_2))
@@ -1683,8 +2151,8 @@ class ATSCParser(UserDataParser):
 class SCTEParser(UserDataParser):
     "Parser for SCTE-20 data that may contain CEA-608 Closed Captioning."
 
-    def __init__(self, display=False, cc_basename=None, cc_files=None):
-        UserDataParser.__init__(self, display, cc_basename, cc_files)
+    def __init__(self, display=False, cc_basename=None, cc_files=None, metrics=None, scc_frame_rate='30'):
+        UserDataParser.__init__(self, display, cc_basename, cc_files, metrics, scc_frame_rate)
         self.format = "SCTE"
 
     def parse(self, reader, pts_time):
@@ -1707,7 +2175,7 @@ class SCTEParser(UserDataParser):
                     cc_bits_2 = invtab[cc_data_2]
                     if 1<= field_number <= 2:
                         if self.cc_writers:
-                            self.cc_writers[field_number-1].add_data((cc_bits_1, cc_bits_2), pts_time)
+                            self.add_cc_data(field_number-1, (cc_bits_1, cc_bits_2), pts_time)
                     else:
                         log("WARNING: Cannot handle 608 field_number=%d" % field_number)
                 non_real_time_video_count = read_bits(reader, 4, '    non_real_time_video_count', display=self.display)
@@ -1716,12 +2184,12 @@ class SCTEParser(UserDataParser):
 # H264 parser
 #
 class h264_parser:
-    def __init__(self, display=False, cc_files=None):
+    def __init__(self, display=False, cc_files=None, metrics=None, scc_frame_rate='30'):
         self.display = display
         self.construction_frame = None
         self.data = b''
         self.times = []
-        self.sei_parser = SEIParser(display, cc_files)
+        self.sei_parser = SEIParser(display, cc_files, metrics, scc_frame_rate=scc_frame_rate)
 
     def get_cc_summary(self):
         return self.sei_parser.ATSC_parser.get_cc_summary()
@@ -1751,7 +2219,7 @@ class h264_parser:
                    (data[offset + 2] == 0x00) and \
                    (data[offset + 3] == 0x01)
             if code == 1:
-                print('Nal Unit Type=', data[offset + 4] & 0x1f)
+                log('Nal Unit Type={0}'.format(data[offset + 4] & 0x1f))
             offset += 1
 
     def add_pes(self, data, pts, dts, flush=False):
@@ -1887,8 +2355,8 @@ class h264_parser:
             self.data = self.data[pos:]
 
         if sps_pps:
-            print('')
-            print('[SPS/PPS]', sps_pps)
+            log('')
+            log('[SPS/PPS] {0}'.format(sps_pps))
 
         return frames
 
@@ -1901,6 +2369,45 @@ class h264_parser:
     def close(self):
         self.sei_parser.close()
 
+#
+# HEVC parser
+#
+NAL_START_CODE = b'\x00\x00\x01'
+HEVC_NAL_PREFIX_SEI = 39
+
+class hevc_parser:
+    """Parser of HEVC video PES, passing the captions in prefix SEI NAL units to the SEI parser.
+
+    Only the prefix SEI NAL units are parsed, found with bytes.find. NAL units are not
+    reassembled across PES, as a PES carries whole access units."""
+
+    def __init__(self, display=False, cc_files=None, metrics=None, scc_frame_rate='30'):
+        self.display = display
+        self.sei_parser = SEIParser(display, cc_files, metrics, codec='HEVC', scc_frame_rate=scc_frame_rate)
+
+    def get_cc_summary(self):
+        return self.sei_parser.ATSC_parser.get_cc_summary()
+
+    def add_pes(self, data, pts, dts):
+        if not self.sei_parser.ATSC_parser.has_pts_offset():
+            self.sei_parser.ATSC_parser.set_pts_offset(pts)
+
+        position = data.find(NAL_START_CODE)
+        while position >= 0:
+            header = position + 3
+            next_position = data.find(NAL_START_CODE, header)
+            # forbidden_zero_bit, nal_unit_type(6), nuh_layer_id(6), nuh_temporal_id_plus1(3)
+            if header + 2 < len(data) and (data[header] >> 1) & 0x3f == HEVC_NAL_PREFIX_SEI:
+                end = next_position if next_position >= 0 else len(data)
+                if self.display:
+                    log('[HEVC NAL] type={0} ({1} bytes)'.format(HEVC_NAL_PREFIX_SEI, end - header))
+                self.sei_parser.parse(data[header:end], pts, header_size=2)
+            position = next_position
+        return []
+
+    def close(self):
+        self.sei_parser.close()
+
 SampleRates = {0 : 96000,
                1 : 88200,
                2 : 64000,
@@ -2521,7 +3028,7 @@ class id3_parser:
         log('  size={0} means {1}'.format(size, size2))
 
         if size > 1000000:
-            print('BAD ID3 size')
+            logger.warning('BAD ID3 size')
             return
 
         while reader.tell() < len(data):
@@ -2601,17 +3108,10 @@ class metadata_parser:
 # Parser observer
 #
 class parser_observer(observer):
-    def __init__(self, options={}, cc_files=None):
-        self.mpeg_video_pid = -1
-        self.mpeg_audio_pid = -1
-        self.h264_pid = -1
-        self.aac_pid = -1
-        self.ac3_pid = -1
-        self.teletext_pid = -1
-        self.dvb_pid = -1
-        self.metadata_pid = -1
-        self.scte35_pids = set()
+    def __init__(self, options={}, cc_files=None, metrics=None):
+        self.reset_pids()
         self.options = options
+        self.metrics = metrics if metrics is not None else Metrics()
 
         # If video data should be logged
         if 'video' in options:
@@ -2631,9 +3131,15 @@ class parser_observer(observer):
         else:
             self.text_display = False
 
-        # Create some codec parsers
-        self.h264_parser = h264_parser(display=self.video_display, cc_files=cc_files)
-        self.mpeg_video_parser = mpeg_video_parser(display=self.video_display, cc_files=cc_files)
+        # Create some codec parsers, whose SCC files have timecodes at the scc_frame_rate option
+        scc_frame_rate = options.get('scc_frame_rate', '30')
+        self.h264_parser = h264_parser(display=self.video_display, cc_files=cc_files, metrics=self.metrics,
+                                       scc_frame_rate=scc_frame_rate)
+        self.hevc_parser = hevc_parser(display=self.video_display, cc_files=cc_files, metrics=self.metrics,
+                                       scc_frame_rate=scc_frame_rate)
+        self.mpeg_video_parser = mpeg_video_parser(display=self.video_display, cc_files=cc_files,
+                                                   metrics=self.metrics, frames=options['verbose'] > 0,
+                                                   picture_info=True, scc_frame_rate=scc_frame_rate)
         self.aac_parser = aac_parser_adts(display=self.audio_display)
         self.ac3_parser = ac3_parser(display=self.audio_display)
         self.mpeg_audio_parser = mpeg_audio_parser(display=self.audio_display)
@@ -2641,7 +3147,28 @@ class parser_observer(observer):
     def on_pat(self, pat):
         pass
 
+    def reset_pids(self):
+        "Observe no streams."
+        self.mpeg_video_pid = -1
+        self.mpeg_audio_pid = -1
+        self.h264_pid = -1
+        self.hevc_pid = -1
+        self.aac_pid = -1
+        self.ac3_pid = -1
+        self.teletext_pid = -1
+        self.dvb_pid = -1
+        self.metadata_pid = -1
+        self.scte35_pids = set()
+
     def on_pmt(self, importer, pmt):
+        """Observe the streams of the PMT, instead of the streams of an earlier version.
+
+        The H.264 parser is flushed if its stream is gone. The other parsers keep no data between PES,
+        and all parsers keep their SCC writers, so the captions continue in the new streams."""
+        elementary_pids = set(stream.elementary_pid for stream in pmt.stream_list)
+        if self.h264_pid != -1 and self.h264_pid not in elementary_pids:
+            self.flush()
+        self.reset_pids()
         for stream in pmt.stream_list:
             if stream.stream_type in (STREAM_TYPE_MPEG1_VIDEO, STREAM_TYPE_MPEG2_VIDEO, STREAM_TYPE_MPEG2_VIDEO_2):
                 self.mpeg_video_pid = stream.elementary_pid
@@ -2653,6 +3180,9 @@ class parser_observer(observer):
                 self.h264_pid = stream.elementary_pid
                 importer.observe_pid(stream.elementary_pid)
                 #pass
+            elif stream.stream_type == STREAM_TYPE_HEVC:
+                self.hevc_pid = stream.elementary_pid
+                importer.observe_pid(stream.elementary_pid)
             elif stream.stream_type == STREAM_TYPE_AAC or stream.stream_type == STREAM_TYPE_AUDIO_ADTS:
                 self.aac_pid = stream.elementary_pid
                 importer.observe_pid(stream.elementary_pid)
@@ -2678,9 +3208,29 @@ class parser_observer(observer):
                             self.dvb_pid = stream.elementary_pid
                             importer.observe_pid(stream.elementary_pid)
 
+    def get_stage(self, pid):
+        "Metrics stage of the parser of pid."
+        for stage, stage_pid in (('mpeg_video', self.mpeg_video_pid), ('h264', self.h264_pid),
+                                 ('hevc', self.hevc_pid),
+                                 ('mpeg_audio', self.mpeg_audio_pid), ('aac', self.aac_pid),
+                                 ('ac3', self.ac3_pid), ('teletext', self.teletext_pid),
+                                 ('dvb_subtitle', self.dvb_pid), ('metadata', self.metadata_pid)):
+            if pid == stage_pid:
+                return stage
+        return 'other_pes'
+
     def on_pes(self, pid, pes):
+        previous_stage = self.metrics.switch(self.get_stage(pid))
+        try:
+            self.parse_pes(pid, pes)
+        finally:
+            self.metrics.switch(previous_stage)
+
+    def parse_pes(self, pid, pes):
         if pid == self.mpeg_video_pid:
-            frames = self.mpeg_video_parser.add_pes(pes.payload, pes.pts, pes.dts)
+            # -1 if the PES has no PTS, so that the PTS of its pictures is found from earlier pictures
+            pts = pes.pts if pes.pts_dts_indicator & 0x02 else -1
+            frames = self.mpeg_video_parser.add_pes(pes.payload, pts, pes.dts)
             if self.options['verbose'] > 0:
                 for frame in frames:
                     log(frame)
@@ -2694,6 +3244,8 @@ class parser_observer(observer):
             if self.options['verbose'] > 0:
                 for frame in frames:
                     log(frame)
+        elif pid == self.hevc_pid:
+            self.hevc_parser.add_pes(pes.payload, pes.pts, pes.dts)
         elif pid == self.aac_pid:
             frames = self.aac_parser.add_pes(pes.payload, pes.pts, pes.dts)
             if self.options['verbose'] > 0:
@@ -2717,53 +3269,361 @@ class parser_observer(observer):
             #pass
 
     def flush(self):
+        previous_stage = self.metrics.switch('h264')
         frames = self.h264_parser.flush()
+        self.metrics.switch(previous_stage)
         if self.options['verbose'] > 0:
             for frame in frames:
                 log(frame)
 
     def close(self):
+        previous_stage = self.metrics.switch('scc_write')
         self.h264_parser.close()
+        self.hevc_parser.close()
         self.mpeg_video_parser.close()
+        self.metrics.switch(previous_stage)
 
 
     def get_scte35_pids(self):
         return self.scte35_pids
 
+    def get_pids(self):
+        "PIDs of the streams parsed by this observer."
+        pids = [self.mpeg_video_pid, self.mpeg_audio_pid, self.h264_pid, self.hevc_pid, self.aac_pid,
+                self.ac3_pid, self.teletext_pid, self.dvb_pid, self.metadata_pid]
+        return [pid for pid in pids if pid != -1]
+
+    def get_video_pids(self):
+        "PIDs of the video streams, which carry the captions."
+        return [pid for pid in (self.mpeg_video_pid, self.h264_pid, self.hevc_pid) if pid != -1]
+
+    def get_cc_writers(self):
+        "List of (video codec, SCC writer) of the fields of every caption source."
+        cc_writers = []
+        for video, parser in (("MPEG2", self.mpeg_video_parser.ATSC_parser),
+                              ("MPEG2", self.mpeg_video_parser.SCTE_parser),
+                              ("H.264", self.h264_parser.sei_parser.ATSC_parser),
+                              ("HEVC", self.hevc_parser.sei_parser.ATSC_parser)):
+            cc_writers.extend((video, writer) for writer in parser.cc_writers)
+        return cc_writers
+
+    def get_cc_summaries(self):
+        "List of (video codec, CC summary) of the video streams with captions."
+        cc_summaries = []
+        for video, parser in (("MPEG2", self.mpeg_video_parser), ("H.264", self.h264_parser),
+                              ("HEVC", self.hevc_parser)):
+            cc_summary = parser.get_cc_summary()
+            if cc_summary:
+                cc_summaries.append((video, cc_summary))
+        return cc_summaries
+
+#
+# Program observer
+#
+class program_observer(observer):
+    """Observer of the programs of a multi-program TS, with a parser_observer per program.
+
+    The programs share the packet parsing, but have their own codec parsers and SCC writers.
+    The SCC files of each program are appended to cc_files[program number], and
+    service_names[program number] is the name in the SDT, if there is one."""
 
-def handle_file(file, progress_callback=None, cc_files=None, **options):
+    def __init__(self, options={}, metrics=None):
+        self.options = options
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.programs = {}
+        self.cc_files = {}
+        self.service_names = {}
+        # Observers of the programs of each PID, as PIDs may be shared between programs
+        self.pid_observers = {}
+
+    def on_pmt(self, importer, pmt):
+        program = self.programs.get(pmt.program_num)
+        if program is None:
+            cc_files = self.cc_files[pmt.program_num] = []
+            program = self.programs[pmt.program_num] = parser_observer(self.options, cc_files, self.metrics)
+        else:
+            # A new version of the PMT
+            for pid in program.get_pids():
+                self.pid_observers[pid].remove(program)
+        program.on_pmt(importer, pmt)
+        for pid in program.get_pids():
+            observers = self.pid_observers.setdefault(pid, [])
+            if program not in observers:
+                observers.append(program)
+
+    def on_sdt(self, sdt):
+        self.service_names.update(sdt.service_names)
+
+    def on_pes(self, pid, pes):
+        for program in self.pid_observers.get(pid, ()):
+            program.on_pes(pid, pes)
+
+    def flush(self):
+        for program in self.programs.values():
+            program.flush()
+
+    def close(self):
+        for program in self.programs.values():
+            program.close()
+
+    def get_pids(self):
+        return [pid for pid, observers in self.pid_observers.items() if observers]
+
+    def get_scte35_pids(self):
+        scte35_pids = set()
+        for program in self.programs.values():
+            scte35_pids.update(program.get_scte35_pids())
+        return scte35_pids
+
+    def get_video_pids(self):
+        return [pid for pid in self.get_pids() if any(pid in program.get_video_pids()
+                                                      for program in self.pid_observers[pid])]
+
+    def get_cc_summaries(self):
+        cc_summaries = []
+        for program_num, program in self.programs.items():
+            for video, cc_summary in program.get_cc_summaries():
+                cc_summaries.append(("%s, program %d" % (video, program_num), cc_summary))
+        return cc_summaries
+
+
+def get_remaining_size(file):
+    "Number of bytes from the current position to the end of file, or None if unknown."
+    try:
+        file_stat = os.fstat(file.fileno())
+        if stat.S_ISREG(file_stat.st_mode):
+            return max(0, file_stat.st_size - file.tell())
+    except (AttributeError, OSError, ValueError):
+        pass
+    try:
+        position = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        file.seek(position)
+        return max(0, size - position)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+# Bytes read at each bisection step when looking for a video PTS
+SEEK_SAMPLE_SIZE = 188 * 4096
+# Video streams in a PMT, in order of preference
+VIDEO_STREAM_TYPES = (STREAM_TYPE_H264, STREAM_TYPE_HEVC, STREAM_TYPE_MPEG2_VIDEO, STREAM_TYPE_MPEG2_VIDEO_2,
+                      STREAM_TYPE_MPEG1_VIDEO)
+# Parsed beyond the end of a time range, as PES are not in presentation order
+END_MARGIN = timecode.PTS_CLOCK
+
+class ts_seeker:
+    """Find byte offsets of video PTS values in a seekable TS file by bisection.
+
+    Offsets are packet aligned and relative to the position of the file when created.
+    PTS values are compared relative to the first video PTS, so a wrap-around is handled."""
+
+    def __init__(self, file, sample_size=SEEK_SAMPLE_SIZE):
+        self.file = file
+        self.sample_size = sample_size
+        self.start = file.tell()
+        self.size = file.seek(0, os.SEEK_END) - self.start
+        data = self.read(0, sample_size)
+        self.sync_offset = find_sync_offset(data)
+        self.num_packets = (self.size - self.sync_offset) // 188
+        video_stream = find_video_stream(data[self.sync_offset:])
+        self.video_pid = video_stream[1] if video_stream else None
+        self.first_pts = self.sample_pts(0) if self.video_pid is not None else None
+        file.seek(self.start)
+
+    def read(self, offset, size):
+        self.file.seek(self.start + offset)
+        return self.file.read(size)
+
+    def sample_pts(self, packet_index):
+        "Return the PTS of the first video PES starting at or after the packet, or None."
+        data = self.read(self.sync_offset + packet_index * 188, self.sample_size)
+        video_pid = self.video_pid
+        for offset in range(0, len(data) - 187, 188):
+            if data[offset] == 0x47 and data[offset + 1] & 0x40 and \
+               ((data[offset + 1] & 0x1f) << 8) | data[offset + 2] == video_pid:
+                timestamps = read_pes_timestamps(data, offset)
+                if timestamps is not None:
+                    return timestamps[0]
+        return None
+
+    def find_offset(self, pts, after=False):
+        """Return the offset of a packet at most one sample before the first video PES with a PTS
+        after pts, or with after=True, an offset at most one sample after it."""
+        first_pts = self.first_pts
+        target = (pts - first_pts) % timecode.PTS_WRAP
+        if target >= timecode.PTS_WRAP // 2:
+            # Before the first PTS
+            return self.start + self.sync_offset
+        low = 0
+        high = self.num_packets
+        sample_packets = self.sample_size // 188
+        while high - low > sample_packets:
+            middle = (low + high) // 2
+            sample = self.sample_pts(middle)
+            if sample is None:
+                # No video PES in the sample, keep the range wide
+                is_after = not after
+            else:
+                is_after = (sample - first_pts) % timecode.PTS_WRAP > target
+            if is_after:
+                high = middle
+            else:
+                low = middle
+        packet_index = high if after else low
+        return self.start + self.sync_offset + packet_index * 188
+
+
+def find_sync_offset(data):
+    "Return the offset of the first of two consecutive sync bytes, or 0."
+    for offset in range(min(188, len(data))):
+        if data[offset] == 0x47 and (offset + 188 >= len(data) or data[offset + 188] == 0x47):
+            return offset
+    return 0
+
+
+def find_video_stream(data):
+    """Return (stream type, PID) of the video stream in the first PMT in data, or None.
+
+    The PAT and PMT sections are reassembled across packets and checked by a section_assembler."""
+    pmt_pid = None
+    sections = section_assembler()
+    for offset in range(0, len(data) - 187, 188):
+        pid = ((data[offset + 1] & 0x1f) << 8) | data[offset + 2]
+        if pid != PAT_PID and pid != pmt_pid:
+            continue
+        for section in sections.add_packet(ts_packet(data[offset:offset+188])):
+            if pid == PAT_PID and pmt_pid is None:
+                for info in pat(section_packet_data(pid, section)).pmt_info:
+                    if info.program_num:
+                        pmt_pid = info.program_pid
+                        break
+            elif pid == pmt_pid:
+                pids = dict((stream.stream_type, stream.elementary_pid)
+                            for stream in pmt(section_packet_data(pid, section)).stream_list)
+                for stream_type in VIDEO_STREAM_TYPES:
+                    if stream_type in pids:
+                        return stream_type, pids[stream_type]
+                return None
+    return None
+
+
+def read_pes_timestamps(data, offset):
+    "Return (PTS, DTS) of the PES header starting in the TS packet at offset, or None without PTS."
+    payload = offset + 4
+    if data[offset + 3] & 0x20:
+        payload += 1 + data[offset + 4]
+    if payload + 14 > offset + 188 or data[payload:payload+3] != b'\x00\x00\x01' or \
+       not data[payload + 7] & 0x80:
+        return None
+    pts = read_timestamp(data, payload + 9)
+    if data[payload + 7] & 0x40 and payload + 19 <= offset + 188:
+        return pts, read_timestamp(data, payload + 14)
+    return pts, pts
+
+
+def read_timestamp(data, p):
+    return ((data[p] >> 1) & 0x07) << 30 | data[p + 1] << 22 | (data[p + 2] >> 1) << 15 | \
+        data[p + 3] << 7 | data[p + 4] >> 1
+
+
+def has_time_range(options):
+    "Return True if the options limit the extraction to a time range."
+    return any(options[key] is not None for key in ('start', 'end', 'start_pts', 'end_pts'))
+
+
+def find_time_range(file, options, seeker=None):
+    """Return (start_offset, end_offset, start_pts, end_pts) of the start/end options.
+
+    start and end are seconds from the first video PTS, start_pts and end_pts are PTS values.
+    The start offset includes options['preroll'] seconds before the start, so that the CEA-608
+    state is complete at the start. end_offset and end_pts are None if no end is given.
+    seeker finds the offsets, by default a ts_seeker bisecting the file, else e.g. a tsindex.TsIndex."""
+    if seeker is None:
+        seeker = ts_seeker(file)
+    if seeker.first_pts is None:
+        raise ValueError('No video PTS found at the start of the file')
+    start_pts = options['start_pts']
+    if start_pts is None:
+        start_pts = seeker.first_pts + int(round((options['start'] or 0) * timecode.PTS_CLOCK))
+    end_pts = options['end_pts']
+    if end_pts is None and options['end'] is not None:
+        end_pts = seeker.first_pts + int(round(options['end'] * timecode.PTS_CLOCK))
+    start_pts %= timecode.PTS_WRAP
+
+    preroll = int(options['preroll'] * timecode.PTS_CLOCK)
+    start_offset = seeker.find_offset(start_pts - preroll)
+    end_offset = None
+    if end_pts is not None:
+        end_pts %= timecode.PTS_WRAP
+        if not 0 < (end_pts - start_pts) % timecode.PTS_WRAP < timecode.PTS_WRAP // 2:
+            raise ValueError('End of the time range is not after the start')
+        end_offset = seeker.find_offset(end_pts + END_MARGIN, after=True)
+    return start_offset, end_offset, start_pts, end_pts
+
+
+def handle_file(file, progress_callback=None, cc_files=None, metrics=None, seeker=None, program_files=None,
+                **options):
+    """Parse a TS file, appending SCC files to cc_files. Returns the metrics of the parsing.
+
+    The 'programs' option selects the programs, see ts_importer._handle_pat. The SCC files of all of
+    them are appended to cc_files, and if program_files is a dict, it is filled with
+    {program number: {'service_name': name in the SDT or None, 'files': SCC files of the program}}.
+
+    progress_callback is called with the number of bytes parsed and the size of the file,
+    which is None if it is unknown. seeker is used to find the time range options, see find_time_range."""
     if isinstance(file, str):
         file = open(file, 'rb')
 
     nr_bytes_to_read = -1
-    observer = parser_observer(options, cc_files=cc_files)
-    importer = ts_importer(observer, options, log_cc=options['log_cc'])
+    time_range = None
+    if has_time_range(options):
+        start_offset, end_offset, start_pts, end_pts = find_time_range(file, options, seeker)
+        time_range = (start_pts, end_pts)
+        file.seek(start_offset)
+        if end_offset is not None:
+            nr_bytes_to_read = end_offset - start_offset
+
+    report_progress = None
+    if progress_callback:
+        total_bytes = get_remaining_size(file)
+        if total_bytes is not None and nr_bytes_to_read >= 0:
+            total_bytes = min(total_bytes, nr_bytes_to_read)
+
+        def report_progress(num_bytes):
+            progress_callback(num_bytes, total_bytes)
+
+    if metrics is None:
+        metrics = Metrics()
+    observer = program_observer(options, metrics=metrics)
+    importer = ts_importer(observer, options, log_cc=options['log_cc'], metrics=metrics)
     
     with file as f:
         bytes = 188 * 100000
         #f.read(24)
         if nr_bytes_to_read > 0:
             bytes = min(bytes, nr_bytes_to_read)
+        metrics.switch('read')
         data = f.read(bytes)
         nr_bytes_to_read -= len(data)
-        try:
-            importer.preflight(data)
-        except Exception as e:
-            print('preflight error:', e)
-            importer.report()
-            return
+        importer.add_data(data, report_progress)
+        if not importer.pmts:
+            logger.error('Could not find pat/pmt in the first %d bytes', len(data))
+            importer.update_metrics()
+            metrics.stop()
+            return metrics
 
         num_bytes = len(data)
-        importer.add_data(data, progress_callback)
 
         done = False
         while not done:
             if nr_bytes_to_read >= 0:
                 bytes = min(bytes, nr_bytes_to_read)
+            metrics.switch('read')
             data = f.read(bytes)
             num_bytes += len(data)
             nr_bytes_to_read -= len(data)
-            importer.add_data(data)
+            importer.add_data(data, report_progress)
             if nr_bytes_to_read == 0 or len(data) != bytes:
                 done = True
         importer.flush()
@@ -2773,3 +3633,167 @@ def handle_file(file, progress_callback=None, cc_files=None, **options):
         importer.report()
 
     importer.close()
+
+    for program_num, files in observer.cc_files.items():
+        if time_range:
+            preroll = int(options['preroll'] * timecode.PTS_CLOCK)
+            clipped_files = [cc_file.clip(time_range[0], time_range[1], preroll) for cc_file in files]
+            files[:] = [cc_file for cc_file in clipped_files if cc_file.line_ends]
+        if cc_files is not None:
+            cc_files.extend(files)
+        if program_files is not None:
+            program_files[program_num] = {'service_name': observer.service_names.get(program_num),
+                                          'files': files}
+
+    metrics.stop()
+    return metrics
+
+
+# Number of evenly spaced samples of a file parsed by probe_file
+PROBE_SAMPLES = 5
+# Seconds of each sample
+PROBE_SECONDS = 1.0
+# Size of a sample if the duration of the file is unknown
+PROBE_SAMPLE_SIZE = 188 * 4096
+# Packets kept at the start of each video PES, where the SEI or user data with captions are
+PROBE_PES_PACKETS = 16
+PROBE_CHUNK_SIZE = 188 * 1024
+
+class pes_head_filter:
+    """Filter of TS packets, keeping all packets of the PIDs in pids, and of the video PIDs in video_pids
+    only the first max_packets packets of each PES, unless its length is given.
+
+    The data given to filter must start with a packet."""
+
+    def __init__(self, max_packets=PROBE_PES_PACKETS):
+        self.max_packets = max_packets
+        self.pids = set()
+        self.video_pids = set()
+        # Packets still kept of the current PES, per video PID
+        self.remaining = {}
+
+    def reset(self):
+        "Drop the PES of the video PIDs until their next start."
+        self.remaining = {}
+
+    def filter(self, data):
+        "Return the packets of data that are kept."
+        pids = self.pids
+        video_pids = self.video_pids
+        remaining = self.remaining
+        kept = []
+        for offset in range(0, len(data) - 187, 188):
+            pid = ((data[offset + 1] & 0x1f) << 8) | data[offset + 2]
+            if pid in video_pids:
+                if data[offset + 1] & 0x40:
+                    count = self.max_packets
+                    payload = offset + 4
+                    if data[offset + 3] & 0x20:
+                        payload += 1 + data[offset + 4]
+                    if payload + 6 <= offset + 188:
+                        pes_packet_length = (data[payload + 4] << 8) | data[payload + 5]
+                        # The PES parser checks bounded PES, so they are kept whole
+                        count = max(count, pes_packet_length // 184 + 2)
+                else:
+                    count = remaining.get(pid, 0)
+                if count:
+                    remaining[pid] = count - 1
+                    kept.append(data[offset:offset+188])
+            elif pid in pids:
+                kept.append(data[offset:offset+188])
+        return b''.join(kept)
+
+
+def probe_offsets(file, samples, seconds):
+    """Return the (offset, size) of evenly spaced samples of seconds each of a seekable TS file, the first one
+    at its start. The offsets are packet aligned. Returns None if the file is not seekable."""
+    try:
+        seeker = ts_seeker(file)
+    except (AttributeError, OSError, ValueError):
+        return None
+    num_packets = seeker.num_packets
+    sample_packets = PROBE_SAMPLE_SIZE // 188
+    if seeker.first_pts is not None:
+        last_pts = seeker.sample_pts(max(0, num_packets - seeker.sample_size // 188))
+        if last_pts is not None:
+            duration = ((last_pts - seeker.first_pts) % timecode.PTS_WRAP) / timecode.PTS_CLOCK
+            if duration > 0:
+                sample_packets = max(1, int(num_packets * seconds / duration))
+    start = seeker.start + seeker.sync_offset
+    if samples < 2 or samples * sample_packets >= num_packets:
+        return [(start, min(samples * sample_packets, num_packets) * 188)]
+    last_sample = num_packets - sample_packets
+    return [(start + last_sample * i // (samples - 1) * 188, sample_packets * 188) for i in range(samples)]
+
+
+def probe_file(file, samples=PROBE_SAMPLES, seconds=PROBE_SECONDS, metrics=None, **options):
+    """Parse evenly spaced samples of a TS file for captions, and return a summary of the captions found.
+
+    Only the PSI and the start of each video PES are parsed. A file that is not seekable is parsed from its
+    position, for as many bytes as the samples would take if its duration were unknown.
+    The 'programs' option selects the programs, see ts_importer._handle_pat. The summary is:
+    {'samples': number of samples, 'bytes_read': ..., 'has_captions': whether caption data other than padding
+     was found, 'programs': {program number: {'service_name': name in the SDT or None, 'captions': [
+        {'source': 'EMBEDDED' | 'ATSC' | 'SCTE', 'video': 'H.264' | 'HEVC' | 'MPEG2', 'field': 1 | 2,
+         'channels': ['CC1', ...], 'caption_pairs': ..., 'padding_pairs': ...}]}}}"""
+    if metrics is None:
+        metrics = Metrics()
+    observer = program_observer(options, metrics=metrics)
+    # Continuity is broken by the filtering
+    importer = ts_importer(observer, dict(options, check_cc=False), metrics=metrics)
+    head_filter = pes_head_filter()
+
+    sample_offsets = probe_offsets(file, samples, seconds)
+    if sample_offsets is None:
+        sample_offsets = [(None, samples * PROBE_SAMPLE_SIZE)]
+    bytes_read = 0
+    for i, (offset, size) in enumerate(sample_offsets):
+        if offset is not None:
+            file.seek(offset)
+        if i:
+            importer.skip()
+            head_filter.reset()
+        while size > 0:
+            metrics.switch('read')
+            data = file.read(min(size, PROBE_CHUNK_SIZE))
+            if not data:
+                break
+            size -= len(data)
+            bytes_read += len(data)
+            if importer.pmts:
+                metrics.switch('pes_head_filter')
+                head_filter.pids = set((PAT_PID, SDT_PID)) | set(importer.pmt_pids)
+                head_filter.video_pids = set(observer.get_video_pids())
+                data = head_filter.filter(data)
+            # Until the PMTs are found, the importer keeps the packets of the streams
+            importer.add_data(data)
+    importer.flush()
+    importer.close()
+    metrics.stop()
+
+    programs = {}
+    for program_num, program in observer.programs.items():
+        captions = []
+        for video, writer in program.get_cc_writers():
+            processor = writer.cea608_field_processor
+            data_counters = processor.data_counters
+            caption_pairs = (data_counters['char'] + data_counters['cmd'] + data_counters['other']) // 2
+            padding_pairs = data_counters['padding'] // 2
+            if caption_pairs or padding_pairs:
+                captions.append({
+                    'source': writer.base_name,
+                    'video': video,
+                    'field': writer.channel + 1,
+                    'channels': ['CC%d' % (2 * writer.channel + channel)
+                                 for channel in sorted(processor.used_channels)],
+                    'caption_pairs': caption_pairs,
+                    'padding_pairs': padding_pairs,
+                })
+        programs[program_num] = {'service_name': observer.service_names.get(program_num), 'captions': captions}
+    return {
+        'samples': len(sample_offsets),
+        'bytes_read': bytes_read,
+        'has_captions': any(caption['caption_pairs'] for program in programs.values()
+                            for caption in program['captions']),
+        'programs': programs,
+    }
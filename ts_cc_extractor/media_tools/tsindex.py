@@ -0,0 +1,227 @@
+"""Index of the video PES of a TS file, kept in a .tsidx sidecar file.
+
+For every video PES start the index has the byte offset, PTS, DTS and a keyframe flag, as arrays.
+Offsets of a time range are found by bisection of the DTS, without reading the TS file.
+The sidecar has the size and modification time of the TS file, and is rebuilt when they change.
+"""
+
+import bisect
+import logging
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+from . import ts
+from .timecode import PTS_WRAP
+
+SUFFIX = '.tsidx'
+MAGIC = b'TSIDX\x01'
+# Magic, TS file size, TS file mtime in ns, video PID, video stream type, number of PES
+HEADER = struct.Struct('<6sqqHBI')
+NO_PID = 0x1fff
+READ_SIZE = 188 * 100000
+
+logger = logging.getLogger(__name__)
+
+
+class TsIndex(object):
+    "Byte offsets, PTS, DTS and keyframe flags of the video PES of a TS file."
+
+    def __init__(self, size=0, mtime_ns=0, video_pid=None, stream_type=0):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.video_pid = video_pid
+        self.stream_type = stream_type
+        self.offsets = array('q')
+        # PTS and DTS are unwrapped, so they keep increasing after a wrap-around
+        self.pts = array('q')
+        self.dts = array('q')
+        self.keyframes = array('B')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def first_pts(self):
+        return self.pts[0] if self.pts else None
+
+    def add(self, offset, pts, dts, keyframe):
+        "Add a PES in decoding order, with PTS and DTS as read from the PES header."
+        if self.dts:
+            last_dts = self.dts[-1]
+            dts = last_dts + unwrap(dts - last_dts)
+        pts = dts + unwrap(pts - dts)
+        self.offsets.append(offset)
+        self.pts.append(pts)
+        self.dts.append(dts)
+        self.keyframes.append(1 if keyframe else 0)
+
+    def find_offset(self, pts, after=False):
+        """Return the offset of the last keyframe decoded at or before pts,
+        or with after=True, the offset of the first PES decoded after pts."""
+        if not self.offsets:
+            return self.size if after else 0
+        target = self.pts[0] + unwrap(pts - self.pts[0])
+        index = bisect.bisect_right(self.dts, target)
+        if after:
+            return self.offsets[index] if index < len(self.offsets) else self.size
+        if index == 0:
+            return 0
+        index -= 1
+        keyframe = index
+        while keyframe >= 0 and not self.keyframes[keyframe]:
+            keyframe -= 1
+        return self.offsets[keyframe if keyframe >= 0 else index]
+
+    def is_valid(self, path):
+        "Return True if the index matches the size and modification time of the TS file at path."
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return False
+        return file_stat.st_size == self.size and file_stat.st_mtime_ns == self.mtime_ns
+
+    def save(self, path):
+        """Write the index to path, replacing it atomically.
+
+        The data is written to a temporary file of its own, so that concurrent saves do not mix."""
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(path) + '.',
+                                        dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, self.size, self.mtime_ns,
+                                    NO_PID if self.video_pid is None else self.video_pid,
+                                    self.stream_type, len(self.offsets)))
+                for values in (self.offsets, self.pts, self.dts, self.keyframes):
+                    write_array(f, values)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @classmethod
+    def load(cls, path):
+        "Read an index written by save. Raises ValueError if it is not an index."
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise ValueError('Truncated index %s' % path)
+            magic, size, mtime_ns, video_pid, stream_type, count = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError('Not an index: %s' % path)
+            index = cls(size, mtime_ns, None if video_pid == NO_PID else video_pid, stream_type)
+            for values in (index.offsets, index.pts, index.dts, index.keyframes):
+                read_array(f, values, count)
+        return index
+
+
+def unwrap(delta):
+    "Return a PTS difference in the range [-2^32, 2^32)."
+    return (delta + PTS_WRAP // 2) % PTS_WRAP - PTS_WRAP // 2
+
+
+def write_array(f, values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+
+def read_array(f, values, count):
+    try:
+        values.fromfile(f, count)
+    except EOFError:
+        raise ValueError('Truncated index %s' % f.name)
+    if sys.byteorder == 'big':
+        values.byteswap()
+
+
+def is_keyframe(data, offset, stream_type):
+    "Return True if the PES starting in the TS packet at offset starts with a keyframe."
+    adaptation_field_length = data[offset + 4] if data[offset + 3] & 0x20 else -1
+    if adaptation_field_length > 0 and data[offset + 5] & 0x40:
+        # Random access indicator
+        return True
+    payload = offset + 5 + adaptation_field_length
+    es_start = payload + 9 + data[payload + 8]
+    es = data[es_start:offset + 188]
+    if stream_type == ts.STREAM_TYPE_H264:
+        position = es.find(b'\x00\x00\x01')
+        while 0 <= position < len(es) - 3:
+            nal_unit_type = es[position + 3] & 0x1f
+            if nal_unit_type == 5:
+                return True
+            if 1 <= nal_unit_type <= 4:
+                return False
+            position = es.find(b'\x00\x00\x01', position + 3)
+    elif stream_type == ts.STREAM_TYPE_HEVC:
+        position = es.find(b'\x00\x00\x01')
+        while 0 <= position < len(es) - 3:
+            nal_unit_type = (es[position + 3] >> 1) & 0x3f
+            if 16 <= nal_unit_type <= 23:
+                # IRAP picture
+                return True
+            if nal_unit_type < 16:
+                return False
+            position = es.find(b'\x00\x00\x01', position + 3)
+    elif stream_type:
+        position = es.find(b'\x00\x00\x01\x00')
+        if 0 <= position < len(es) - 5:
+            return (es[position + 5] >> 3) & 0x07 == 1
+    return False
+
+
+def build_index(file, size=0, mtime_ns=0):
+    "Scan the TS file from its current position and return its TsIndex. Offsets are from that position."
+    data = file.read(READ_SIZE)
+    sync_offset = ts.find_sync_offset(data)
+    video_stream = ts.find_video_stream(data[sync_offset:])
+    if video_stream is None:
+        return TsIndex(size, mtime_ns)
+    stream_type, video_pid = video_stream
+    index = TsIndex(size, mtime_ns, video_pid, stream_type)
+    position = 0
+    offset = sync_offset
+    while True:
+        end = len(data) - 187
+        while offset < end:
+            if data[offset + 1] & 0x40 and ((data[offset + 1] & 0x1f) << 8) | data[offset + 2] == video_pid \
+               and data[offset] == 0x47:
+                timestamps = ts.read_pes_timestamps(data, offset)
+                if timestamps is not None:
+                    index.add(position + offset, timestamps[0], timestamps[1],
+                              is_keyframe(data, offset, stream_type))
+            offset += 188
+        more_data = file.read(READ_SIZE)
+        if not more_data:
+            return index
+        position += offset
+        data = data[offset:] + more_data
+        offset = 0
+
+
+def get_index(path):
+    """Return the index of the TS file at path, from its sidecar if it is up to date.
+
+    Otherwise the index is built and the sidecar written, if the directory is writable."""
+    index_path = path + SUFFIX
+    try:
+        index = TsIndex.load(index_path)
+        if index.is_valid(path):
+            return index
+    except (OSError, ValueError):
+        pass
+
+    file_stat = os.stat(path)
+    with open(path, 'rb') as f:
+        index = build_index(f, file_stat.st_size, file_stat.st_mtime_ns)
+    try:
+        index.save(index_path)
+    except OSError as e:
+        logger.warning('Could not write index %s: %s', index_path, e)
+    return index
@@ -0,0 +1,184 @@
+"""Sidecar file of the CEA-608 byte pairs of extracted captions, as NumPy arrays.
+
+The file is an uncompressed `.npz` archive, which `numpy.load()` reads, written without NumPy.
+The arrays of all SCC files are concatenated, with one element per byte pair:
+
+- 'pts': int64, unwrapped PTS of the pair
+- 'source': uint8, index of the SCC file in 'sources'
+- 'channel': uint8, field of the pair, 0 or 1
+- 'pairs': uint16, the pair as (a << 8) | b, with parity bits
+
+and per SCC file 'sources' (its name, e.g. 'EMBEDDED'), 'source_ends' (index after its last pair)
+and 'pts_offsets' (PTS of its time 0), while 'line_ends' holds the index after the last pair of every line,
+i.e. of the pairs of a time stamp.
+The members are stored uncompressed, and the data of every array starts at a multiple of 64 bytes in the
+file, with the local headers padded by an extra field, so an array can also be memory-mapped at the offset
+of its data.
+"""
+from __future__ import annotations
+
+import ast
+import struct
+import sys
+import time
+import zipfile
+from array import array
+from typing import IO, TYPE_CHECKING, Iterable
+
+from .cache import read_exactly, write_array
+
+if TYPE_CHECKING:
+    from .media_tools.scc import SccFile
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_ALIGNMENT = 64
+# Size of a ZIP local file header without its name and extra field, and of a ZIP64 extra field
+ZIP_LOCAL_HEADER_SIZE = 30
+ZIP64_EXTRA_SIZE = 20
+# Header id of the extra field padding the local headers, unknown to readers which skip it
+PADDING_EXTRA_ID = 0x6470
+# NumPy type of the array typecodes
+DESCRS = {'q': '<i8', 'B': '|u1', 'H': '<u2'}
+# Arrays besides 'sources', and their typecode
+ARRAYS = (('pts', 'q'), ('source', 'B'), ('channel', 'B'), ('pairs', 'H'), ('line_ends', 'q'),
+          ('source_ends', 'q'), ('pts_offsets', 'q'))
+
+
+def npy_header(descr: str, length: int) -> bytes:
+    """Header of a one-dimensional .npy array, padded so that the data is aligned."""
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, length)
+    header += ' ' * (-(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_ALIGNMENT) + '\n'
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def open_member(zip_file: zipfile.ZipFile, name: str, header: bytes, size: int) -> IO[bytes]:
+    """Open a member of size bytes for writing, after writing its .npy header.
+
+    The local file header gets an extra field padding it so that the data after the .npy header
+    starts at a multiple of NPY_ALIGNMENT bytes in the file."""
+    zip_info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+    zip_info.compress_type = zipfile.ZIP_STORED
+    zip64 = size >= zipfile.ZIP64_LIMIT
+    # The offset of the local header, as ZipFile takes it
+    assert zip_file.fp is not None
+    data_offset = (zip_file.fp.tell() + ZIP_LOCAL_HEADER_SIZE + len(name.encode('ascii'))
+                   + (ZIP64_EXTRA_SIZE if zip64 else 0) + len(header))
+    # The extra field has a header of 4 bytes
+    padding = (-(data_offset + 4)) % NPY_ALIGNMENT
+    zip_info.extra = struct.pack('<HH', PADDING_EXTRA_ID, padding) + b'\0' * padding
+    f = zip_file.open(zip_info, 'w', force_zip64=zip64)
+    f.write(header)
+    return f
+
+
+def write_npy(zip_file: zipfile.ZipFile, name: str, typecode: str, chunks: Iterable[array],
+              length: int) -> None:
+    """Write the arrays of chunks as one array of length items to the archive."""
+    header = npy_header(DESCRS[typecode], length)
+    with open_member(zip_file, name + '.npy', header, len(header) + array(typecode).itemsize * length) as f:
+        for chunk in chunks:
+            write_array(f, chunk)
+
+
+def write_npz(f: IO[bytes], cc_files: list[SccFile]) -> None:
+    """Write the byte pairs of SCC files to a sidecar file.
+
+    Args:
+        f: Binary file, seekable or not
+        cc_files: SCC files, as returned by `extract_scc()`
+    """
+    num_pairs = sum(len(cc_file['pairs']) for cc_file in cc_files)
+    names = [(cc_file['name'] or '') for cc_file in cc_files]
+    width = max([len(name) for name in names] + [1])
+    # Index of the first pair of each file, and of the end
+    file_starts = [0]
+    for cc_file in cc_files:
+        file_starts.append(file_starts[-1] + len(cc_file['pairs']))
+
+    with zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as zip_file:
+        write_npy(zip_file, 'pts', 'q', (cc_file['pts'] for cc_file in cc_files), num_pairs)
+        write_npy(zip_file, 'source', 'B', (array('B', [index]) * len(cc_file['pairs'])
+                                            for index, cc_file in enumerate(cc_files)), num_pairs)
+        write_npy(zip_file, 'channel', 'B', (array('B', [cc_file['channel']]) * len(cc_file['pairs'])
+                                             for cc_file in cc_files), num_pairs)
+        write_npy(zip_file, 'pairs', 'H', (cc_file['pairs'] for cc_file in cc_files), num_pairs)
+        line_ends = (array('q', [start + end for end in cc_file.line_ends])
+                     for start, cc_file in zip(file_starts, cc_files))
+        write_npy(zip_file, 'line_ends', 'q', line_ends, sum(len(cc_file.line_ends) for cc_file in cc_files))
+        write_npy(zip_file, 'source_ends', 'q', [array('q', file_starts[1:])], len(cc_files))
+        write_npy(zip_file, 'pts_offsets', 'q', [array('q', [cc_file['pts_offset'] for cc_file in cc_files])],
+                  len(cc_files))
+        # Strings of UCS-4 characters
+        header = npy_header('<U%d' % width, len(names))
+        with open_member(zip_file, 'sources.npy', header, len(header) + 4 * width * len(names)) as npy_file:
+            for name in names:
+                npy_file.write(name.ljust(width, '\0').encode('utf-32-le'))
+
+
+def read_npy_header(f: IO[bytes]) -> tuple[str, int]:
+    """Read the header of a one-dimensional .npy array. Returns its type and length."""
+    if read_exactly(f, len(NPY_MAGIC)) != NPY_MAGIC:
+        raise ValueError('Not a .npy array of version 1.0')
+    header_length, = struct.unpack('<H', read_exactly(f, 2))
+    try:
+        header = ast.literal_eval(read_exactly(f, header_length).decode('latin1'))
+        descr, fortran_order, shape = header['descr'], header['fortran_order'], header['shape']
+    except (SyntaxError, ValueError, TypeError, KeyError):
+        raise ValueError('Invalid .npy header')
+    if fortran_order or len(shape) != 1:
+        raise ValueError('Not a one-dimensional array: %s' % (shape,))
+    return descr, shape[0]
+
+
+def read_npy(zip_file: zipfile.ZipFile, name: str, typecode: str) -> array:
+    """Read an array of the archive, which must have the type of typecode."""
+    with zip_file.open(name + '.npy') as f:
+        descr, length = read_npy_header(f)
+        if descr != DESCRS[typecode]:
+            raise ValueError('Unexpected type of %s: %s' % (name, descr))
+        values = array(typecode)
+        values.frombytes(read_exactly(f, values.itemsize * length))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def read_npz(f: IO[bytes], frame_rate: str = '30') -> list[SccFile]:
+    """Read the SCC files of a sidecar file written by `write_npz()`, with SCC timecodes at frame_rate.
+
+    Raises:
+        ValueError: If it is not such a file
+    """
+    from .media_tools.scc import SccFile
+
+    try:
+        zip_file = zipfile.ZipFile(f)
+    except zipfile.BadZipFile as e:
+        raise ValueError('Not a sidecar file: %s' % e)
+    with zip_file:
+        try:
+            arrays = {name: read_npy(zip_file, name, typecode) for name, typecode in ARRAYS}
+            with zip_file.open('sources.npy') as npy_file:
+                descr, length = read_npy_header(npy_file)
+                if not descr.startswith('<U') or not descr[2:].isdigit():
+                    raise ValueError('Unexpected type of sources: %s' % descr)
+                width = int(descr[2:])
+                names = [read_exactly(npy_file, 4 * width).decode('utf-32-le').rstrip('\0')
+                         for _ in range(length)]
+        except KeyError as e:
+            raise ValueError('Not a sidecar file: %s' % e)
+
+    cc_files = []
+    start = 0
+    line_ends = arrays['line_ends']
+    line_index = 0
+    for name, end, pts_offset in zip(names, arrays['source_ends'], arrays['pts_offsets']):
+        file_line_ends = array('L')
+        while line_index < len(line_ends) and line_ends[line_index] <= end:
+            file_line_ends.append(line_ends[line_index] - start)
+            line_index += 1
+        channel = arrays['channel'][start] if end > start else 0
+        cc_files.append(SccFile(name, channel, arrays['pts'][start:end], arrays['pairs'][start:end],
+                                pts_offset, file_line_ends, frame_rate))
+        start = end
+    return cc_files
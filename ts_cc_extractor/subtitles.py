@@ -0,0 +1,159 @@
+"""Streaming SRT and WebVTT writers of decoded CEA-608 captions.
+
+The byte pairs of an SCC file are decoded with `Cea608FieldProcessor`, and every caption is written
+as a cue as soon as it is replaced or erased, so no caption objects or subtitle text are held in memory.
+The SCC file itself is extracted beforehand, as it is also cached and written as SCC or sidecar file:
+its arrays, about 10 bytes per byte pair, are what grows with the length of the stream.
+Cue times are the PTS of the byte pairs, relative to the 'pts_offset' of the SCC file.
+The layout of the WebVTT cues is the one of the caption on the 32x15 grid of CEA-608.
+"""
+from __future__ import annotations
+
+import abc
+from typing import IO, TYPE_CHECKING
+
+from .media_tools import cea608
+
+if TYPE_CHECKING:
+    from typing import List, Tuple
+
+    from .media_tools.scc import SccFile
+
+    # Row number (1-15), column of the first character and (text, italics) runs,
+    # see CaptionScreen.get_cue_rows
+    CueRow = Tuple[int, int, List[Tuple[str, bool]]]
+
+# Duration of the last cue if the caption is still shown at the end of the data
+LAST_CUE_MS = 4000
+# Placement of the 32x15 caption grid in the safe area of the video, in percent
+SAFE_AREA_LEFT = 10
+SAFE_AREA_TOP = 5
+SAFE_AREA_WIDTH = 80
+SAFE_AREA_HEIGHT = 90
+
+VTT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+
+
+def row_blocks(rows: list[CueRow]) -> list[list[CueRow]]:
+    """Split rows into blocks of consecutive rows."""
+    blocks: list[list[CueRow]] = []
+    for row in rows:
+        if blocks and blocks[-1][-1][0] == row[0] - 1:
+            blocks[-1].append(row)
+        else:
+            blocks.append([row])
+    return blocks
+
+
+def percent(value: float) -> str:
+    """Percentage rounded to 2 decimals, without trailing zeros."""
+    return ('%.2f' % value).rstrip('0').rstrip('.') + '%'
+
+
+class SubtitleWriter(cea608.OutputFilter, abc.ABC):
+    """Base of the writers, an output filter of `Cea608Channel` writing every cue to a text file.
+
+    Args:
+        f: Text file the subtitles are written to
+        pts_offset: PTS of time 0 of the subtitles
+    """
+
+    header = ''
+
+    def __init__(self, f: IO[str], pts_offset: int):
+        self.f = f
+        self.pts_offset = pts_offset
+        self.num_cues = 0
+
+    def add_cue(self, start: int, end: int | None, rows: list[CueRow]) -> None:
+        start_ms = max(start - self.pts_offset, 0) // 90
+        end_ms = max(end - self.pts_offset, 0) // 90 if end is not None else start_ms + LAST_CUE_MS
+        if end_ms <= start_ms:
+            return
+        if not self.num_cues:
+            self.f.write(self.header)
+        self.write_cue(start_ms, end_ms, rows)
+
+    @abc.abstractmethod
+    def write_cue(self, start_ms: int, end_ms: int, rows: list[CueRow]) -> None:
+        """Write a cue of the caption rows."""
+
+
+class SrtWriter(SubtitleWriter):
+    """Writer of SubRip cues, with the text of all rows and no styling."""
+
+    def write_cue(self, start_ms: int, end_ms: int, rows: list[CueRow]) -> None:
+        lines: list[str] = []
+        for block in row_blocks(rows):
+            indent = min(column for _, column, _ in block)
+            lines.extend(' ' * (column - indent) + ''.join(text for text, _ in segments)
+                         for _, column, segments in block)
+        self.num_cues += 1
+        self.f.write('%s%d\n%s --> %s\n%s\n' % ('\n' if self.num_cues > 1 else '', self.num_cues,
+                                                self.timestamp(start_ms), self.timestamp(end_ms),
+                                                '\n'.join(lines)))
+
+    @staticmethod
+    def timestamp(ms: int) -> str:
+        seconds, ms = divmod(ms, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return '%02d:%02d:%02d,%03d' % (hours, minutes, seconds, ms)
+
+
+class VttWriter(SubtitleWriter):
+    """Writer of WebVTT cues, a cue for each block of consecutive rows, placed as on the caption grid.
+
+    Roll-up captions are written as cues of their base row, without scrolling regions.
+    """
+
+    header = 'WEBVTT\n\n'
+
+    def write_cue(self, start_ms: int, end_ms: int, rows: list[CueRow]) -> None:
+        timespan = '%s --> %s' % (self.timestamp(start_ms), self.timestamp(end_ms))
+        for block in row_blocks(rows):
+            indent = min(column for _, column, _ in block)
+            lines = ['&nbsp;' * (column - indent) + ''.join(
+                '<i>%s</i>' % text.translate(VTT_ESCAPES) if italics else text.translate(VTT_ESCAPES)
+                for text, italics in segments) for _, column, segments in block]
+            settings = 'align:left position:%s line:%s size:%s' % (
+                percent(SAFE_AREA_WIDTH * indent / cea608.NR_COLS + SAFE_AREA_LEFT),
+                percent(SAFE_AREA_HEIGHT * (block[0][0] - 1) / cea608.NR_ROWS + SAFE_AREA_TOP),
+                percent(SAFE_AREA_WIDTH - SAFE_AREA_WIDTH * indent / cea608.NR_COLS))
+            self.num_cues += 1
+            self.f.write('%s%s %s\n%s\n' % ('\n' if self.num_cues > 1 else '', timespan, settings,
+                                            '\n'.join(lines)))
+
+    @staticmethod
+    def timestamp(ms: int) -> str:
+        seconds, ms = divmod(ms, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return '%02d:%02d:%02d.%03d' % (hours, minutes, seconds, ms)
+
+
+def write_cues(scc_file: SccFile, f: IO[str], fmt: str = 'SRT') -> int:
+    """Decode the byte pairs of an SCC file and write the captions of its first channel as subtitles.
+
+    Args:
+        scc_file: SCC file, as returned by `extract_scc()`
+        f: Text file the subtitles are written to, nothing is written if there are no cues
+        fmt: Subtitles format: 'SRT' or 'VTT'
+
+    Returns:
+        The number of cues written
+    """
+    writer_class = SrtWriter if fmt.upper() == 'SRT' else VttWriter
+    writer = writer_class(f, scc_file['pts_offset'])
+    processor = cea608.Cea608FieldProcessor(scc_file['channel'], writer)
+    pairs = scc_file['pairs']
+    pts = scc_file['pts']
+    start = 0
+    for end in scc_file.line_ends:
+        line = pairs[start:end]
+        if cea608.SWAP_CODES:
+            line.byteswap()
+        processor.add_pairs(line.tobytes(), pts[start])
+        start = end
+    processor.close()
+    return writer.num_cues